@@ -0,0 +1,38 @@
+// Opens a typed array written by scope_transfer.write_npy. The wrapper of a
+// JavaScript evaluation prepends this file when the scope has typed arrays.
+//
+// Returns a flat typed array over the file's data with the array's shape in its
+// `shape` property.
+
+function __safeEvalLoadArray(path) {
+  const data = require("fs").readFileSync(path);
+  const headerLength = data.readUInt16LE(8);
+  const header = data.toString("latin1", 10, 10 + headerLength);
+  const descr = /'descr':\s*'([^']+)'/.exec(header)[1];
+  const shape = /'shape':\s*\(([^)]*)\)/.exec(header)[1]
+    .split(",")
+    .map((size) => size.trim())
+    .filter((size) => size !== "")
+    .map(Number);
+  const ArrayType = {
+    "|i1": Int8Array,
+    "|u1": Uint8Array,
+    "<i2": Int16Array,
+    "<u2": Uint16Array,
+    "<i4": Int32Array,
+    "<u4": Uint32Array,
+    "<f4": Float32Array,
+    "<f8": Float64Array,
+  }[descr];
+  const offset = data.byteOffset + 10 + headerLength;
+  const length = (data.length - 10 - headerLength) / ArrayType.BYTES_PER_ELEMENT;
+  // View the read buffer in place when it is aligned, copy it otherwise
+  const array =
+    offset % ArrayType.BYTES_PER_ELEMENT === 0
+      ? new ArrayType(data.buffer, offset, length)
+      : new ArrayType(
+          data.buffer.slice(offset, offset + length * ArrayType.BYTES_PER_ELEMENT)
+        );
+  array.shape = shape;
+  return array;
+}
@@ -0,0 +1,589 @@
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from .executor_daemon import (
+    ExecutorClient,
+    ExecutorError,
+    build_command,
+    build_service_command,
+    iter_output,
+    run_program,
+    write_program,
+)
+from .dependencies import DependencyCache, module_dockerfile
+from .image_cache import ImageCache
+from .reaper import owner_labels, sweep_orphans
+
+
+class SandboxBackend:
+    """
+    Where and how the programs of one SafeEval session run. SafeEval keeps the
+    language-specific parts (wrapping code, parsing results) and hands everything that
+    touches the sandbox to its backend:
+        prepare()   set the sandbox up, once, from SafeEval.__init__
+        execute()   run one program and yield its frames
+        start_interpreter()
+                    start a long-lived interpreter, for stateful sessions
+        is_healthy()
+        teardown()  release the sandbox without blocking the caller
+
+    Pick the backend of a deployment with SAFE_EVAL_BACKEND, see backend_class().
+    """
+
+    name = None
+
+    def __init__(self, evaluator):
+        """
+        :param evaluator: the SafeEval the backend runs programs for
+        """
+        self.evaluator = evaluator
+
+    @property
+    def volume_path(self):
+        """
+        The session directory as the programs see it, None if they cannot read it.
+        """
+        return None
+
+    def prepare(self):
+        raise NotImplementedError("Backend must implement prepare().")
+
+    def execute(self, code, interpreter, extension, time_limit):
+        """
+        Run a program and yield {"stream": "stdout" | "stderr", "data": str} and
+        {"result": bytes} frames as they are produced, then a final {"returncode"}.
+        :param code: the full program, read by the interpreter from stdin
+        :param interpreter: absolute path of the interpreter inside the sandbox
+        :param extension: file extension the interpreter expects, e.g. ".py"
+        :param time_limit: The time limit in seconds
+        """
+        raise NotImplementedError("Backend must implement execute().")
+
+    def start_interpreter(
+        self, script, memory_limit, cpu_limit, stderr=subprocess.DEVNULL
+    ):
+        """
+        Start a long-lived interpreter running script, with piped stdin and stdout.
+        It runs until its stdin is closed or the sandbox is torn down.
+        :param script: path of the program in the session directory, as the sandbox
+            sees it
+        :param memory_limit: address space limit of the interpreter in bytes
+        :param cpu_limit: CPU seconds the interpreter may use over its lifetime
+        :param stderr: where the interpreter's stderr goes, as for subprocess.Popen;
+            discarded by default, since nothing bounds what a program writes there
+        :return: the subprocess.Popen of the interpreter
+        """
+        raise NotImplementedError(
+            f"The {self.name} backend cannot start long-lived interpreters."
+        )
+
+    def is_healthy(self):
+        return True
+
+    def teardown(self, session_path):
+        """
+        Hand the session directory to the reaper. Backends with more to remove
+        override this. Must not block.
+        """
+        if session_path is not None:
+            self.evaluator.reaper.submit(None, session_path)
+
+    @classmethod
+    def sweep_orphans(cls, tmp_dir):
+        """
+        Remove what crashed processes of this backend left behind.
+        :return: dict with the removed "containers", "images" and "sessions"
+        """
+        return {"containers": [], "images": [], "sessions": []}
+
+
+class DockerBackend(SandboxBackend):
+    """
+    One long-running Docker container per session, built FROM the shared nsjail base
+    image. Programs run under nsjail inside the container, through the executor
+    daemon when it is connected and through `docker exec` otherwise.
+    """
+
+    name = "docker"
+
+    # Images are shared between sessions and only removed by the cache's LRU collection
+    image_cache = ImageCache(
+        Path(__file__).parent / ".image_cache",
+        disk_budget=int(os.getenv("SAFE_EVAL_IMAGE_CACHE_BYTES", 10 * 1024**3)),
+    )
+
+    # Downloaded pip and npm packages the module layers are installed from
+    dependency_cache = DependencyCache(
+        os.getenv("SAFE_EVAL_DEPENDENCY_CACHE")
+        or Path(__file__).parent / ".dependency_cache",
+        offline=os.getenv("SAFE_EVAL_DEPENDENCY_OFFLINE", "0") == "1",
+    )
+
+    # nsjail git revision compiled into the shared base image
+    nsjail_revision = os.getenv("SAFE_EVAL_NSJAIL_REVISION", "3.4")
+
+    # Seconds to wait for the executor daemon socket after the container started
+    executor_startup_timeout = 5
+
+    def __init__(self, evaluator):
+        super().__init__(evaluator)
+        self.container = evaluator._session_id
+        self._container_has_started = False
+        self._image_tag = None
+        self._executor = None
+        self._seccomp_path = evaluator._module_path / "settings/seccomp_profile.json"
+        self._docker_nsjail_base_command = (
+            "docker exec -i {session_id} nsjail "
+            "--user 99999 --group 99999 "
+            "--disable_proc --chroot / --really_quiet "
+            "--time_limit {time_limit} "
+        )
+
+    @property
+    def volume_path(self):
+        return "/volume"
+
+    def prepare(self):
+        docker_ps = subprocess.run("docker ps", shell=True, capture_output=True)
+        if not docker_ps.stdout.decode("utf-8").startswith("CONTAINER ID"):
+            raise Exception("Docker is not installed or have no permission to access.")
+
+        # Let the evaluator provide the Dockerfile contents
+        with self.evaluator._phase("docker_build"):
+            base_image = self.base_image()
+        with self.evaluator._phase("render"):
+            self.evaluator._create_dockerfile(base_image)
+
+        # Build the Docker image, unless an identical one is already cached, then
+        # the session's modules on top of it, one layer each
+        with self.evaluator._phase("docker_build"):
+            self._build_docker_image()
+        if self.evaluator.modules:
+            with self.evaluator._phase("modules"):
+                self._build_module_layers()
+
+        # Run the Docker container in detached mode
+        with self.evaluator._phase("docker_run"):
+            self._run_container()
+
+        # Start the in-container executor daemon; evaluations fall back to
+        # `docker exec` if it is not available
+        with self.evaluator._phase("executor_start"):
+            self._start_executor()
+
+    def execute(self, code, interpreter, extension, time_limit):
+        if self._executor is not None:
+            started = False
+            try:
+                for frame in self._executor.stream(
+                    code, interpreter, extension, time_limit
+                ):
+                    started = True
+                    yield frame
+                return
+            except ExecutorError:
+                self._executor.close()
+                self._executor = None
+                if started:
+                    raise
+
+        command = (self._docker_nsjail_base_command + interpreter + " -").format(
+            session_id=self.container, time_limit=time_limit
+        )
+        process = subprocess.Popen(
+            command,
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        try:
+            write_program(process, code)
+            for stream, data in iter_output(process):
+                yield {"stream": stream, "data": data}
+            yield {"returncode": process.wait()}
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+    def start_interpreter(
+        self, script, memory_limit, cpu_limit, stderr=subprocess.DEVNULL
+    ):
+        # Killing `docker exec` leaves the process in the container running; it ends
+        # with its stdin or with the container
+        command = build_service_command(
+            [self.evaluator.interpreter, script], memory_limit, cpu_limit
+        )
+        return subprocess.Popen(
+            ["docker", "exec", "-i", self.container] + command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+        )
+
+    def is_healthy(self):
+        """
+        Return True if the session container is still running.
+        """
+        if not self._container_has_started:
+            return False
+        result = subprocess.run(
+            ["docker", "inspect", "-f", "{{.State.Running}}", self.container],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        return (
+            result.returncode == 0 and result.stdout.decode("utf-8").strip() == "true"
+        )
+
+    def teardown(self, session_path):
+        """
+        Hand the container and the session directory over to the reaper. The image
+        stays in the image cache for the next session with the same configuration.
+        """
+        if self._executor is not None:
+            self._executor.close()
+            self._executor = None
+
+        container = None
+        if self._container_has_started:
+            self._container_has_started = False
+            container = self.container
+
+        if container is not None or session_path is not None:
+            self.evaluator.reaper.submit(container, session_path)
+
+    @classmethod
+    def sweep_orphans(cls, tmp_dir):
+        return sweep_orphans(tmp_dir, cls.image_cache.repository)
+
+    def base_image(self):
+        """
+        Return the tag of the nsjail base image the language images build FROM,
+        building it first if it is not cached yet.
+        """
+        module_path = self.evaluator._module_path
+        with open(module_path / "Dockerfile_nsjail_base.txt", "r") as f:
+            dockerfile = f.read().format(revision=self.nsjail_revision)
+        tag = self.image_cache.tag_for(dockerfile, self.nsjail_revision)
+        self.image_cache.ensure(
+            tag, lambda tag: self._docker_build_from(dockerfile, tag)
+        )
+        return tag
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _build_docker_image(self):
+        """
+        Resolve the content-addressed image for this session's Dockerfile and build
+        it only if it is not cached yet.
+        """
+        with open(self.evaluator._session_path / "Dockerfile", "r") as f:
+            dockerfile = f.read()
+        self._image_tag = self.image_cache.tag_for(dockerfile, self.nsjail_revision)
+        self.image_cache.ensure(
+            self._image_tag, lambda tag: self._docker_build_from(dockerfile, tag)
+        )
+
+    def _build_module_layers(self):
+        """
+        Fetch the session's modules into the dependency cache if they are not there
+        yet, then resolve the image that installs them on top of the language image.
+        The layers install from the cache only, so they build without a network.
+        """
+        language = self.evaluator.language
+        modules = self.evaluator.modules
+        self.dependency_cache.fetch(
+            language, self.evaluator.version, modules, self._image_tag
+        )
+        dockerfile = module_dockerfile(language, self._image_tag, modules)
+        contexts = self.dependency_cache.build_contexts(language)
+        self._image_tag = self.image_cache.tag_for(dockerfile, self.nsjail_revision)
+        self.image_cache.ensure(
+            self._image_tag,
+            lambda tag: self._docker_build_from(
+                dockerfile, tag, contexts, network="none"
+            ),
+        )
+
+    def _docker_build_from(self, dockerfile, tag, build_args=(), network="host"):
+        """
+        Build a Docker image from Dockerfile contents alone. The Dockerfile is sent on
+        stdin, so the build context is empty.
+        :param build_args: extra `docker build` arguments, e.g. named build contexts
+        :param network: network mode of the RUN instructions
+        """
+        result = subprocess.run(
+            ["docker", "build", f"--network={network}", *build_args, "-t", tag, "-"],
+            input=dockerfile.encode("utf-8"),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"Failed to build docker image: {result.stderr.decode('utf-8')}"
+            )
+
+    def _run_container(self):
+        """
+        Run the Docker container in detached mode.
+        """
+        run_cmd = (
+            f"docker run --rm --privileged "
+            f"--security-opt seccomp={self._seccomp_path} --name={self.container} "
+            f'-v "{self.evaluator._session_path}:/volume" '
+            f"{' '.join(owner_labels())} "
+            f"-d -it {self._image_tag}"
+        )
+        result = subprocess.run(
+            run_cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                "Failed to start docker container: " + result.stderr.decode("utf-8")
+            )
+        self._container_has_started = True
+
+    def _start_executor(self):
+        """
+        Copy the executor daemon into /volume, start it inside the container and
+        connect to its socket.
+        """
+        session_path = self.evaluator._session_path
+        shutil.copy(
+            self.evaluator._module_path / "executor_daemon.py",
+            session_path / ".executor_daemon.py",
+        )
+        socket_path = session_path / ".executor.sock"
+        command = [
+            "docker",
+            "exec",
+            "-d",
+            self.container,
+            "python3",
+            "/volume/.executor_daemon.py",
+            "/volume/.executor.sock",
+            "--interpreter",
+            self.evaluator.interpreter,
+            "--owner",
+            f"{os.getuid()}:{os.getgid()}",
+            "--max-time-limit",
+            str(self.evaluator.max_timelimit),
+        ]
+        # The pool's jobs can only require("fs"), so sessions with modules run every
+        # job as a node process of its own
+        if self.evaluator.node_pool and not self.evaluator.modules:
+            shutil.copy(
+                self.evaluator._module_path / "node_pool.js",
+                session_path / ".node_pool.js",
+            )
+            command += ["--node-pool", self.evaluator.interpreter]
+        if self.evaluator.zygote:
+            command += [
+                "--zygote",
+                self.evaluator.interpreter,
+                "--preload",
+                ",".join(self.evaluator.preload_modules),
+            ]
+        result = subprocess.run(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if result.returncode != 0:
+            return
+
+        deadline = time.monotonic() + self.executor_startup_timeout
+        while time.monotonic() < deadline:
+            if socket_path.exists():
+                try:
+                    self._executor = ExecutorClient(socket_path)
+                    return
+                except ExecutorError:
+                    pass
+            time.sleep(0.05)
+
+
+class HostBackend(SandboxBackend):
+    """
+    Runs programs directly on the host with the host's interpreters, without Docker.
+
+    When nsjail is installed (SAFE_EVAL_NSJAIL or on PATH) every program runs under
+    it with the same flags the containers use, which adds namespaces and nsjail's
+    seccomp policy. Without nsjail, prepare() fails unless SAFE_EVAL_HOST_UNSAFE=1
+    opts into the plain mode: the program is a subprocess in its own session with
+    rlimits on CPU time, address space, file size and open files, a wall-clock kill,
+    an empty environment, and new user and network namespaces (see host_confine.py).
+    The plain mode has no seccomp filter and no private filesystem view: programs
+    can read whatever the host's other users can, so it is for development and
+    benchmarks only.
+
+    Sessions cannot install modules and run whatever interpreter version the host
+    has.
+    """
+
+    name = "host"
+
+    nsjail = os.getenv("SAFE_EVAL_NSJAIL") or shutil.which("nsjail")
+
+    # Run programs without nsjail, confined by rlimits and namespaces only
+    unsafe = os.getenv("SAFE_EVAL_HOST_UNSAFE", "0") == "1"
+
+    # Host interpreters by language
+    interpreters = {
+        "python": os.getenv("SAFE_EVAL_HOST_PYTHON") or shutil.which("python3"),
+        "javascript": os.getenv("SAFE_EVAL_HOST_NODE") or shutil.which("node"),
+    }
+
+    # Limits of the plain subprocess mode
+    memory_limit = int(os.getenv("SAFE_EVAL_HOST_MEMORY_BYTES", 4 * 1024**3))
+    file_size_limit = int(os.getenv("SAFE_EVAL_HOST_FILE_BYTES", 64 * 1024**2))
+    open_files_limit = 256
+
+    def __init__(self, evaluator):
+        super().__init__(evaluator)
+        self.interpreter = None
+
+    @property
+    def volume_path(self):
+        return str(self.evaluator._session_path)
+
+    def prepare(self):
+        if self.nsjail is None and not self.unsafe:
+            raise RuntimeError(
+                "nsjail is not installed; set SAFE_EVAL_HOST_UNSAFE=1 to run "
+                "programs on the host without it."
+            )
+        if self.evaluator.modules:
+            raise RuntimeError("The host backend cannot install modules.")
+        self.interpreter = self.interpreters.get(self.evaluator.language)
+        if self.interpreter is None:
+            raise RuntimeError(
+                f"No host interpreter found for {self.evaluator.language}."
+            )
+
+    def execute(self, code, interpreter, extension, time_limit):
+        # The host has its own interpreter path; the container path is ignored
+        def command(result_fd):
+            argv = [self.interpreter, "-", str(result_fd)]
+            if self.nsjail is None:
+                return self._confined(argv, time_limit)
+            argv = build_command(time_limit, result_fd, argv)
+            return [self.nsjail] + argv[1:]
+
+        popen_kwargs = {}
+        if self.nsjail is None:
+            popen_kwargs = self._plain_popen_kwargs
+
+        kill_timer = []
+
+        def on_start(process):
+            if self.nsjail is None:
+                # nsjail enforces the time limit itself; CPU rlimits miss sleeping
+                timer = threading.Timer(time_limit + 1, _kill_group, (process,))
+                timer.daemon = True
+                timer.start()
+                kill_timer.append(timer)
+
+        try:
+            for stream, data in run_program(
+                command,
+                code,
+                on_start=on_start,
+                cwd=self.evaluator._session_path,
+                **popen_kwargs,
+            ):
+                if stream == "returncode":
+                    yield {"returncode": data}
+                elif stream == "result":
+                    yield {"result": data}
+                else:
+                    yield {"stream": stream, "data": data}
+        finally:
+            for timer in kill_timer:
+                timer.cancel()
+
+    def start_interpreter(
+        self, script, memory_limit, cpu_limit, stderr=subprocess.DEVNULL
+    ):
+        argv = [self.interpreter, script]
+        popen_kwargs = {}
+        if self.nsjail is not None:
+            argv = build_service_command(argv, memory_limit, cpu_limit)
+            argv = [self.nsjail] + argv[1:]
+        else:
+            argv = self._confined(argv, cpu_limit, memory_limit)
+            popen_kwargs = self._plain_popen_kwargs
+        return subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            cwd=self.evaluator._session_path,
+            **popen_kwargs,
+        )
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    # The plain mode's programs start a session of their own, so the wall-clock kill
+    # takes down their children too, and see an empty environment
+    _plain_popen_kwargs = {
+        "start_new_session": True,
+        "env": {"PATH": "/usr/bin:/bin", "LANG": "C.UTF-8"},
+    }
+
+    def _confined(self, argv, time_limit, memory_limit=None):
+        """
+        Return the command line that runs argv under host_confine.py with the plain
+        mode's rlimits.
+        """
+        time_limit = int(time_limit)
+        if memory_limit is None:
+            memory_limit = self.memory_limit
+        limits = [
+            ("RLIMIT_CPU", time_limit, time_limit + 1),
+            ("RLIMIT_AS", memory_limit, memory_limit),
+            ("RLIMIT_FSIZE", self.file_size_limit, self.file_size_limit),
+            ("RLIMIT_NOFILE", self.open_files_limit, self.open_files_limit),
+            ("RLIMIT_CORE", 0, 0),
+        ]
+        confine = Path(__file__).parent / "host_confine.py"
+        trampoline = [sys.executable, "-I", "-S", str(confine), json.dumps(limits)]
+        return trampoline + ["--"] + argv
+
+
+def _kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+backends = {DockerBackend.name: DockerBackend, HostBackend.name: HostBackend}
+
+
+def backend_class(name=None):
+    """
+    Return the backend class registered under name, defaults to SAFE_EVAL_BACKEND
+    ("docker" if unset). A SandboxBackend subclass is returned as is.
+    """
+    if isinstance(name, type) and issubclass(name, SandboxBackend):
+        return name
+    name = name or os.getenv("SAFE_EVAL_BACKEND", DockerBackend.name)
+    try:
+        return backends[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown sandbox backend {name!r}, expected one of: "
+            + ", ".join(sorted(backends))
+        ) from None
@@ -0,0 +1,63 @@
+// Runs a batch of [code, scope] items inside one node process.
+// SafeEvalJavaScript.eval_batch sends this file followed by a main(...) call as
+// the program.
+//
+// Every item runs in a fresh vm context with its own timeout and captured console;
+// an error or a timeout only fails that item. One JSON line per item is written to
+// the result fd passed as the first argument:
+//
+//     {"index": i, "returnValue": ..., "stdout": "..."}
+//     {"index": i, "error": "...", "stdout": "..."}
+//
+// Without a result fd the lines go to stdout, prefixed with the marker.
+
+const fs = require("fs");
+const util = require("util");
+const vm = require("vm");
+
+function writeAll(fd, text) {
+  const buffer = Buffer.from(text);
+  let offset = 0;
+  while (offset < buffer.length) {
+    offset += fs.writeSync(fd, buffer, offset);
+  }
+}
+
+function main(items, timeLimit, marker) {
+  const channel = process.argv.length > 2 ? Number(process.argv[2]) : null;
+  const scripts = new Map();
+  items.forEach(([code, scope], index) => {
+    const result = { index };
+    const stdout = [];
+    const log = (...args) => {
+      stdout.push(util.format(...args) + "\n");
+    };
+    try {
+      let script = scripts.get(code);
+      if (script === undefined) {
+        script = new vm.Script(`(() => { ${code}\n})()`, { filename: "user_code.js" });
+        scripts.set(code, script);
+      }
+      const context = vm.createContext({
+        ...scope,
+        console: { log, info: log, warn: log, error: log },
+      });
+      result.returnValue = script.runInContext(context, { timeout: timeLimit * 1000 });
+    } catch (error) {
+      result.error = error && error.message ? error.message : String(error);
+    }
+    result.stdout = stdout.join("");
+
+    let line;
+    try {
+      line = JSON.stringify(result);
+    } catch (error) {
+      line = JSON.stringify({ index, error: error.message, stdout: result.stdout });
+    }
+    if (channel !== null) {
+      writeAll(channel, line + "\n");
+    } else {
+      process.stdout.write(marker + line + "\n");
+    }
+  });
+}
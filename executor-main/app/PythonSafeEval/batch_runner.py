@@ -0,0 +1,90 @@
+"""
+Runs a batch of (code, scope) items inside one interpreter. SafeEvalPython.eval_batch
+sends this file followed by a main(...) call as the program.
+
+Every item runs with its own time limit and its own captured stdout; an error or a
+timeout only fails that item. One JSON line per item is written to the result fd
+passed as the first argument:
+
+    {"index": i, "returnValue": ..., "stdout": "..."}
+    {"index": i, "error": "...", "stdout": "..."}
+
+Without a result fd the lines go to stdout, prefixed with the marker.
+
+Runs with the container's python3, so it must stay compatible with Python 3.6.
+"""
+
+import io
+import json
+import os
+import signal
+import sys
+
+
+class ItemTimeout(BaseException):
+    pass
+
+
+def on_alarm(signum, frame):
+    raise ItemTimeout()
+
+
+def compile_item(code, names):
+    # Scope variables are locals of user_code, as in SafeEvalPython.eval
+    lines = ["def user_code(scope):"]
+    lines += ["    %s = scope[%r]" % (name, name) for name in names]
+    lines += ["    " + line for line in code.split("\n")]
+    namespace = {}
+    exec(compile("\n".join(lines), "<user_code>", "exec"), namespace)
+    return namespace["user_code"]
+
+
+def run_item(function, scope, time_limit):
+    signal.setitimer(signal.ITIMER_REAL, time_limit)
+    try:
+        return function(scope)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def main(items, time_limit, marker):
+    signal.signal(signal.SIGALRM, on_alarm)
+    channel = os.fdopen(int(sys.argv[1]), "w") if len(sys.argv) > 1 else None
+    compiled = {}
+    real_stdout = sys.stdout
+    for index, (code, scope) in enumerate(items):
+        result = {"index": index}
+        stdout = io.StringIO()
+        try:
+            key = (code, tuple(scope))
+            if key not in compiled:
+                compiled[key] = compile_item(code, list(scope))
+            sys.stdout = stdout
+            try:
+                result["returnValue"] = run_item(compiled[key], scope, time_limit)
+            finally:
+                sys.stdout = real_stdout
+        except ItemTimeout:
+            result["error"] = "Time limit exceeded"
+        except Exception as e:
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+        result["stdout"] = stdout.getvalue()
+
+        try:
+            line = json.dumps(result)
+        except (TypeError, ValueError) as e:
+            line = json.dumps(
+                {
+                    "index": index,
+                    "error": "TypeError: %s" % e,
+                    "stdout": result["stdout"],
+                }
+            )
+        if channel is not None:
+            channel.write(line + "\n")
+            channel.flush()
+        else:
+            real_stdout.write(marker + line + "\n")
+            real_stdout.flush()
+    if channel is not None:
+        channel.close()
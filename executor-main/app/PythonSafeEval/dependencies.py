@@ -0,0 +1,328 @@
+import fcntl
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class PackageManager:
+    """
+    How one language's packages are named, fetched into the host's dependency cache
+    and installed from it.
+
+    A package is fetched once, by running the package manager in the language image
+    with an empty download directory mounted, and merged into the cache directory;
+    from then on it is installed with the network off: every package becomes its own
+    RUN layer that bind-mounts the cache directory as a BuildKit build context.
+    Neither fetching nor installing runs code of the package: pip only takes wheels
+    and npm skips install scripts.
+    """
+
+    # Name of the cache directory and of the build context it is passed as
+    context = None
+
+    # Where the download directory is mounted while fetching, and the cache
+    # directory while installing
+    target = None
+
+    # Accepted package specs: a registry package name with an optional version, no
+    # URLs, paths or command line options
+    pattern = None
+
+    def validate(self, spec):
+        """
+        :raises ValueError: if spec is not a plain package name with an optional
+            version
+        """
+        if not isinstance(spec, str) or not self.pattern.fullmatch(spec):
+            raise ValueError(f"Invalid module: {spec!r}.")
+
+    def name(self, spec):
+        """
+        Package name of a spec, as matched against the allowed modules.
+        """
+        raise NotImplementedError
+
+    def fetch_command(self, spec):
+        """
+        Shell command run in the language image that downloads the package and its
+        dependencies into target.
+        """
+        raise NotImplementedError
+
+    def install_command(self, spec):
+        """
+        Shell command of the RUN layer that installs the package from target only.
+        """
+        raise NotImplementedError
+
+    def merge(self, downloaded, directory):
+        """
+        Add the files of a finished download to the cache directory. Files the
+        cache already has are kept, symlinks and anything else are skipped.
+        :param downloaded: the download directory, as the fetch left it
+        :param directory: the cache directory
+        """
+        raise NotImplementedError
+
+
+class Pip(PackageManager):
+    context = "wheelhouse"
+    target = "/wheelhouse"
+    pattern = re.compile(
+        r"[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?"
+        r"(?:\[[A-Za-z0-9._-]+(?:,[A-Za-z0-9._-]+)*\])?"
+        r"(?:(?:==|!=|<=|>=|~=|<|>)[A-Za-z0-9.*+!]+"
+        r"(?:,(?:==|!=|<=|>=|~=|<|>)[A-Za-z0-9.*+!]+)*)?"
+    )
+
+    def name(self, spec):
+        return re.split(r"[\[<>=!~,]", spec, 1)[0].lower().replace("_", "-")
+
+    def fetch_command(self, spec):
+        # Building an sdist would run its setup.py
+        return (
+            f"pip3 download --only-binary=:all: --dest {self.target} "
+            f"{shlex.quote(spec)}"
+        )
+
+    def install_command(self, spec):
+        return f"pip3 install --no-index --find-links={self.target} {shlex.quote(spec)}"
+
+    def merge(self, downloaded, directory):
+        for path in downloaded.iterdir():
+            if path.suffix == ".whl" and _is_plain_file(path):
+                if not (directory / path.name).exists():
+                    _copy_file(path, directory / path.name)
+
+
+class Npm(PackageManager):
+    context = "npm-cache"
+    target = "/npm-cache"
+    pattern = re.compile(
+        r"(?:@[a-z0-9][a-z0-9._-]*/)?[a-z0-9][a-z0-9._-]*(?:@[A-Za-z0-9.^~<>=*|+-]+)?"
+    )
+
+    def name(self, spec):
+        scope = "@" if spec.startswith("@") else ""
+        return scope + spec[len(scope) :].split("@", 1)[0]
+
+    def fetch_command(self, spec):
+        # Installing into a throwaway prefix puts the package and every dependency
+        # into the cache, which `npm cache add` alone does not
+        return (
+            f"npm install -g --ignore-scripts --prefix /tmp/npm-fetch "
+            f"--cache {self.target} {shlex.quote(spec)}"
+        )
+
+    def install_command(self, spec):
+        return (
+            f"npm install -g --offline --ignore-scripts --cache {self.target} "
+            f"{shlex.quote(spec)}"
+        )
+
+    def merge(self, downloaded, directory):
+        # Only the content-addressed store: content files with the same path are
+        # the same, index buckets are logs whose new lines are appended
+        cache = downloaded / "_cacache"
+        if cache.is_symlink():
+            return
+        for root, _, names in os.walk(cache):
+            for name in names:
+                path = Path(root) / name
+                relative = path.relative_to(downloaded)
+                if relative.parts[1] not in ("content-v2", "index-v5"):
+                    continue
+                if not _is_plain_file(path):
+                    continue
+                destination = directory / relative
+                if not destination.exists():
+                    destination.parent.mkdir(parents=True, exist_ok=True)
+                    _copy_file(path, destination)
+                elif relative.parts[1] == "index-v5":
+                    with open(path, "rb") as source, open(destination, "ab") as f:
+                        f.write(source.read())
+
+
+def _is_plain_file(path):
+    return path.is_file() and not path.is_symlink()
+
+
+def _copy_file(source, destination):
+    """
+    Copy under a temporary name and rename, so no build sees half of the file.
+    """
+    partial = destination.with_name(f".{destination.name}.partial")
+    shutil.copyfile(source, partial)
+    os.replace(partial, destination)
+
+
+package_managers = {"python": Pip(), "javascript": Npm()}
+
+# Most modules one session may ask for
+max_modules = int(os.getenv("SAFE_EVAL_MAX_MODULES", "16"))
+
+
+def allowed_modules(language):
+    """
+    Package names a request may ask for, from SAFE_EVAL_ALLOWED_PYTHON_MODULES or
+    SAFE_EVAL_ALLOWED_JAVASCRIPT_MODULES (comma separated). Unset allows none.
+    """
+    allowed = os.getenv(f"SAFE_EVAL_ALLOWED_{language.upper()}_MODULES", "")
+    return {name.strip() for name in allowed.split(",") if name.strip()}
+
+
+def validate_modules(language, modules):
+    """
+    Check the modules a session asks for and put them in their canonical order.
+    :return: the distinct module specs, sorted
+    :raises ValueError: if modules is not a list of valid, allowed package specs
+    """
+    if not modules:
+        return []
+    if not isinstance(modules, (list, tuple)):
+        raise ValueError("'modules' must be a list of package names.")
+    manager = package_managers.get(language)
+    if manager is None:
+        raise ValueError(f"Modules are not supported for {language}.")
+    for spec in modules:
+        manager.validate(spec)
+    modules = sorted(set(modules), key=lambda spec: (spec.lower(), spec))
+    if len(modules) > max_modules:
+        raise ValueError(f"At most {max_modules} modules per request.")
+    allowed = allowed_modules(language)
+    for spec in modules:
+        if manager.name(spec) not in allowed:
+            raise ValueError(f"Module not allowed: {spec}.")
+    return modules
+
+
+def module_dockerfile(language, image, modules):
+    """
+    Dockerfile that adds modules to image, one RUN layer per module in sorted order.
+    Sessions whose modules share a sorted prefix share those layers in Docker's build
+    cache, so adding a module only builds the layers from it onwards.
+
+    The layers read the dependency cache through a bind-mounted build context and
+    never reach the network (RUN --mount and named contexts need BuildKit, the
+    default builder since Docker 23).
+    """
+    manager = package_managers[language]
+    lines = [f"FROM {image}"]
+    for spec in validate_modules(language, modules):
+        lines.append(
+            f"RUN --mount=type=bind,from={manager.context},target={manager.target},rw"
+            f" {manager.install_command(spec)}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+class DependencyCache:
+    """
+    Host directories holding the downloaded packages of every language: a pip
+    wheelhouse and an npm cache. They are filled once per (version, module) and then
+    feed every image build offline. A manifest per directory records what has been
+    fetched; with offline set nothing is fetched and the directories must have been
+    populated beforehand (e.g. copied from another host).
+    """
+
+    def __init__(self, cache_dir, offline=False):
+        """
+        :param cache_dir: directory holding the package directories and manifests
+        :param offline: never download, only use what the cache already holds
+        """
+        self.cache_dir = Path(cache_dir)
+        self.offline = offline
+
+    def directory(self, language):
+        return self.cache_dir / package_managers[language].context
+
+    def build_contexts(self, language):
+        """
+        `docker build` arguments that pass the language's package directory as the
+        build context its install layers mount.
+        """
+        manager = package_managers[language]
+        return ["--build-context", f"{manager.context}={self.directory(language)}"]
+
+    def fetch(self, language, version, modules, image):
+        """
+        Download the modules that are not cached yet by running the package manager
+        in image, the language image they are installed into. Fetches of one
+        language are serialized across threads and processes.
+        :return: the fetched modules
+        :raises RuntimeError: if a download fails
+        """
+        if self.offline:
+            return []
+        directory = self.directory(language)
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._locked_manifest(language) as manifest:
+            fetched = []
+            for spec in modules:
+                if f"{version}/{spec}" in manifest:
+                    continue
+                self._download(language, spec, image)
+                manifest[f"{version}/{spec}"] = True
+                fetched.append(spec)
+        return fetched
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _download(self, language, spec, image):
+        # The container gets an empty directory of its own rather than the cache
+        # every image build reads, runs as this user without capabilities, and
+        # reaches the registry over Docker's default bridge network, not the host's
+        manager = package_managers[language]
+        with tempfile.TemporaryDirectory(
+            dir=self.cache_dir, prefix=".fetch-"
+        ) as downloaded:
+            result = subprocess.run(
+                [
+                    "docker",
+                    "run",
+                    "--rm",
+                    "--user",
+                    f"{os.getuid()}:{os.getgid()}",
+                    "--env",
+                    "HOME=/tmp",
+                    "--cap-drop=ALL",
+                    "--security-opt=no-new-privileges",
+                    "-v",
+                    f"{downloaded}:{manager.target}",
+                    image,
+                    "sh",
+                    "-c",
+                    manager.fetch_command(spec),
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+            if result.returncode != 0:
+                raise RuntimeError(
+                    f"Failed to fetch {spec}: {result.stderr.decode('utf-8')}"
+                )
+            manager.merge(Path(downloaded), self.directory(language))
+
+    @contextmanager
+    def _locked_manifest(self, language):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / f"{package_managers[language].context}.json"
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                content = f.read()
+                manifest = json.loads(content) if content else {}
+                yield manifest
+                f.seek(0)
+                f.truncate()
+                json.dump(manifest, f)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,875 @@
+"""
+Supervisor that runs inside the sandbox container and executes jobs under nsjail.
+
+The daemon listens on a Unix socket in /volume (which is bind-mounted from the host
+session directory), so the host can keep one connection open per container instead
+of forking `docker exec` for every snippet. Jobs can see /volume too, so the socket
+is owned by the host user (--owner) with mode 0600: only the host can connect, never
+the nsjail user. Jobs must use the session's --interpreter, and their time limit is
+capped at --max-time-limit.
+
+Every message is a frame: a 4-byte big-endian length followed by a UTF-8 JSON object.
+
+    request  {"code": str, "interpreter": str, "extension": str, "time_limit": int}
+    replies  {"stream": "stdout" | "stderr", "data": str}   (zero or more)
+             {"result": n} + n raw bytes                     (zero or more)
+             {"returncode": int}                             (exactly one, last)
+             {"error": str}                                  (instead of returncode)
+
+The program is sent to the interpreter's stdin, so jobs never touch the disk, and it
+gets the number of a result fd as its first argument. The wrappers in
+safe_eval.py write the JSON encoded return value there instead of printing it, and
+the daemon forwards those bytes unparsed in "result" frames, so the host decodes the
+return value with a single json.loads instead of scanning stdout.
+
+With --node-pool INTERPRETER the daemon starts node_pool.js under nsjail once and
+sends that interpreter's jobs to it; they run in warm worker threads instead of a
+fresh node each (see node_pool.js).
+
+With --zygote INTERPRETER the daemon also starts a zygote: a long-lived interpreter
+that imports the --preload modules once and then forks a child per job instead of
+starting a fresh interpreter under nsjail. Every job gets a PID namespace of its
+own, so whatever it leaves running dies with it, and new network and mount
+namespaces in which / is read-only and /proc is empty; it then drops to the nsjail
+user, applies nsjail's default rlimits and the time limit, and runs the program.
+Jobs for other interpreters, and all jobs while the zygote is not up, still go
+through nsjail; a zygote that cannot create PID namespaces never comes up.
+
+This file is copied into the container and run with the container's python3, so it
+must stay standard-library only and compatible with Python 3.6.
+"""
+
+import argparse
+import array
+import builtins
+import codecs
+import collections
+import ctypes
+import importlib
+import json
+import os
+import resource
+import selectors
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import traceback
+
+_HEADER = struct.Struct(">I")
+_CHUNK_SIZE = 64 * 1024
+
+# Longest time limit of a job in seconds, SafeEval.max_timelimit on the host
+MAX_TIME_LIMIT = 100
+
+NSJAIL_COMMAND = [
+    "nsjail",
+    "--user",
+    "99999",
+    "--group",
+    "99999",
+    "--disable_proc",
+    "--chroot",
+    "/",
+    "--really_quiet",
+]
+
+
+def build_service_command(argv, memory_limit=None, cpu_limit=None):
+    """
+    Return the nsjail command line of a long-running helper such as the node pool,
+    optionally with an address space limit in bytes and a budget of CPU seconds over
+    its whole lifetime.
+    """
+    limits = []
+    if memory_limit is not None:
+        limits += ["--rlimit_as", str(max(1, memory_limit // 1024**2))]
+    if cpu_limit is not None:
+        limits += ["--rlimit_cpu", str(max(1, int(cpu_limit)))]
+    return NSJAIL_COMMAND + ["--time_limit", "0"] + limits + ["--"] + argv
+
+
+def build_command(time_limit, result_fd, argv):
+    """
+    Return the nsjail command line that runs argv with the result fd passed through.
+    """
+    return (
+        NSJAIL_COMMAND
+        + [
+            "--time_limit",
+            str(int(time_limit)),
+            "--pass_fd",
+            str(result_fd),
+            "--",
+        ]
+        + argv
+    )
+
+
+# Restrictions of zygote jobs, the same as nsjail's defaults for NSJAIL_COMMAND
+ZYGOTE_USER = 99999
+ZYGOTE_GROUP = 99999
+ZYGOTE_RLIMITS = [
+    (resource.RLIMIT_AS, 4096 * 1024**2),
+    (resource.RLIMIT_FSIZE, 1024**2),
+    (resource.RLIMIT_NOFILE, 32),
+    (resource.RLIMIT_CORE, 0),
+]
+_CLONE_NEWNS = 0x00020000
+_CLONE_NEWPID = 0x20000000
+_CLONE_NEWNET = 0x40000000
+_MS_RDONLY = 0x1
+_MS_REMOUNT = 0x20
+_MS_BIND = 0x1000
+_MS_REC = 0x4000
+_MS_PRIVATE = 0x40000
+_PR_SET_NO_NEW_PRIVS = 38
+
+# stdout and stderr of a zygote job, in the shape iter_output() expects of a Popen
+_Pipes = collections.namedtuple("_Pipes", ["stdout", "stderr"])
+
+
+class ExecutorError(Exception):
+    """
+    Raised on the host when the daemon connection is unusable.
+    """
+
+
+def write_frame(sock, message):
+    payload = json.dumps(message).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def read_frame(sock):
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    (length,) = _HEADER.unpack(header)
+    payload = _recv_exactly(sock, length)
+    if payload is None:
+        raise ExecutorError("Connection closed in the middle of a frame.")
+    return json.loads(payload.decode("utf-8"))
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            if chunks:
+                raise ExecutorError("Connection closed in the middle of a frame.")
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+# ------------------------------------------------------------------------------
+# Host side
+# ------------------------------------------------------------------------------
+
+
+class ExecutorClient:
+    """
+    Host side of the protocol. Holds one connection to the daemon open and runs jobs
+    on it one at a time.
+    """
+
+    def __init__(self, socket_path, connect_timeout=5):
+        self._socket_path = str(socket_path)
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(connect_timeout)
+        try:
+            self._sock.connect(self._socket_path)
+        except OSError as e:
+            self._sock.close()
+            raise ExecutorError(f"Failed to connect to {self._socket_path}: {e}")
+
+    def stream(self, code, interpreter, extension, time_limit):
+        """
+        Run one job and yield the reply frames as they arrive.
+        """
+        with self._lock:
+            finished = False
+            # Leave the daemon some time to report a time limit kill
+            self._sock.settimeout(time_limit + 10)
+            try:
+                write_frame(
+                    self._sock,
+                    {
+                        "code": code,
+                        "interpreter": interpreter,
+                        "extension": extension,
+                        "time_limit": time_limit,
+                    },
+                )
+                while not finished:
+                    frame = read_frame(self._sock)
+                    if frame is None:
+                        raise ExecutorError("Executor daemon closed the connection.")
+                    if "error" in frame:
+                        finished = True
+                        raise ExecutorError(frame["error"])
+                    if "result" in frame:
+                        frame["result"] = _recv_exactly(self._sock, frame["result"])
+                    finished = "returncode" in frame
+                    yield frame
+            except (OSError, ValueError) as e:
+                raise ExecutorError(str(e))
+            finally:
+                # A job abandoned halfway leaves unread frames behind, so the
+                # connection cannot be reused
+                if not finished:
+                    self.close()
+
+    def run(self, code, interpreter, extension, time_limit):
+        """
+        Run one job and return dict with keys "stdout", "stderr", "returncode", and
+        "result" (the raw JSON bytes from the result fd) if the program wrote one.
+        """
+        output = {"stdout": [], "stderr": []}
+        result = []
+        returncode = None
+        for frame in self.stream(code, interpreter, extension, time_limit):
+            if "stream" in frame:
+                output[frame["stream"]].append(frame["data"])
+            elif "result" in frame:
+                result.append(frame["result"])
+            else:
+                returncode = frame["returncode"]
+        response = {
+            "stdout": "".join(output["stdout"]),
+            "stderr": "".join(output["stderr"]),
+            "returncode": returncode,
+        }
+        if result:
+            response["result"] = result[0] if len(result) == 1 else b"".join(result)
+        return response
+
+    def close(self):
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+
+# ------------------------------------------------------------------------------
+# Container side
+# ------------------------------------------------------------------------------
+
+
+class _JobHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                job = read_frame(self.request)
+            except (ExecutorError, ValueError):
+                return
+            if job is None:
+                return
+            try:
+                self._run_job(job)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                write_frame(self.request, {"error": str(e)})
+
+    def _run_job(self, job):
+        interpreter = job["interpreter"]
+        if interpreter not in self.server.interpreters:
+            raise ValueError(f"Interpreter not allowed: {interpreter!r}.")
+        time_limit = job["time_limit"]
+        if not isinstance(time_limit, (int, float)) or isinstance(time_limit, bool):
+            raise ValueError("time_limit must be a number.")
+        time_limit = min(max(int(time_limit), 1), self.server.max_time_limit)
+
+        def command(result_fd):
+            return build_command(
+                time_limit, result_fd, [interpreter, "-", str(result_fd)]
+            )
+
+        zygote = None
+        node_pool = self.server.node_pool
+        if interpreter == self.server.zygote_interpreter:
+            zygote = connect_zygote(self.server.zygote_socket)
+        if zygote is not None:
+            output = run_in_zygote(zygote, job["code"], time_limit)
+        elif node_pool is not None and node_pool.accepts(interpreter):
+            output = node_pool.run(job["code"], time_limit)
+        else:
+            output = run_program(command, job["code"])
+
+        for stream, data in output:
+            if stream == "returncode":
+                write_frame(self.request, {"returncode": data})
+            elif stream == "result":
+                write_frame(self.request, {"result": len(data)})
+                self.request.sendall(data)
+            else:
+                write_frame(self.request, {"stream": stream, "data": data})
+
+
+def write_program(process, code):
+    """
+    Send the program to a Popen with piped stdin and close it. The interpreters read
+    all of stdin before running anything, so this cannot block on the output pipes.
+    """
+    try:
+        process.stdin.write(code.encode("utf-8"))
+        process.stdin.close()
+    except BrokenPipeError:
+        # The interpreter died before reading its program; the exit code tells why
+        pass
+
+
+def run_program(command, code, on_start=None, **popen_kwargs):
+    """
+    Run a program that reads its source from stdin ("-") and writes its return value
+    to a result fd, so nothing is written to disk for a job.
+    :param command: callable(result_fd) returning the argv
+    :param code: the program
+    :param on_start: optional callable(process), called right after the spawn
+    :param popen_kwargs: extra subprocess.Popen arguments, e.g. preexec_fn or cwd
+    Yields ("stdout" | "stderr", text) and ("result", bytes) pairs as they are
+    produced, then ("returncode", int). A program still running when the generator is
+    closed early is killed.
+    """
+    read_fd, write_fd = os.pipe()
+    try:
+        try:
+            process = subprocess.Popen(
+                command(write_fd),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                pass_fds=(write_fd,),
+                **popen_kwargs,
+            )
+        finally:
+            # Only the child keeps the write end, so EOF arrives when it exits
+            os.close(write_fd)
+        try:
+            if on_start is not None:
+                on_start(process)
+            write_program(process, code)
+            with open(read_fd, "rb", buffering=0) as result:
+                read_fd = None
+                for item in iter_output(process, result):
+                    yield item
+            yield "returncode", process.wait()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+    finally:
+        if read_fd is not None:
+            os.close(read_fd)
+
+
+def iter_output(process, result=None):
+    """
+    Yield ("stdout" | "stderr", text) pairs from a Popen with piped stdout and stderr
+    as soon as the process produces them, until both pipes are closed. If a result
+    file object is given, its raw bytes are yielded as ("result", bytes) as well.
+    """
+    selector = selectors.DefaultSelector()
+    selector.register(process.stdout, selectors.EVENT_READ, "stdout")
+    selector.register(process.stderr, selectors.EVENT_READ, "stderr")
+    if result is not None:
+        selector.register(result, selectors.EVENT_READ, "result")
+    decoders = {"stdout": _decoder(), "stderr": _decoder()}
+    open_streams = len(selector.get_map())
+    try:
+        while open_streams:
+            for key, _ in selector.select():
+                chunk = os.read(key.fileobj.fileno(), _CHUNK_SIZE)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    open_streams -= 1
+                if key.data == "result":
+                    data = chunk
+                elif not chunk:
+                    data = decoders[key.data].decode(b"", final=True)
+                else:
+                    data = decoders[key.data].decode(chunk)
+                if data:
+                    yield key.data, data
+    finally:
+        selector.close()
+
+
+def _decoder():
+    return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    zygote_interpreter = None
+    zygote_socket = None
+    zygote_process = None
+    node_pool = None
+
+    def server_close(self):
+        super().server_close()
+        if self.zygote_process is not None:
+            self.zygote_process.kill()
+            self.zygote_process.wait()
+        if self.node_pool is not None:
+            self.node_pool.close()
+
+
+def make_server(
+    socket_path,
+    interpreters,
+    zygote_interpreter=None,
+    preload=(),
+    node_pool=None,
+    owner=None,
+    max_time_limit=MAX_TIME_LIMIT,
+):
+    """
+    :param socket_path: Unix socket to listen on
+    :param interpreters: the interpreters jobs may ask for
+    :param zygote_interpreter: interpreter whose jobs run in a zygote, None for none
+    :param preload: modules the zygote imports before forking jobs
+    :param node_pool: node interpreter whose jobs run in node_pool.js, None for none
+    :param owner: (uid, gid) the socket belongs to, the daemon's own user if None
+    :param max_time_limit: cap of the jobs' time limits in seconds
+    """
+    if owner is not None and owner[0] == ZYGOTE_USER:
+        raise ValueError("The socket must not belong to the sandbox user.")
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    # The socket is created with mode 0600, before anyone can connect to it
+    umask = os.umask(0o177)
+    try:
+        server = _Server(socket_path, _JobHandler)
+    finally:
+        os.umask(umask)
+    if owner is not None:
+        os.chown(socket_path, *owner)
+    server.volume = os.path.dirname(socket_path)
+    server.interpreters = frozenset(interpreters)
+    server.max_time_limit = max_time_limit
+    if node_pool is not None:
+        server.node_pool = NodePool(
+            node_pool, os.path.join(server.volume, ".node_pool.js")
+        )
+    if zygote_interpreter is not None:
+        # Jobs go through nsjail until the zygote has imported its modules
+        server.zygote_interpreter = zygote_interpreter
+        server.zygote_socket = os.path.join(server.volume, ".zygote.sock")
+        server.zygote_process = subprocess.Popen(
+            [zygote_interpreter, os.path.abspath(__file__)]
+            + ["--zygote-server", server.zygote_socket]
+            + ["--preload", ",".join(preload)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+        )
+    return server
+
+
+def serve(socket_path, interpreters, **kwargs):
+    make_server(socket_path, interpreters, **kwargs).serve_forever()
+
+
+# ------------------------------------------------------------------------------
+# Node pool
+# ------------------------------------------------------------------------------
+
+
+class NodePool:
+    """
+    Daemon side of node_pool.js: one persistent node process, fed one job at a time
+    over a socket pair connected to its stdin and stdout.
+    """
+
+    def __init__(self, interpreter, script, size=2, memory_mb=512):
+        """
+        :param interpreter: node binary, also the job interpreter this pool serves
+        :param script: path of node_pool.js
+        :param size: number of warm worker threads
+        :param memory_mb: old generation cap of each worker
+        """
+        self.interpreter = interpreter
+        self._argv = [interpreter, script, str(size), str(memory_mb)]
+        self._lock = threading.Lock()
+        self._sock = None
+        self.process = None
+        self._start()
+
+    def accepts(self, interpreter):
+        """
+        Return True if the pool runs this interpreter's jobs, restarting it if it
+        exited.
+        """
+        if interpreter != self.interpreter:
+            return False
+        with self._lock:
+            if self.process.poll() is not None:
+                self._start()
+            return self.process.poll() is None
+
+    def run(self, code, time_limit):
+        """
+        Run one job. Yields the same pairs as run_program().
+        """
+        with self._lock:
+            finished = False
+            try:
+                write_frame(self._sock, {"code": code, "time_limit": time_limit})
+                while not finished:
+                    frame = read_frame(self._sock)
+                    if frame is None:
+                        raise ExecutorError("Node pool exited.")
+                    if "result" in frame:
+                        yield "result", _recv_exactly(self._sock, frame["result"])
+                    elif "returncode" in frame:
+                        finished = True
+                        yield "returncode", frame["returncode"]
+                    else:
+                        yield frame["stream"], frame["data"]
+            finally:
+                # Frames of an abandoned job would be read as the next job's
+                while not finished:
+                    frame = read_frame(self._sock)
+                    if frame is None or "returncode" in frame:
+                        finished = True
+                    elif "result" in frame:
+                        _recv_exactly(self._sock, frame["result"])
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if self._sock is not None:
+            self._sock.close()
+
+    def _start(self):
+        self.close()
+        self._sock, child = socket.socketpair()
+        try:
+            self.process = subprocess.Popen(
+                build_service_command(self._argv),
+                stdin=child,
+                stdout=child,
+                stderr=subprocess.DEVNULL,
+            )
+        finally:
+            child.close()
+
+
+# ------------------------------------------------------------------------------
+# Zygote
+# ------------------------------------------------------------------------------
+
+
+def connect_zygote(socket_path):
+    """
+    Connect to the zygote, or return None if it is not (yet) listening.
+    """
+    if socket_path is None or not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def run_in_zygote(sock, code, time_limit):
+    """
+    Run a Python program in a child forked by the zygote on the other end of sock.
+    Yields the same pairs as run_program().
+    """
+    pipes = [os.pipe() for _ in range(3)]
+    try:
+        try:
+            fds = array.array("i", [write_fd for _, write_fd in pipes])
+            sock.sendmsg([b"\0"], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+            write_frame(sock, {"code": code, "time_limit": time_limit})
+        finally:
+            # Only the job keeps the write ends, so EOF arrives when it exits
+            for _, write_fd in pipes:
+                os.close(write_fd)
+        stdout, stderr, result = [open(fd, "rb", buffering=0) for fd, _ in pipes]
+        pipes = []
+        with stdout, stderr, result:
+            for item in iter_output(_Pipes(stdout, stderr), result):
+                yield item
+        frame = read_frame(sock)
+        if frame is None:
+            raise ExecutorError("Zygote job ended without an exit status.")
+        yield "returncode", frame["returncode"]
+    finally:
+        for read_fd, _ in pipes:
+            os.close(read_fd)
+        sock.close()
+
+
+def serve_zygote(socket_path, preload):
+    """
+    Import the preload modules, then fork a supervisor per connection. Runs as root
+    inside the container; only the jobs drop privileges.
+    """
+    # Thread pools started by imports do not survive fork
+    for variable in ("OPENBLAS_NUM_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(variable, "1")
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            pass
+
+    if not _can_isolate_jobs():
+        # Without PID namespaces a job could leave processes running past its time
+        # limit; the daemon keeps sending jobs through nsjail
+        sys.stderr.write("Zygote disabled: cannot create PID namespaces.\n")
+        return
+
+    # Supervisors are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    listener.listen(64)
+    while True:
+        conn, _ = listener.accept()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if os.fork() == 0:
+            listener.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            try:
+                _supervise_job(conn)
+            finally:
+                os._exit(0)
+        conn.close()
+
+
+def _supervise_job(conn):
+    """
+    Runs in a child of the zygote: forks the job, enforces its time limit and
+    reports its exit status over conn.
+    """
+    _, ancdata, _, _ = conn.recvmsg(1, socket.CMSG_SPACE(3 * array.array("i").itemsize))
+    fds = array.array("i")
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - len(data) % fds.itemsize])
+    job = read_frame(conn)
+
+    # The next child is the init of a new PID namespace. When it exits, or is
+    # killed, the kernel kills every process left in the namespace, including
+    # those the job detached with setsid() or a double fork
+    _unshare(_CLONE_NEWPID)
+    pid = os.fork()
+    if pid == 0:
+        conn.close()
+        _init_job(job, list(fds))
+    for fd in fds:
+        os.close(fd)
+
+    def kill_job(signum, frame):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    signal.signal(signal.SIGALRM, kill_job)
+    signal.alarm(max(1, int(job["time_limit"])))
+    _, status = os.waitpid(pid, 0)
+    signal.alarm(0)
+    if os.WIFSIGNALED(status):
+        returncode = 128 + os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    write_frame(conn, {"returncode": returncode})
+
+
+def _init_job(job, fds):
+    """
+    Runs as PID 1 of the job's namespace: forks the job, reaps whatever gets
+    reparented to it, and exits with the job's status once the job is done, which
+    takes the rest of the namespace down. The job itself is not PID 1, so signals
+    such as SIGXCPU keep their default effect on it. Never returns.
+    """
+    returncode = 1
+    try:
+        pid = os.fork()
+        if pid == 0:
+            _run_forked_job(job, fds)
+        for fd in fds:
+            os.close(fd)
+        while True:
+            reaped, status = os.wait()
+            if reaped == pid:
+                break
+        if os.WIFSIGNALED(status):
+            returncode = 128 + os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+    finally:
+        os._exit(returncode)
+
+
+def _run_forked_job(job, fds):
+    """
+    Runs in the forked job: confine the process, run the program, exit. Never
+    returns.
+    """
+    returncode = 1
+    try:
+        stdout_fd, stderr_fd, result_fd = fds
+        os.setsid()
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.dup2(stdout_fd, 1)
+        os.dup2(stderr_fd, 2)
+        os.dup2(result_fd, 3)
+        # Nothing of the zygote stays reachable besides stdio and the result fd
+        os.closerange(4, resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+        _confine_job(job["time_limit"])
+
+        sys.argv = ["-", "3"]
+        os.environ.clear()
+        program = compile(job["code"], "<stdin>", "exec")
+        exec(program, {"__name__": "__main__", "__builtins__": builtins})
+        returncode = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            returncode = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(returncode)
+
+
+def _confine_job(time_limit):
+    """
+    Apply what nsjail would: its default rlimits, a CPU time limit, new network and
+    mount namespaces with a read-only / and without /proc, and the unprivileged
+    nsjail user. The container's seccomp profile still applies.
+    """
+    resource.setrlimit(resource.RLIMIT_CPU, (int(time_limit), int(time_limit) + 1))
+    for limit, value in ZYGOTE_RLIMITS:
+        resource.setrlimit(limit, (value, value))
+    os.chdir("/")
+    if os.geteuid() != 0:
+        # Not started as root, e.g. a development run outside the container
+        return
+    _unshare(_CLONE_NEWNET | _CLONE_NEWNS)
+    # Mount changes stay in the job's namespace, then / becomes read-only like
+    # nsjail's --chroot / and an empty read-only tmpfs hides /proc
+    _mount(None, "/", None, _MS_REC | _MS_PRIVATE)
+    _mount("/", "/", None, _MS_BIND | _MS_REMOUNT | _MS_RDONLY)
+    _mount("none", "/proc", "tmpfs", _MS_RDONLY)
+    libc = ctypes.CDLL(None, use_errno=True)
+    os.setgroups([])
+    os.setgid(ZYGOTE_GROUP)
+    os.setuid(ZYGOTE_USER)
+    libc.prctl(_PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0)
+
+
+def _unshare(flags):
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.unshare(flags) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, "unshare failed: " + os.strerror(errno))
+
+
+def _mount(source, target, fstype, flags):
+    def encode(value):
+        return None if value is None else value.encode()
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.mount(encode(source), encode(target), encode(fstype), flags, None) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"mount {target} failed: {os.strerror(errno)}")
+
+
+def _can_isolate_jobs():
+    """
+    Return True if the zygote's children can create PID namespaces.
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _unshare(_CLONE_NEWPID)
+            os._exit(0)
+        except BaseException:
+            os._exit(1)
+    _, status = os.waitpid(pid, 0)
+    return os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sandbox executor daemon.")
+    parser.add_argument("socket", nargs="?", default="/volume/.executor.sock")
+    parser.add_argument(
+        "--interpreter",
+        action="append",
+        default=[],
+        help="interpreter jobs may ask for, repeatable",
+    )
+    parser.add_argument(
+        "--owner",
+        metavar="UID:GID",
+        help="user and group the socket belongs to, the host user",
+    )
+    parser.add_argument(
+        "--max-time-limit",
+        type=int,
+        default=MAX_TIME_LIMIT,
+        help="cap of the jobs' time limits in seconds",
+    )
+    parser.add_argument(
+        "--zygote",
+        metavar="INTERPRETER",
+        help="run this interpreter's jobs in a zygote",
+    )
+    parser.add_argument("--preload", default="", help="comma separated modules")
+    parser.add_argument(
+        "--node-pool",
+        metavar="INTERPRETER",
+        help="run this node's jobs in node_pool.js",
+    )
+    parser.add_argument("--zygote-server", metavar="SOCKET", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    preload = [module for module in args.preload.split(",") if module]
+    if args.zygote_server:
+        serve_zygote(args.zygote_server, preload)
+        return
+    if not args.interpreter:
+        parser.error("at least one --interpreter is required")
+    owner = None
+    if args.owner:
+        uid, gid = args.owner.split(":")
+        owner = (int(uid), int(gid))
+    serve(
+        args.socket,
+        args.interpreter,
+        zygote_interpreter=args.zygote,
+        preload=preload,
+        node_pool=args.node_pool,
+        owner=owner,
+        max_time_limit=args.max_time_limit,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Trampoline of the host backend's plain subprocess mode (see backends.HostBackend).
+
+    python3 host_confine.py LIMITS -- PROGRAM [ARGS...]
+
+Applies the rlimits in LIMITS, a JSON list of [name, soft, hard] with name a
+resource.RLIMIT_* constant, moves into new user and network namespaces and execs
+the program. Doing this in a process of its own, instead of a preexec_fn in the
+multithreaded server, keeps the server from running Python code between fork and
+exec. Exits with 126 and a message on stderr if the program cannot be confined.
+
+This file must stay standard-library only.
+"""
+
+import ctypes
+import json
+import os
+import resource
+import sys
+
+_CLONE_NEWUSER = 0x10000000
+_CLONE_NEWNET = 0x40000000
+
+
+def unshare(flags):
+    if hasattr(os, "unshare"):
+        os.unshare(flags)
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.unshare(flags) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def main(argv):
+    if len(argv) < 4 or argv[2] != "--":
+        sys.stderr.write("usage: host_confine.py LIMITS -- PROGRAM [ARGS...]\n")
+        return 126
+    try:
+        for name, soft, hard in json.loads(argv[1]):
+            resource.setrlimit(getattr(resource, name), (soft, hard))
+        unshare(_CLONE_NEWUSER | _CLONE_NEWNET)
+    except (OSError, ValueError, AttributeError) as e:
+        sys.stderr.write(f"Failed to confine the program: {e}\n")
+        return 126
+    os.execv(argv[3], argv[3:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,142 @@
+import fcntl
+import hashlib
+import json
+import os
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class ImageCache:
+    """
+    Content-addressed cache of sandbox Docker images.
+
+    Images are tagged with a hash of the rendered Dockerfile plus the nsjail revision,
+    so identical configurations share one image across sessions and processes. An
+    index file records size and last use of every image, and collect_garbage() removes
+    the least recently used images until the cache fits in the disk budget.
+    """
+
+    repository = "safe_eval_cache"
+
+    def __init__(self, cache_dir, disk_budget=10 * 1024**3):
+        """
+        :param cache_dir: directory holding the index and the build lock files
+        :param disk_budget: maximum total size of cached images in bytes
+        """
+        self.cache_dir = Path(cache_dir)
+        self.disk_budget = disk_budget
+        self._index_path = self.cache_dir / "index.json"
+
+    def tag_for(self, dockerfile, nsjail_revision):
+        """
+        Return the image tag for a rendered Dockerfile.
+        """
+        digest = hashlib.sha256()
+        digest.update(nsjail_revision.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(dockerfile.encode("utf-8"))
+        return f"{self.repository}:{digest.hexdigest()[:32]}"
+
+    def exists(self, tag):
+        result = subprocess.run(
+            ["docker", "image", "inspect", tag],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        return result.returncode == 0
+
+    @contextmanager
+    def build_lock(self, tag):
+        """
+        Serialize builds of the same tag across threads and processes.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        lock_path = self.cache_dir / (tag.split(":", 1)[1] + ".lock")
+        with open(lock_path, "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def ensure(self, tag, build):
+        """
+        Make sure the image exists, calling build(tag) if it does not.
+        :return: True if the image was built, False if it was reused
+        """
+        with self.build_lock(tag):
+            if self.exists(tag):
+                self.touch(tag)
+                return False
+            build(tag)
+            self.touch(tag, size=self._image_size(tag))
+        self.collect_garbage(keep=tag)
+        return True
+
+    def touch(self, tag, size=None):
+        """
+        Record that the image was just used.
+        """
+        with self._locked_index() as index:
+            entry = index.setdefault(tag, {"size": 0})
+            entry["last_used"] = time.time()
+            if size is not None:
+                entry["size"] = size
+
+    def collect_garbage(self, keep=None):
+        """
+        Remove least recently used images until the cache fits in the disk budget.
+        Images still used by a container cannot be removed and are skipped.
+        :return: list of removed tags
+        """
+        removed = []
+        with self._locked_index() as index:
+            total = sum(entry["size"] for entry in index.values())
+            for tag, entry in sorted(index.items(), key=lambda i: i[1]["last_used"]):
+                if total <= self.disk_budget:
+                    break
+                if tag == keep:
+                    continue
+                result = subprocess.run(
+                    ["docker", "image", "remove", tag],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                )
+                if result.returncode != 0 and b"No such image" not in result.stderr:
+                    continue
+                total -= entry["size"]
+                del index[tag]
+                removed.append(tag)
+        return removed
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _image_size(self, tag):
+        result = subprocess.run(
+            ["docker", "image", "inspect", "-f", "{{.Size}}", tag],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            return int(result.stdout.decode("utf-8").strip())
+        except ValueError:
+            return 0
+
+    @contextmanager
+    def _locked_index(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self._index_path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                content = f.read()
+                index = json.loads(content) if content else {}
+                yield index
+                f.seek(0)
+                f.truncate()
+                json.dump(index, f)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,450 @@
+// Persistent node process that runs JavaScript jobs in warm worker threads.
+// executor_daemon.py starts it under nsjail with --node-pool and talks to it over
+// stdin/stdout (one end of a socket pair) with the daemon's own framing:
+//
+//     request  {"code": str, "time_limit": int}
+//     replies  {"stream": "stdout" | "stderr", "data": str}   (zero or more)
+//              {"result": n} + n raw bytes                     (zero or more)
+//              {"returncode": int}                             (exactly one, last)
+//
+// Workers are started ahead of time, so neither node nor a worker starts while a
+// job waits, but every worker runs exactly one job and is then terminated:
+// nothing a job leaves behind (globals, pending callbacks, a broken realm) can
+// reach the next job, which may belong to another request or tenant.
+//
+// Inside the worker the job runs in a vm context that holds no object of the
+// worker's own realm, since any such object leads back to the worker's `process`
+// through its constructor. console, process.argv/env/exit, Buffer and
+// require("fs") are built in the context's realm by contextBootstrap() on top of
+// one bridge function, which only takes and returns primitives and typed arrays
+// of the context. Promise callbacks run before the job ends (microtaskMode
+// "afterEvaluate"); timers are not provided: the job is over when its code and
+// its microtasks have run.
+//
+// The part of the program after BODY_MARKER is the same for every run of a code
+// body, so it is compiled with V8's code cache; the scope definitions before it
+// are not cached.
+//
+// Exit codes follow a node process under nsjail: 0 when the program finishes, 1
+// on an uncaught error, the code passed to process.exit(), and 137 when the job
+// is killed for its time limit or memory cap.
+
+"use strict";
+
+const crypto = require("crypto");
+const { Worker, isMainThread, parentPort } = require("worker_threads");
+
+const BODY_MARKER = "\n// safe-eval: body\n";
+const RESULT_FD = 3;
+const KILLED = 137;
+
+if (isMainThread) {
+  runPool(Number(process.argv[2] || 2), Number(process.argv[3] || 512));
+} else {
+  runWorker();
+}
+
+// ------------------------------------------------------------------------------
+// Main thread: framing, job queue, workers and the code cache
+// ------------------------------------------------------------------------------
+
+function runPool(size, memoryMb) {
+  const codeCache = new Map();
+  const maxCacheEntries = 256;
+  const idle = [];
+  const jobs = [];
+  let busy = false;
+
+  function spawn() {
+    const worker = new Worker(__filename, {
+      resourceLimits: {
+        maxOldGenerationSizeMb: memoryMb,
+        maxYoungGenerationSizeMb: Math.max(16, Math.floor(memoryMb / 8)),
+      },
+      stdout: true,
+      stderr: true,
+    });
+    worker.on("error", () => {});
+    return worker;
+  }
+
+  for (let i = 0; i < size; i += 1) {
+    idle.push(spawn());
+  }
+
+  function writeFrame(message, raw) {
+    const payload = Buffer.from(JSON.stringify(message));
+    const header = Buffer.alloc(4);
+    header.writeUInt32BE(payload.length);
+    const parts = raw ? [header, payload, raw] : [header, payload];
+    process.stdout.write(Buffer.concat(parts));
+  }
+
+  function runNext() {
+    if (busy || jobs.length === 0) {
+      return;
+    }
+    busy = true;
+    const job = jobs.shift();
+    const worker = idle.length ? idle.shift() : spawn();
+    const index = job.code.indexOf(BODY_MARKER);
+    const prelude = index === -1 ? "" : job.code.slice(0, index);
+    const body = index === -1 ? job.code : job.code.slice(index);
+    const key = crypto.createHash("sha256").update(body).digest("hex");
+    const cached = codeCache.get(key);
+    let finished = false;
+    let outOfMemory = false;
+
+    const finish = (returncode) => {
+      if (finished) {
+        return;
+      }
+      finished = true;
+      clearTimeout(watchdog);
+      // The worker is done with its one job; its listeners stay attached and
+      // drop whatever it still sends until it has exited
+      worker.terminate();
+      idle.push(spawn());
+      writeFrame({ returncode });
+      busy = false;
+      runNext();
+    };
+
+    // Backstop for code the vm timeout cannot interrupt, e.g. a blocking native call
+    const watchdog = setTimeout(
+      () => finish(KILLED),
+      job.time_limit * 1000 + 1000
+    );
+    worker.on("message", (message) => {
+      if (finished) {
+        return;
+      }
+      if (message.stream !== undefined) {
+        writeFrame({ stream: message.stream, data: message.data });
+      } else if (message.result !== undefined) {
+        const result = Buffer.from(message.result);
+        writeFrame({ result: result.length }, result);
+      } else if (message.cachedData !== undefined) {
+        codeCache.delete(key);
+        codeCache.set(key, Buffer.from(message.cachedData));
+        if (codeCache.size > maxCacheEntries) {
+          codeCache.delete(codeCache.keys().next().value);
+        }
+      } else if (message.returncode !== undefined) {
+        finish(message.returncode);
+      }
+    });
+    // The worker went over its memory cap, or the job called process.exit()
+    worker.on("error", (error) => {
+      outOfMemory = error && error.code === "ERR_WORKER_OUT_OF_MEMORY";
+    });
+    worker.on("exit", (code) => finish(outOfMemory ? KILLED : code));
+    if (cached !== undefined) {
+      // Most recently used entries are kept
+      codeCache.delete(key);
+      codeCache.set(key, cached);
+    }
+    worker.postMessage({
+      prelude,
+      body,
+      timeLimit: job.time_limit,
+      cachedData: cached,
+    });
+  }
+
+  let buffered = Buffer.alloc(0);
+  process.stdin.on("data", (chunk) => {
+    buffered = Buffer.concat([buffered, chunk]);
+    while (buffered.length >= 4) {
+      const length = buffered.readUInt32BE(0);
+      if (buffered.length < 4 + length) {
+        break;
+      }
+      jobs.push(JSON.parse(buffered.toString("utf8", 4, 4 + length)));
+      buffered = buffered.slice(4 + length);
+    }
+    runNext();
+  });
+  process.stdin.on("end", () => process.exit(0));
+}
+
+// ------------------------------------------------------------------------------
+// Worker: one job in a fresh vm context
+// ------------------------------------------------------------------------------
+
+function runWorker() {
+  const fs = require("fs");
+  const util = require("util");
+  const vm = require("vm");
+
+  const typedArrayLength = Object.getOwnPropertyDescriptor(
+    Object.getPrototypeOf(Uint8Array.prototype),
+    "length"
+  ).get;
+  const setBytes = Uint8Array.prototype.set;
+
+  // A copy of a typed array of the context, read through its internal slots so
+  // none of the context's (user-replaceable) methods or getters run
+  function copyBytes(bytes) {
+    if (!util.types.isUint8Array(bytes)) {
+      throw new TypeError("Expected a Uint8Array.");
+    }
+    const copy = Buffer.alloc(typedArrayLength.call(bytes));
+    setBytes.call(copy, bytes);
+    return copy;
+  }
+
+  // Values of the context as plain values of this realm, for util.format
+  function toFormattable(value, depth) {
+    if (typeof value === "function") {
+      const name = Object.getOwnPropertyDescriptor(value, "name");
+      const label = name && typeof name.value === "string" ? name.value : "";
+      return { [label]: function () {} }[label];
+    }
+    if (typeof value !== "object" || value === null) {
+      return value;
+    }
+    try {
+      return structuredClone(value);
+    } catch (error) {
+      // Holds functions or other values that cannot be cloned
+    }
+    if (depth > 2) {
+      return Array.isArray(value) ? "[Array]" : "[Object]";
+    }
+    if (Array.isArray(value)) {
+      return Array.from(value, (item) => toFormattable(item, depth + 1));
+    }
+    const copy = {};
+    for (const name of Object.keys(value)) {
+      copy[name] = toFormattable(value[name], depth + 1);
+    }
+    return copy;
+  }
+
+  parentPort.once("message", ({ prelude, body, timeLimit, cachedData }) => {
+    const send = (stream, data) => parentPort.postMessage({ stream, data });
+    // The object a context is made from backs its global: lookups the global
+    // does not answer itself, such as `this.constructor`, fall through to it,
+    // so it must not carry this realm's Object.prototype
+    const context = vm.createContext(Object.create(null), {
+      microtaskMode: "afterEvaluate",
+    });
+    let failed = null;
+    let lastError = "";
+
+    // Everything the context can call. Arguments come from the context, so they
+    // are checked before use; errors are reported as a message, never thrown
+    // into the context.
+    function bridge(operation, a, b, c, d) {
+      try {
+        switch (operation) {
+          case "write": {
+            const values = [];
+            for (let i = 0; i < b.length; i += 1) {
+              values.push(toFormattable(b[i], 0));
+            }
+            const stream = a === "stderr" ? "stderr" : "stdout";
+            send(stream, util.format(...values) + "\n");
+            return undefined;
+          }
+          case "result":
+            parentPort.postMessage({ result: copyBytes(a) });
+            return undefined;
+          case "byteLength":
+            return Buffer.byteLength(String(a));
+          case "encode":
+            setBytes.call(b, Buffer.from(String(a)));
+            return undefined;
+          case "decode":
+            return copyBytes(a).toString(String(b), Number(c), Number(d));
+          case "size":
+            return fs.statSync(String(a)).size;
+          case "read": {
+            const data = fs.readFileSync(String(a));
+            if (data.length !== typedArrayLength.call(b)) {
+              throw new Error(`${a} changed while it was read`);
+            }
+            setBytes.call(b, data);
+            return undefined;
+          }
+          case "readText":
+            return fs.readFileSync(String(a), String(b));
+          case "exists":
+            return fs.existsSync(String(a));
+          case "exit":
+            process.exit(Number(a) | 0);
+            return undefined;
+          case "error":
+            return lastError;
+          default:
+            throw new Error(`Unknown operation ${operation}`);
+        }
+      } catch (error) {
+        lastError =
+          error && typeof error.message === "string" ? error.message : "Error";
+        return failed;
+      }
+    }
+
+    const bootstrap = new vm.Script(`(${contextBootstrap})`, {
+      filename: "safe-eval:bootstrap",
+    });
+    failed = bootstrap.runInContext(context)(bridge, RESULT_FD);
+
+    let returncode = 0;
+    try {
+      const options = { timeout: timeLimit * 1000 };
+      if (prelude) {
+        const scope = new vm.Script(prelude, { filename: "[stdin]" });
+        scope.runInContext(context, options);
+      }
+      const script = new vm.Script(body, { filename: "[stdin]", cachedData });
+      script.runInContext(context, options);
+      if (cachedData === undefined || script.cachedDataRejected) {
+        parentPort.postMessage({ cachedData: script.createCachedData() });
+      }
+    } catch (error) {
+      if (error && error.code === "ERR_SCRIPT_EXECUTION_TIMEOUT") {
+        returncode = KILLED;
+      } else {
+        send("stderr", describeError(error) + "\n");
+        returncode = 1;
+      }
+    }
+    parentPort.postMessage({ returncode });
+  });
+}
+
+// Text of an error thrown by a job, which may be any value of the context
+function describeError(error) {
+  try {
+    const stack =
+      error !== null && typeof error === "object" ? error.stack : undefined;
+    return typeof stack === "string" ? stack : String(error);
+  } catch (nested) {
+    return "Uncaught exception";
+  }
+}
+
+// ------------------------------------------------------------------------------
+// Context realm
+// ------------------------------------------------------------------------------
+
+// Compiled and run inside the job's context (its source is used, not the function
+// itself), so every object it creates belongs to the context. Installs the
+// globals the wrappers in safe_eval.py use and returns the value the bridge
+// answers failures with.
+function contextBootstrap(bridge, resultFd) {
+  "use strict";
+
+  const failed = {};
+  const ErrorOfContext = Error;
+  const StringOfContext = String;
+  const Uint8ArrayOfContext = Uint8Array;
+  const ArrayBufferOfContext = ArrayBuffer;
+
+  function call(operation, a, b, c, d) {
+    let reply;
+    let message = null;
+    try {
+      reply = bridge(operation, a, b, c, d);
+      if (reply === failed) {
+        message = StringOfContext(bridge("error"));
+      }
+    } catch (error) {
+      // e.g. a stack overflow inside the bridge; its error is not handed on
+      message = "Internal error";
+    }
+    if (message !== null) {
+      throw new ErrorOfContext(message);
+    }
+    return reply;
+  }
+
+  class Buffer extends Uint8ArrayOfContext {
+    static from(value, offsetOrEncoding, length) {
+      if (typeof value === "string") {
+        const bytes = new Buffer(call("byteLength", value));
+        call("encode", value, bytes);
+        return bytes;
+      }
+      if (value instanceof ArrayBufferOfContext) {
+        return new Buffer(value, offsetOrEncoding || 0, length);
+      }
+      const bytes = new Buffer(value.length);
+      for (let i = 0; i < bytes.length; i += 1) {
+        bytes[i] = value[i];
+      }
+      return bytes;
+    }
+
+    static alloc(size) {
+      return new Buffer(size);
+    }
+
+    readUInt16LE(offset = 0) {
+      return this[offset] | (this[offset + 1] << 8);
+    }
+
+    toString(encoding = "utf8", start = 0, end = this.length) {
+      return call("decode", this, StringOfContext(encoding), start, end);
+    }
+  }
+
+  function format(stream) {
+    return (...args) => {
+      call("write", stream, args);
+    };
+  }
+
+  const fs = {
+    readFileSync(path, options) {
+      path = StringOfContext(path);
+      const encoding =
+        typeof options === "string" ? options : options && options.encoding;
+      if (encoding) {
+        return call("readText", path, StringOfContext(encoding));
+      }
+      const bytes = new Buffer(call("size", path));
+      call("read", path, bytes);
+      return bytes;
+    },
+    existsSync(path) {
+      return call("exists", StringOfContext(path));
+    },
+    writeSync(fd, data, offset) {
+      if (fd !== resultFd) {
+        throw new ErrorOfContext("EBADF: bad file descriptor, write");
+      }
+      const bytes = typeof data === "string" ? Buffer.from(data) : data;
+      const chunk = offset ? bytes.subarray(offset) : bytes;
+      call("result", chunk);
+      return chunk.length;
+    },
+    closeSync() {},
+  };
+
+  globalThis.console = {
+    log: format("stdout"),
+    info: format("stdout"),
+    debug: format("stdout"),
+    warn: format("stderr"),
+    error: format("stderr"),
+  };
+  globalThis.process = {
+    argv: ["node", "-", StringOfContext(resultFd)],
+    env: {},
+    exit(code) {
+      call("exit", code === undefined ? 0 : code);
+    },
+  };
+  globalThis.require = (name) => {
+    if (name === "fs") {
+      return fs;
+    }
+    throw new ErrorOfContext(`Cannot find module '${name}'`);
+  };
+  globalThis.Buffer = Buffer;
+  return failed;
+}
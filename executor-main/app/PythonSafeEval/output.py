@@ -0,0 +1,131 @@
+import os
+import re
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+# Spilled outputs are shared by every worker on the host, so they can be fetched from
+# any of them
+SPILL_DIR = Path(
+    os.getenv("SAFE_EVAL_SPILL_DIR", Path(tempfile.gettempdir()) / "safe_eval_outputs")
+)
+
+_OUTPUT_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class BoundedOutput:
+    """
+    Collects one output stream with a memory cap.
+
+    Up to max_bytes are kept in memory. Past that only a head and a tail window of
+    max_bytes / 2 each stay in memory, and the whole stream goes to a spill file that
+    can be fetched by output_id. The spill file itself stops growing at
+    max_spill_bytes; total_bytes keeps counting everything the program wrote.
+    """
+
+    def __init__(self, max_bytes, max_spill_bytes=1024**3, spill_ttl=3600):
+        """
+        :param max_bytes: bytes kept in memory
+        :param max_spill_bytes: bytes written to the spill file at most
+        :param spill_ttl: seconds spill files are kept before they are swept
+        """
+        self.max_bytes = max_bytes
+        self.max_spill_bytes = max_spill_bytes
+        self.spill_ttl = spill_ttl
+        self.total_bytes = 0
+        self.output_id = None
+        self._buffer = bytearray()
+        self._head = None
+        self._spill = None
+        self._spilled_bytes = 0
+
+    @property
+    def truncated(self):
+        return self._head is not None
+
+    def write(self, data):
+        chunk = data.encode("utf-8")
+        self.total_bytes += len(chunk)
+        if self._head is None:
+            self._buffer += chunk
+            if len(self._buffer) > self.max_bytes:
+                self._start_spilling()
+            return
+
+        self._write_spill(chunk)
+        # The buffer holds the tail window
+        self._buffer += chunk
+        tail_size = self.max_bytes - len(self._head)
+        if len(self._buffer) > tail_size:
+            del self._buffer[: len(self._buffer) - tail_size]
+
+    def getvalue(self):
+        """
+        Return the whole output, or head and tail joined by a truncation notice.
+        """
+        self.close()
+        if self._head is None:
+            return self._buffer.decode("utf-8", errors="replace")
+        omitted = self.total_bytes - len(self._head) - len(self._buffer)
+        return (
+            self._head.decode("utf-8", errors="replace")
+            + f"\n... [{omitted} bytes truncated] ...\n"
+            + self._buffer.decode("utf-8", errors="replace")
+        )
+
+    def metadata(self):
+        return {
+            "truncated": self.truncated,
+            "total_bytes": self.total_bytes,
+            "output_id": self.output_id,
+        }
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _start_spilling(self):
+        SPILL_DIR.mkdir(parents=True, exist_ok=True)
+        sweep_spilled_outputs(self.spill_ttl)
+        self.output_id = uuid.uuid4().hex
+        self._spill = open(SPILL_DIR / self.output_id, "wb")
+        self._write_spill(bytes(self._buffer))
+
+        half = self.max_bytes // 2
+        self._head = bytes(self._buffer[:half])
+        del self._buffer[: len(self._buffer) - (self.max_bytes - half)]
+
+    def _write_spill(self, chunk):
+        room = self.max_spill_bytes - self._spilled_bytes
+        if self._spill is None or room <= 0:
+            return
+        self._spill.write(chunk[:room])
+        self._spilled_bytes += min(room, len(chunk))
+
+
+def spilled_output_path(output_id):
+    """
+    Return the spill file of an output id, or None if the id is invalid or unknown.
+    """
+    if not _OUTPUT_ID.match(output_id):
+        return None
+    path = SPILL_DIR / output_id
+    return path if path.is_file() else None
+
+
+def sweep_spilled_outputs(ttl):
+    """
+    Delete spill files older than ttl seconds.
+    """
+    cutoff = time.time() - ttl
+    for entry in os.scandir(SPILL_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
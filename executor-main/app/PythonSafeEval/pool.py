@@ -0,0 +1,301 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .safe_eval import SafeEvalJavaScript, SafeEvalPython
+from .timing import phase
+
+
+class PoolExhausted(Exception):
+    """
+    Raised when no sandbox could be checked out before the timeout expired.
+    """
+
+
+class SandboxPool:
+    """
+    Keeps pre-started SafeEval containers per (language, version, modules) key so a
+    request only pays for the nsjail exec instead of docker build/run/stop.
+
+    - checkout() hands out an idle, healthy container or starts a new one while the
+      key is below max_size; otherwise it waits for a release.
+    - release() scrubs /volume and puts the container back on the idle list.
+    - Idle containers above min_size are evicted after idle_timeout seconds, and idle
+      containers are health checked every health_check_interval seconds.
+    """
+
+    evaluator_classes = {
+        SafeEvalPython.language: SafeEvalPython,
+        SafeEvalJavaScript.language: SafeEvalJavaScript,
+    }
+
+    def __init__(
+        self,
+        min_size=0,
+        max_size=4,
+        idle_timeout=300,
+        health_check_interval=30,
+        tmp_dir=None,
+    ):
+        """
+        :param min_size: containers kept warm per key, even when idle
+        :param max_size: maximum number of containers (idle + checked out) per key
+        :param idle_timeout: seconds an idle container above min_size is kept around
+        :param health_check_interval: seconds between health checks of idle containers
+        :param tmp_dir: optionally override the base directory for .jailfs
+        """
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(
+                "Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1."
+            )
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._tmp_dir = tmp_dir
+        self._cond = threading.Condition()
+        # key -> deque of [evaluator, released_at, last_health_check]
+        self._idle = {}
+        # key -> number of containers that exist (idle, checked out or starting)
+        self._size = {}
+        # key -> number of checkouts waiting for a release
+        self._waiting = {}
+        self._maintenance_thread = None
+        self._closed = False
+
+    # --------------------------------------------------------------------------
+    # Public API
+    # --------------------------------------------------------------------------
+    def key(self, language, version=None, modules=None):
+        if language not in self.evaluator_classes:
+            raise ValueError(f"Unsupported language: {language}")
+        if version is None:
+            version = self.evaluator_classes[language].default_version
+        return (language, str(version), tuple(sorted(modules or [])))
+
+    def checkout(self, language, version=None, modules=None, timeout=None):
+        """
+        Return a running evaluator for the given key. The caller owns it until it is
+        passed back to release().
+        """
+        key = self.key(language, version, modules)
+        with phase("checkout", key[0], key[1]):
+            return self._checkout(key, timeout)
+
+    def release(self, evaluator, discard=False):
+        """
+        Give an evaluator back to the pool. Broken evaluators (discard=True) are torn
+        down instead of being reused.
+        """
+        key = evaluator._pool_key
+        if not discard:
+            try:
+                evaluator.scrub_volume()
+            except OSError:
+                discard = True
+
+        if discard:
+            self._discard(key, evaluator)
+            return
+
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                closed = True
+            else:
+                closed = False
+                self._idle.setdefault(key, deque()).append([evaluator, now, now])
+                self._cond.notify()
+        if closed:
+            self._discard(key, evaluator)
+
+    @contextmanager
+    def sandbox(self, language, version=None, modules=None, timeout=None):
+        """
+        Context manager around checkout()/release(). The evaluator is discarded if
+        the block raises.
+        """
+        evaluator = self.checkout(language, version, modules, timeout=timeout)
+        try:
+            yield evaluator
+        except BaseException:
+            self.release(evaluator, discard=True)
+            raise
+        else:
+            self.release(evaluator)
+
+    def prewarm(self, language, version=None, modules=None):
+        """
+        Start containers for the key until it has min_size of them.
+        """
+        key = self.key(language, version, modules)
+        while True:
+            with self._cond:
+                if self._closed or self._size.get(key, 0) >= self.min_size:
+                    return
+                self._size[key] = self._size.get(key, 0) + 1
+            self.release(self._create(key))
+
+    def evict_idle(self):
+        """
+        Tear down idle containers that exceeded idle_timeout (keeping min_size per
+        key) and ones that fail their health check.
+        """
+        now = time.monotonic()
+        expired = []
+        to_check = []
+        with self._cond:
+            for key, idle in self._idle.items():
+                remaining = self._size.get(key, 0)
+                keep = deque()
+                while idle:
+                    entry = idle.popleft()
+                    evaluator, released_at, last_check = entry
+                    if (
+                        now - released_at > self.idle_timeout
+                        and remaining > self.min_size
+                    ):
+                        remaining -= 1
+                        expired.append((key, evaluator))
+                    elif now - last_check >= self.health_check_interval:
+                        to_check.append((key, entry))
+                    else:
+                        keep.append(entry)
+                idle.extend(keep)
+
+        for key, evaluator in expired:
+            self._discard(key, evaluator)
+
+        for key, entry in to_check:
+            evaluator = entry[0]
+            if evaluator.is_healthy():
+                entry[2] = time.monotonic()
+                with self._cond:
+                    if not self._closed:
+                        self._idle[key].appendleft(entry)
+                        self._cond.notify()
+                        continue
+            self._discard(key, evaluator)
+
+        for key in list(self._idle):
+            self.prewarm(*self._unpack(key))
+
+    def start(self):
+        """
+        Start the background thread that runs evict_idle() periodically. Also
+        reopens a pool that was closed.
+        """
+        with self._cond:
+            self._closed = False
+            if (
+                self._maintenance_thread is not None
+                and self._maintenance_thread.is_alive()
+            ):
+                return
+            self._maintenance_thread = threading.Thread(
+                target=self._maintenance_loop, name="sandbox-pool", daemon=True
+            )
+        self._maintenance_thread.start()
+
+    def close(self):
+        """
+        Tear down every idle container. Checked out containers are torn down when
+        they are released.
+        """
+        with self._cond:
+            self._closed = True
+            entries = [
+                (key, entry[0]) for key, idle in self._idle.items() for entry in idle
+            ]
+            self._idle.clear()
+            self._cond.notify_all()
+        for key, evaluator in entries:
+            self._discard(key, evaluator)
+
+    def stats(self):
+        """
+        Return {key: {"size": ..., "idle": ..., "waiting": ...}} for every known key.
+        """
+        with self._cond:
+            return {
+                key: {
+                    "size": size,
+                    "idle": len(self._idle.get(key, ())),
+                    "waiting": self._waiting.get(key, 0),
+                }
+                for key, size in self._size.items()
+            }
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _checkout(self, key, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Sandbox pool is closed.")
+                idle = self._idle.setdefault(key, deque())
+                entry = None
+                if idle:
+                    # Most recently used first, so the oldest ones age out
+                    entry = idle.pop()
+                elif self._size.get(key, 0) < self.max_size:
+                    self._size[key] = self._size.get(key, 0) + 1
+                else:
+                    remaining = (
+                        None if deadline is None else deadline - time.monotonic()
+                    )
+                    if remaining is not None and remaining <= 0:
+                        raise PoolExhausted(f"No sandbox available for {key}.")
+                    self._waiting[key] = self._waiting.get(key, 0) + 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting[key] -= 1
+                    continue
+
+            if entry is None:
+                return self._create(key)
+
+            evaluator, _, last_check = entry
+            if time.monotonic() - last_check < self.health_check_interval:
+                return evaluator
+            if evaluator.is_healthy():
+                return evaluator
+            self._discard(key, evaluator)
+
+    def _create(self, key):
+        language, version, modules = self._unpack(key)
+        try:
+            evaluator = self.evaluator_classes[language](
+                version=version, modules=modules, tmp_dir=self._tmp_dir
+            )
+        except BaseException:
+            with self._cond:
+                self._size[key] -= 1
+                self._cond.notify()
+            raise
+        evaluator._pool_key = key
+        return evaluator
+
+    def _discard(self, key, evaluator):
+        with self._cond:
+            self._size[key] -= 1
+            self._cond.notify()
+        evaluator.close()
+
+    def _unpack(self, key):
+        language, version, modules = key
+        return language, version, list(modules)
+
+    def _maintenance_loop(self):
+        interval = max(1, min(self.idle_timeout, self.health_check_interval) / 2)
+        while not self._closed:
+            time.sleep(interval)
+            try:
+                self.evict_idle()
+            except Exception:
+                pass
@@ -0,0 +1,207 @@
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from .timing import phase
+
+# Labels put on every sandbox container, so a later process can tell which containers
+# were left behind by a worker that no longer exists
+OWNER_HOST_LABEL = "safe_eval.owner_host"
+OWNER_PID_LABEL = "safe_eval.owner_pid"
+
+
+def owner_labels():
+    """
+    Return the `docker run --label` arguments that mark a container as ours.
+    """
+    return [
+        "--label",
+        f"{OWNER_HOST_LABEL}={socket.gethostname()}",
+        "--label",
+        f"{OWNER_PID_LABEL}={os.getpid()}",
+    ]
+
+
+class Reaper:
+    """
+    Tears sandbox containers down on a background thread.
+
+    close() hands the container and its session directory over with submit() and
+    returns immediately. The thread collects whatever was submitted within
+    batch_interval and removes it with a single `docker rm -f`, so neither request
+    handlers nor the garbage collector ever wait on docker.
+    """
+
+    def __init__(self, batch_interval=0.5, max_batch=50):
+        """
+        :param batch_interval: seconds to wait for more containers before removing
+        :param max_batch: maximum number of containers per `docker rm -f`
+        """
+        self.batch_interval = batch_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, container, session_path=None):
+        """
+        Schedule removal of a container (None if it never started) and of its
+        session directory.
+        """
+        self._queue.put((container, session_path))
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="sandbox-reaper", daemon=True
+                )
+                self._thread.start()
+
+    @property
+    def pending(self):
+        """
+        Number of containers and session directories waiting to be removed.
+        """
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout=30):
+        """
+        Block until everything submitted so far is removed, or timeout seconds passed.
+        :return: True if the queue was drained
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=60)]
+            except queue.Empty:
+                # The thread is started again by the next submit()
+                return
+            deadline = time.monotonic() + self.batch_interval
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(
+                        self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                    )
+                except queue.Empty:
+                    break
+            try:
+                self._reap(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _reap(self, batch):
+        containers = [container for container, _ in batch if container is not None]
+        if containers:
+            with phase("teardown"):
+                remove_containers(containers)
+        for _, session_path in batch:
+            if session_path is not None:
+                shutil.rmtree(session_path, ignore_errors=True)
+
+
+def remove_containers(containers):
+    """
+    Force-remove containers in one docker call. Missing containers are ignored.
+    """
+    subprocess.run(
+        ["docker", "rm", "-f", *containers],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def sweep_orphans(jailfs_path, keep_repository, min_age=3600):
+    """
+    Remove what crashed workers left behind: containers labeled by a process of this
+    host that is gone, safe_eval_* images outside the image cache, and session
+    directories without a container.
+    :param jailfs_path: directory holding the session directories
+    :param keep_repository: image repository of the image cache, whose images stay
+    :param min_age: seconds a session directory without a container is left alone,
+        so sessions still building their image are not removed
+    :return: dict with the removed "containers", "images" and "sessions"
+    """
+    removed = {"containers": [], "images": [], "sessions": []}
+    if shutil.which("docker") is None:
+        return removed
+
+    result = subprocess.run(
+        [
+            "docker",
+            "ps",
+            "-a",
+            "--filter",
+            f"label={OWNER_HOST_LABEL}={socket.gethostname()}",
+            "--format",
+            '{{.Names}} {{.Label "' + OWNER_PID_LABEL + '"}}',
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    for line in result.stdout.decode("utf-8").splitlines():
+        name, _, pid = line.partition(" ")
+        if pid.isdigit() and not _process_exists(int(pid)):
+            removed["containers"].append(name)
+    if removed["containers"]:
+        remove_containers(removed["containers"])
+
+    result = subprocess.run(
+        ["docker", "images", "--format", "{{.Repository}}:{{.Tag}}"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    for image in result.stdout.decode("utf-8").splitlines():
+        repository = image.split(":", 1)[0]
+        if repository.startswith("safe_eval") and repository != keep_repository:
+            removed["images"].append(image)
+    if removed["images"]:
+        subprocess.run(
+            ["docker", "image", "rm", "-f", *removed["images"]],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    # Session directories are named after their container, whichever worker owns it
+    result = subprocess.run(
+        ["docker", "ps", "-a", "--format", "{{.Names}}"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    if result.returncode != 0:
+        return removed
+    live = set(result.stdout.decode("utf-8").split())
+    cutoff = time.time() - min_age
+    jailfs_path = Path(jailfs_path)
+    if jailfs_path.is_dir():
+        for entry in os.scandir(jailfs_path):
+            if not entry.name.startswith("safe_eval") or entry.name in live:
+                continue
+            if entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed["sessions"].append(entry.name)
+    return removed
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -1,5 +1,6 @@
 import json
 import os
+import re
 import shlex
 import shutil
 import subprocess
@@ -7,14 +8,22 @@ import uuid
 from pathlib import Path
 import stat
 
+from .backends import backend_class
+from .dependencies import validate_modules
+from .output import BoundedOutput
+from .reaper import Reaper
+from .scope_transfer import ScopeTransfer
+from .syntax_check import check_javascript, check_python, format_syntax_error
+from .timing import phase
+
 
 class SafeEval:
     """
     Base class that manages:
     1) Creating and cleaning up a temporary session directory
-    2) Copying nsjail files
-    3) Building and running a Docker container
-    4) Providing helper methods to execute commands inside the container via nsjail
+    2) Setting up the sandbox through a backend (see backends.py), by default a
+       Docker container built from a cached image
+    3) Providing helper methods to execute code in the sandbox via nsjail
 
     Child classes (e.g. SafeEvalPython, SafeEvalJavaScript) should override:
         - _create_dockerfile()
@@ -23,20 +32,52 @@ class SafeEval:
 
     max_timelimit = 100  # 100 seconds
 
-    def __init__(self, session_id=None, tmp_dir=None):
+    # Bytes of stdout and of stderr kept in memory per evaluation; the rest spills to disk
+    max_output_bytes = int(os.getenv("SAFE_EVAL_MAX_OUTPUT_BYTES", 1024**2))
+
+    # Containers and session directories are removed in batches in the background
+    reaper = Reaper()
+
+    # Scopes whose JSON is larger than this are written to a side file in the session
+    # volume instead of being inlined into the program source
+    scope_file_threshold = int(os.getenv("SAFE_EVAL_SCOPE_FILE_BYTES", 64 * 1024))
+
+    # Sandbox backend name or class (see backends.py), SAFE_EVAL_BACKEND when None
+    backend = None
+
+    # Files in the session directory that belong to the build context or the executor
+    # daemon, not to an evaluation
+    _volume_keep = {
+        "Dockerfile",
+        ".executor_daemon.py",
+        ".executor.sock",
+        ".zygote.sock",
+        ".node_pool.js",
+    }
+
+    # Run jobs in children forked from a warm interpreter with the session's modules
+    # already imported, instead of a fresh interpreter per job (see executor_daemon)
+    zygote = False
+
+    # Run jobs in warm worker threads of one persistent interpreter (node_pool.js)
+    node_pool = False
+
+    # Interpreter inside the container, the file extension it expects, the batch
+    # runner program with the call that starts it, and the typed array loader. Set by
+    # child classes.
+    interpreter = None
+    extension = None
+    _batch_runner = None
+    _batch_call = None
+    _array_loader = None
+
+    def __init__(self, session_id=None, tmp_dir=None, backend=None):
         # Directory of the current .py file
         self._module_path = Path(__file__).parent
-        self._container_has_started = False
         self._session_id = session_id
         self._random_string = self._random_word()
         self._session_path = None
-        self._seccomp_path = self._module_path / "settings/seccomp_profile.json"
-        self._docker_nsjail_base_command = (
-            "docker exec {session_id} nsjail "
-            "--user 99999 --group 99999 "
-            "--disable_proc --chroot / --really_quiet "
-            "--time_limit {time_limit} "
-        )
+        self._backend = None
 
         # Generate a unique session ID
         while True:
@@ -48,21 +89,6 @@ class SafeEval:
             if not os.path.exists(self._session_path):
                 break
 
-        if not subprocess.run("git --version", shell=True, capture_output=True).stdout.decode('utf-8').startswith("git version"):
-            raise Exception("Git is not installed or have no permission to access.")
-        if not subprocess.run("docker ps", shell=True, capture_output=True).stdout.decode('utf-8').startswith("CONTAINER ID"):
-            raise Exception("Docker is not installed or have no permission to access.")
-
-        # fetch nsjail
-        if not Path(self._module_path / ".nsjail").is_dir():
-            os.mkdir(self._module_path / ".nsjail")
-            
-            result = subprocess.run("git clone https://github.com/google/nsjail.git {module_path}/.nsjail".format(module_path=self._module_path), shell=True, stdout=subprocess.DEVNULL)
-            if result.returncode != 0:
-                shutil.rmtree(self._module_path / ".nsjail")
-                raise RuntimeError("Failed to clone nsjail, make sure that the internet is connected and the module directory is writable.")
-        
-
         # Create the .jailfs directory if needed
         if not (self._module_path / ".jailfs").is_dir():
             (self._module_path / ".jailfs").mkdir(parents=True, exist_ok=True)
@@ -70,134 +96,279 @@ class SafeEval:
         # Create the session path
         self._session_path.mkdir(parents=True, exist_ok=True)
 
-        # Copy nsjail files into the session
-        shutil.copytree(self._module_path / ".nsjail", self._session_path / ".nsjail")
-
-        # Let the child class provide the Dockerfile contents
-        self._create_dockerfile()
+        # Set the sandbox up, e.g. build the image and start the container
+        self._backend = backend_class(backend or self.backend)(self)
+        self._backend.prepare()
 
-        # Build the Docker image
-        self._build_docker_image()
+    def __enter__(self):
+        return self
 
-        # Run the Docker container in detached mode
-        self._run_container()
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def __del__(self):
         # Cleanup when the object is destroyed
-        if self._container_has_started:
-            try:
-                subprocess.run(
-                    ["docker", "stop", self._session_id],
-                    check=True,
-                    stdout=subprocess.DEVNULL,
-                )
-                subprocess.run(
-                    f"docker image remove {self._session_id}_image --no-prune",
-                    shell=True,
-                    check=True,
-                    stdout=subprocess.DEVNULL,
-                )
-            except Exception:
-                pass
+        self.close()
 
-        try:
-            shutil.rmtree(self._session_path)
-        except FileNotFoundError:
-            pass
+    def close(self):
+        """
+        Tear the sandbox down through the backend, which hands the container and the
+        session directory over to the reaper to remove them in the background.
+        Safe to call more than once.
+        """
+        backend = getattr(self, "_backend", None)
+        session_path = getattr(self, "_session_path", None)
+        self._backend = None
+        self._session_path = None
+        if backend is not None:
+            backend.teardown(session_path)
+        elif session_path is not None:
+            self.reaper.submit(None, session_path)
+
+    def is_healthy(self):
+        """
+        Return True if the session sandbox can still run programs, e.g. its container
+        is still running.
+        """
+        return self._backend is not None and self._backend.is_healthy()
+
+    def scrub_volume(self):
+        """
+        Remove everything the evaluations left in /volume so the container can be
+        handed to the next request. The Dockerfile and the executor daemon are
+        kept.
+        """
+        for entry in os.scandir(self._session_path):
+            if entry.name in self._volume_keep:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    @classmethod
+    def sweep_orphans(cls, tmp_dir=None):
+        """
+        Remove containers, images and session directories left behind by processes
+        that exited without closing their evaluators. Meant to run once at startup.
+        :param tmp_dir: base directory of the session directories, as passed to
+            __init__
+        :return: dict with the removed "containers", "images" and "sessions"
+        """
+        if tmp_dir is None:
+            tmp_dir = Path(__file__).parent / ".jailfs"
+        return backend_class(cls.backend).sweep_orphans(tmp_dir)
+
+    @staticmethod
+    def check_syntax(code):
+        """
+        Check code for syntax errors on the host, without touching the container.
+        :return: {"line", "column", "message"} of the first error, or None
+        """
+        return None
+
+    def eval_batch(
+        self,
+        items,
+        time_limit=max_timelimit,
+        item_time_limit=None,
+        max_output_bytes=None,
+    ):
+        """
+        Evaluate many (code, scope) items in a single sandboxed interpreter.
+        Each item gets its own time limit and its own stdout, and an error only fails
+        that item. Results are written to the result channel as one JSON line per item
+        (see helpers.extract_batch_results).
+        :param items: list of (code, scope) pairs
+        :param time_limit: time limit of the whole batch in seconds
+        :param item_time_limit: time limit of each item in seconds, defaults to time_limit
+        :param max_output_bytes: cap of the batch's own stdout and stderr
+        """
+        if item_time_limit is None:
+            item_time_limit = time_limit
+
+        with open(self._module_path / self._batch_runner, "r") as f:
+            runner = f.read()
+
+        items_json = json.dumps([[code, scope or {}] for code, scope in items])
+        wrapped_code = runner + self._batch_call.format(
+            items=json.dumps(items_json),
+            time_limit=json.dumps(item_time_limit),
+            marker=json.dumps(self._random_string),
+        )
+        return (
+            self._execute_code(
+                wrapped_code,
+                self.interpreter,
+                self.extension,
+                time_limit,
+                max_output_bytes,
+            ),
+            self._random_string,
+        )
+
+    def eval_stream(
+        self, code, time_limit=max_timelimit, scope=None, typed_arrays=None
+    ):
+        """
+        Evaluate code like eval(), but yield output while the code runs:
+            {"stream": "stdout" | "stderr", "data": str}  as output is produced
+            {"returncode": int, "returnValue": ...}       once, last
+        "returnValue" is only present when the code returned without raising. It is
+        read from the result channel, or from the marker line that is filtered out of
+        the stdout frames when the program ran without one.
+        typed_arrays is as in eval().
+        """
+        return_filter = ReturnValueFilter(self._random_string)
+        result = []
+        with self._scope_transfer(scope or {}, typed_arrays) as scope_transfer:
+            for frame in self._stream_code(
+                self._wrap_code(code, scope or {}, scope_transfer),
+                self.interpreter,
+                self.extension,
+                time_limit,
+            ):
+                if frame.get("stream") == "stdout":
+                    data = return_filter.feed(frame["data"])
+                    if data:
+                        yield {"stream": "stdout", "data": data}
+                elif "returncode" in frame:
+                    data = return_filter.finish()
+                    if data:
+                        yield {"stream": "stdout", "data": data}
+                    final = {"returncode": frame["returncode"]}
+                    if result:
+                        payload = json.loads(b"".join(result))
+                        final["returnValue"] = payload["returnValue"]
+                    elif return_filter.has_return_value:
+                        final["returnValue"] = return_filter.return_value
+                    yield final
+                elif "result" in frame:
+                    result.append(frame["result"])
+                else:
+                    yield frame
 
     # --------------------------------------------------------------------------
-    # Child classes should override the following method with their Dockerfile
+    # Child classes should override the following methods
     # --------------------------------------------------------------------------
-    def _create_dockerfile(self):
+    def _create_dockerfile(self, base_image):
         """
-        Return the contents of the Dockerfile as a string.
+        Write the session Dockerfile, built FROM base_image.
         This should be overridden by child classes.
         """
         raise NotImplementedError("Child class must implement _create_dockerfile().")
 
+    def _wrap_code(self, code, scope, scope_transfer=None):
+        """
+        Return the program that defines the scope, runs the code and prints its return
+        value after the random marker. Without a scope_transfer the whole scope is
+        inlined into the program.
+        This should be overridden by child classes.
+        """
+        raise NotImplementedError("Child class must implement _wrap_code().")
+
     # --------------------------------------------------------------------------
     # Internal helper methods
     # --------------------------------------------------------------------------
-    def _build_docker_image(self):
+    def _phase(self, name):
         """
-        Build the Docker image for this session.
+        Time a block as a phase of this evaluator, labeled with language and version.
         """
-        build_cmd = f"docker build --network=host -t {self._session_id}_image ."
-        result = subprocess.run(
-            build_cmd,
-            shell=True,
-            cwd=self._session_path,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-        )
-        if result.returncode != 0:
-            raise RuntimeError(
-                f"Failed to build docker image: {result.stderr.decode('utf-8')}"
-            )
+        return phase(name, self.language, getattr(self, "version", ""))
 
-    def _run_container(self):
+    def _scope_transfer(self, scope, typed_arrays=None):
         """
-        Run the Docker container in detached mode.
+        Write the large or typed parts of the scope to side files in the session
+        volume, see ScopeTransfer.
         """
-        run_cmd = (
-            f"docker run --rm --privileged --security-opt seccomp={self._seccomp_path} --name={self._session_id} "
-            f'-v "{self._session_path}:/volume" '
-            f"-d -it {self._session_id}_image"
+        backend = getattr(self, "_backend", None)
+        volume_path = backend.volume_path if backend is not None else None
+        return ScopeTransfer(
+            scope,
+            typed_arrays,
+            host_dir=self._session_path if volume_path is not None else None,
+            sandbox_dir=volume_path,
+            threshold=self.scope_file_threshold,
         )
-        result = subprocess.run(
-            run_cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
-        )
-        if result.returncode != 0:
-            raise RuntimeError(
-                "Failed to start docker container: " + result.stderr.decode("utf-8")
-            )
-        self._container_has_started = True
 
-    def _execute_file_in_volume(self, command_template, volume_filename, time_limit):
+    def _array_loader_source(self, scope_transfer):
         """
-        Execute a file inside the Docker container, using nsjail.
-        :param command_template: Something like
-            'docker exec {session_id} nsjail ... /usr/bin/python3 /volume/{volume_filename}'
-        :param volume_filename: The filename we will pass into the command
-        :param time_limit: The time limit in seconds
-        :return: dict with keys "stdout", "stderr", "returncode"
+        The typed array loader to put before the wrapped code, if it needs one.
         """
-        volume_filename = str(volume_filename)
-        command = command_template.format(
-            session_id=self._session_id,
-            time_limit=time_limit,
-            volume_filename=volume_filename[4:],
-        )
-        # Change file permissions to 755
-        print("path existence", os.path.exists(volume_filename))
-        print("path is", volume_filename)
-        file_status = os.stat(volume_filename)
-
-        # Extract the file's permission bits
-        permissions = file_status.st_mode
-        subprocess.run(['cat', 'PythonSafeEval/.jailfs/' + self._session_id], check=True)
-        # Print the file permissions in 777 format
-        print("File permissions in 777 format: {:o}".format(permissions & 0o777))
+        if not scope_transfer.arrays:
+            return ""
+        with open(self._module_path / self._array_loader, "r") as f:
+            return f.read() + "\n"
 
+    def _syntax_error_result(self, syntax_error):
+        """
+        The _execute_code()-shaped result of code rejected by check_syntax().
+        """
+        return {
+            "stdout": "",
+            "stderr": format_syntax_error(syntax_error),
+            "returncode": 1,
+            "syntax_error": syntax_error,
+        }
+
+    def _execute_code(
+        self, code, interpreter, extension, time_limit, max_output_bytes=None
+    ):
+        """
+        Run code in the session sandbox and collect its output.
+        :param code: the full program to run
+        :param interpreter: absolute path of the interpreter inside the sandbox
+        :param extension: file extension the interpreter expects, e.g. ".py"
+        :param time_limit: The time limit in seconds
+        :param max_output_bytes: cap of stdout and of stderr kept in memory, defaults
+            to max_output_bytes
+        :return: dict with keys "stdout", "stderr", "returncode", "result" if the
+            program wrote to the result channel, and "truncation" if an output
+            stream went over the cap
+        """
+        if max_output_bytes is None:
+            max_output_bytes = self.max_output_bytes
+        outputs = {
+            "stdout": BoundedOutput(max_output_bytes),
+            "stderr": BoundedOutput(max_output_bytes),
+        }
+        result = []
+        returncode = None
         try:
-            result = subprocess.run(
-                command,
-                shell=True,
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            return {
-                "stdout": result.stdout.decode("utf-8"),
-                "stderr": result.stderr.decode("utf-8"),
-                "returncode": result.returncode,
-            }
-        except subprocess.CalledProcessError as e:
-            return {
-                "stdout": e.stdout.decode("utf-8"),
-                "stderr": e.stderr.decode("utf-8"),
-                "returncode": e.returncode,
+            for frame in self._stream_code(code, interpreter, extension, time_limit):
+                if "stream" in frame:
+                    outputs[frame["stream"]].write(frame["data"])
+                elif "result" in frame:
+                    result.append(frame["result"])
+                else:
+                    returncode = frame["returncode"]
+        finally:
+            for output in outputs.values():
+                output.close()
+
+        response = {
+            "stdout": outputs["stdout"].getvalue(),
+            "stderr": outputs["stderr"].getvalue(),
+            "returncode": returncode,
+        }
+        if result:
+            response["result"] = b"".join(result)
+        if any(output.truncated for output in outputs.values()):
+            response["truncation"] = {
+                name: output.metadata() for name, output in outputs.items()
             }
+        return response
+
+    def _stream_code(self, code, interpreter, extension, time_limit):
+        """
+        Like _execute_code(), but yield the backend's frames ({"stream", "data"},
+        {"result"} and a final {"returncode"}) as the output is produced.
+        """
+        with self._phase("exec"):
+            yield from self._backend.execute(code, interpreter, extension, time_limit)
 
     # def _execute_code_in_memory(self, command_template, code_string, time_limit):
     #     """
@@ -237,6 +408,50 @@ class SafeEval:
         return str(uuid.uuid4())
 
 
+class ReturnValueFilter:
+    """
+    Removes the `<marker>{"returnValue": ...}` line from streamed stdout and keeps the
+    parsed value. Text that could be the start of the marker is held back until the
+    next chunk shows whether it is.
+    """
+
+    def __init__(self, marker):
+        self._marker = marker
+        self._buffer = ""
+        self._payload = None
+        self.has_return_value = False
+        self.return_value = None
+
+    def feed(self, data):
+        if self._payload is not None:
+            self._payload += data
+            return ""
+        self._buffer += data
+        index = self._buffer.find(self._marker)
+        if index != -1:
+            out, self._payload = self._buffer[:index], self._buffer[index:]
+            self._buffer = ""
+            return out
+        # Keep back a suffix that may be a partial marker
+        keep = len(self._marker) - 1
+        out, self._buffer = self._buffer[:-keep], self._buffer[-keep:]
+        return out
+
+    def finish(self):
+        out, self._buffer = self._buffer, ""
+        if self._payload is not None:
+            try:
+                value, end = json.JSONDecoder().raw_decode(
+                    self._payload, len(self._marker)
+                )
+                self.return_value = value["returnValue"]
+                self.has_return_value = True
+                out += self._payload[end:].lstrip("\n")
+            except (ValueError, KeyError, TypeError):
+                out += self._payload
+        return out
+
+
 # ------------------------------------------------------------------------------
 # SafeEvalPython
 # ------------------------------------------------------------------------------
@@ -247,34 +462,70 @@ class SafeEvalPython(SafeEval):
     Child class for evaluating Python code.
     """
 
-    def __init__(self, version=None, modules=None, tmp_dir=None):
+    language = "python"
+    default_version = "3.8"
+    interpreter = "/usr/bin/python3"
+    extension = ".py"
+    _batch_runner = "batch_runner.py"
+    _batch_call = "\nmain(json.loads({items}), {time_limit}, {marker})\n"
+    _array_loader = "array_loader.py"
+    check_syntax = staticmethod(check_python)
+    zygote = os.getenv("SAFE_EVAL_PYTHON_ZYGOTE", "0") == "1"
+
+    def __init__(self, version=None, modules=None, tmp_dir=None, backend=None):
         """
         :param version: Python version tag, e.g. 3.8
-        :param modules: list of pip packages to install
+        :param modules: list of pip packages to install, each in its own image layer
+            (see dependencies.py)
         :param tmp_dir: optionally override the base directory for .jailfs
+        :param backend: sandbox backend name, e.g. "docker" or "host"
         """
-        self._container_has_started = False
-        self.python_version = version if version is not None else "3.8"
-        self.modules = modules if modules else []
+        self.python_version = version if version is not None else self.default_version
+        self.modules = validate_modules(self.language, modules)
         self._session_id = "safe_eval_python" + self._random_word()
-        super().__init__(tmp_dir=tmp_dir, session_id=self._session_id)
+        super().__init__(tmp_dir=tmp_dir, session_id=self._session_id, backend=backend)
 
-    def _create_dockerfile(self):
+    @property
+    def version(self):
+        return self.python_version
+
+    @property
+    def preload_modules(self):
+        """
+        Import names of the session's pip packages, for the zygote to import ahead of
+        time. Best effort: a package whose import name differs is just not preloaded.
+        """
+        return [
+            re.split(r"[<>=!~\[;@ ]", module, 1)[0].replace("-", "_")
+            for module in self.modules
+        ]
+
+    def _create_dockerfile(self, base_image):
         # create Dockerfile
         with open(self._module_path / "Dockerfile_template_python.txt", "r") as f:
             Dockerfile = f.read()
 
         Dockerfile = Dockerfile.format(
-            version=self.python_version,
-            modules="RUN pip3 install " + " ".join(self.modules),
+            base_image=base_image, version=self.python_version
         )
 
         with open(self._session_path / "Dockerfile", "w+") as f:
             f.write(Dockerfile)
 
-    def eval(self, code=None, time_limit=SafeEval.max_timelimit, scope=None):
+    def eval(
+        self,
+        code=None,
+        time_limit=SafeEval.max_timelimit,
+        scope=None,
+        max_output_bytes=None,
+        typed_arrays=None,
+    ):
         """
         Evaluate Python code with optional time limit (seconds) and scope dict.
+        Output past max_output_bytes per stream is truncated and spilled to disk.
+        Code with a syntax error is rejected before it reaches the container.
+        Scope lists named in typed_arrays ({variable: dtype}) arrive as read-only
+        memory-mapped numpy arrays (memoryviews when numpy is not installed).
         """
         if code is None:
             return None
@@ -282,44 +533,73 @@ class SafeEvalPython(SafeEval):
         if scope is None:
             scope = {}
 
-        # Build Python lines that define each variable
-        scope_definitions = "\n".join(
-            f"{var} = {json.dumps(val)};" for var, val in scope.items()
+        syntax_error = self.check_syntax(code)
+        if syntax_error is not None:
+            return self._syntax_error_result(syntax_error), self._random_string
+
+        with self._scope_transfer(scope, typed_arrays) as scope_transfer:
+            wrapped_code = self._wrap_code(code, scope, scope_transfer)
+            return (
+                self._execute_code(
+                    wrapped_code,
+                    self.interpreter,
+                    self.extension,
+                    time_limit,
+                    max_output_bytes,
+                ),
+                self._random_string,
+            )
+
+    def _wrap_code(self, code, scope, scope_transfer=None):
+        if scope_transfer is None:
+            scope_transfer = ScopeTransfer(scope)
+
+        # Build Python lines that define each variable: inlined, read from the scope
+        # side file with one json.load, or memory-mapped from a .npy file. The side
+        # file is read by a helper, so the only names bound in the user's function
+        # are the scope variables themselves.
+        scope_lines = [
+            f"{var} = {json.dumps(val)};" for var, val in scope_transfer.inline.items()
+        ]
+        scope_loader = ""
+        if scope_transfer.json_file is not None:
+            scope_loader = (
+                "def __safe_eval_load_scope(path, names):\n"
+                "    with open(path) as f:\n"
+                "        scope = json.load(f)\n"
+                "    return [scope[name] for name in names]\n"
+            )
+            names = scope_transfer.file_variables
+            scope_lines.append(
+                "".join(f"{var}, " for var in names)
+                + f"= __safe_eval_load_scope({json.dumps(scope_transfer.json_file)}, "
+                + f"{json.dumps(names)})"
+            )
+        scope_lines.extend(
+            f"{var} = __safe_eval_load_array({json.dumps(path)})"
+            for var, path in scope_transfer.arrays.items()
         )
+        scope_definitions = "\n".join(scope_lines)
 
-        # Wrap the code to capture the return value
-        wrapped_code = (
-            "import json\n"
-            "try:\n"
+        # Wrap the code to capture the return value. It goes to the result fd passed
+        # as the first argument, or after the marker on stdout when there is none.
+        return (
+            self._array_loader_source(scope_transfer) + "import json\n"
+            "import os\n"
+            "import sys\n" + scope_loader + "try:\n"
             "    def user_code():\n"
             "        user_code = None\n"
             "        " + scope_definitions.replace("\n", "\n        ") + "\n"
             "        " + code.replace("\n", "\n        ") + "\n"  # Indent user code
-            "    result = user_code()\n"
-            "    print('"
-            + self._random_string
-            + "' + json.dumps({'returnValue': result}))\n"
+            "    payload = json.dumps({'returnValue': user_code()})\n"
             "except Exception as e:\n"
             "    print(json.dumps({'error': str(e)}), file=sys.stderr)\n"
-        )
-
-        # Write to a temporary file in the volume
-        volume_filename = self._random_word() + ".py"
-        with open(self._session_path / volume_filename, "w", encoding="utf-8") as f:
-            f.write(wrapped_code)
-
-        # Command template for running the .py file
-        python_command = (
-            "docker exec {session_id} nsjail "
-            "--user 99999 --group 99999 "
-            "--disable_proc --chroot / --really_quiet "
-            "--time_limit {time_limit} "
-            "/usr/bin/python3 {volume_filename}"
-        )
-
-        return (
-            self._execute_file_in_volume(python_command, (self._session_path / volume_filename), time_limit),
-            self._random_string,
+            "    sys.exit(1)\n"
+            "if len(sys.argv) > 1:\n"
+            "    with os.fdopen(int(sys.argv[1]), 'w') as channel:\n"
+            "        channel.write(payload)\n"
+            "else:\n"
+            "    print('" + self._random_string + "' + payload)\n"
         )
 
 
@@ -333,36 +613,57 @@ class SafeEvalJavaScript(SafeEval):
     Child class for evaluating JavaScript code (Node.js).
     """
 
-    def __init__(self, version=None, modules=None, tmp_dir=None):
+    language = "javascript"
+    default_version = "16"
+    interpreter = "/usr/bin/node"
+    extension = ".js"
+    _batch_runner = "batch_runner.js"
+    _batch_call = "\nmain(JSON.parse({items}), {time_limit}, {marker});\n"
+    _array_loader = "array_loader.js"
+    check_syntax = staticmethod(check_javascript)
+    node_pool = os.getenv("SAFE_EVAL_NODE_POOL", "0") == "1"
+
+    def __init__(self, version=None, modules=None, tmp_dir=None, backend=None):
         """
         :param version: Node.js version tag, e.g. '16',  etc.
-        :param modules: list of npm packages to install globally
+        :param modules: list of npm packages to install globally, each in its own
+            image layer (see dependencies.py)
         :param tmp_dir: optionally override the base directory for .jailfs
+        :param backend: sandbox backend name, e.g. "docker" or "host"
         """
-        self._container_has_started = False
-        self.node_version = version if version is not None else "16"
-        self.modules = modules if modules else []
+        self.node_version = version if version is not None else self.default_version
+        self.modules = validate_modules(self.language, modules)
         self._session_id = "safe_eval_javascript" + self._random_word()
-        super().__init__(tmp_dir=tmp_dir, session_id=self._session_id)
+        super().__init__(tmp_dir=tmp_dir, session_id=self._session_id, backend=backend)
 
-    def _create_dockerfile(self):
+    @property
+    def version(self):
+        return self.node_version
+
+    def _create_dockerfile(self, base_image):
         # create Dockerfile
         with open(self._module_path / "Dockerfile_template_javascript.txt", "r") as f:
             Dockerfile = f.read()
 
-        Dockerfile = Dockerfile.format(
-            version=self.node_version,
-            modules=(
-                "RUN npm install -g " + " ".join(self.modules) if self.modules else ""
-            ),
-        )
+        Dockerfile = Dockerfile.format(base_image=base_image, version=self.node_version)
 
         with open(self._session_path / "Dockerfile", "w+") as f:
             f.write(Dockerfile)
 
-    def eval(self, code=None, time_limit=SafeEval.max_timelimit, scope=None):
+    def eval(
+        self,
+        code=None,
+        time_limit=SafeEval.max_timelimit,
+        scope=None,
+        max_output_bytes=None,
+        typed_arrays=None,
+    ):
         """
         Evaluate JS code with optional time limit (seconds) and scope dict.
+        Output past max_output_bytes per stream is truncated and spilled to disk.
+        Code with a syntax error is rejected before it reaches the container.
+        Scope lists named in typed_arrays ({variable: dtype}) arrive as typed arrays
+        with their shape in a `shape` property.
         """
         if code is None:
             return None
@@ -370,36 +671,80 @@ class SafeEvalJavaScript(SafeEval):
         if scope is None:
             scope = {}
 
-        # Prepend scope variables as `let x = ...;`
-        scope_definitions = "\n".join(
-            f"let {var} = {json.dumps(val)};" for var, val in scope.items()
+        syntax_error = self.check_syntax(code)
+        if syntax_error is not None:
+            return self._syntax_error_result(syntax_error), self._random_string
+
+        with self._scope_transfer(scope, typed_arrays) as scope_transfer:
+            wrapped_code = self._wrap_code(code, scope, scope_transfer)
+            return (
+                self._execute_code(
+                    wrapped_code,
+                    self.interpreter,
+                    self.extension,
+                    time_limit,
+                    max_output_bytes,
+                ),
+                self._random_string,
+            )
+
+    def _wrap_code(self, code, scope, scope_transfer=None):
+        if scope_transfer is None:
+            scope_transfer = ScopeTransfer(scope)
+
+        # Prepend scope variables as `let x = ...;`, inlined, read from the scope side
+        # file with one JSON.parse, or loaded from a .npy file. The wrapper's own
+        # names are prefixed so they cannot clash with scope variables.
+        scope_lines = [
+            f"let {var} = {json.dumps(val)};"
+            for var, val in scope_transfer.inline.items()
+        ]
+        if scope_transfer.json_file is not None:
+            scope_lines.append(
+                "const __safeEvalScope = JSON.parse(require('fs').readFileSync("
+                f"{json.dumps(scope_transfer.json_file)}, 'utf8'));"
+            )
+            scope_lines.extend(
+                f"let {var} = __safeEvalScope[{json.dumps(var)}];"
+                for var in scope_transfer.file_variables
+            )
+        scope_lines.extend(
+            f"let {var} = __safeEvalLoadArray({json.dumps(path)});"
+            for var, path in scope_transfer.arrays.items()
+        )
+        scope_definitions = self._array_loader_source(scope_transfer) + "\n".join(
+            scope_lines
         )
 
-        # Wrap the code to capture the return value
-        wrapped_code = (
+        # Wrap the code to capture the return value. It goes to the result fd passed
+        # as the first argument, or after the marker on stdout when there is none.
+        # node_pool.js caches the compiled code after the body marker, which is the
+        # same for every run of this code
+        return (
             scope_definitions
+            + "\n// safe-eval: body"
+            + "\nlet __safeEvalPayload;"
             + "\ntry {"
-            + f"\n  const result = (() => {{ {code} }})();"
-            + "\n  console.log('"
-            + self._random_string
-            + "' + JSON.stringify({ returnValue: result }));"
+            + f"\n  const __safeEvalResult = (() => {{ {code} }})();"
+            + "\n  __safeEvalPayload = JSON.stringify({"
+            + " returnValue: __safeEvalResult });"
             + "\n} catch (error) {"
             + "\n  console.error(JSON.stringify({ error: error.message }));"
             + "\n}"
-        )
-
-        # Write to a temporary file in the volume
-        volume_filename = self._random_word() + ".js"
-        with open(self._session_path / volume_filename, "w", encoding="utf-8") as f:
-            f.write(wrapped_code)
-
-        # Command template for running the .js file
-        node_command = (
-            self._docker_nsjail_base_command + "/usr/bin/node /volume/{volume_filename}"
-        )
-        return (
-            self._execute_file_in_volume(node_command, volume_filename, time_limit),
-            self._random_string,
+            + "\nif (__safeEvalPayload !== undefined && process.argv.length > 2) {"
+            + "\n  const fs = require('fs');"
+            + "\n  const fd = Number(process.argv[2]);"
+            + "\n  const buffer = Buffer.from(__safeEvalPayload);"
+            + "\n  let offset = 0;"
+            + "\n  while (offset < buffer.length) {"
+            + "\n    offset += fs.writeSync(fd, buffer, offset);"
+            + "\n  }"
+            + "\n  fs.closeSync(fd);"
+            + "\n} else if (__safeEvalPayload !== undefined) {"
+            + "\n  console.log('"
+            + self._random_string
+            + "' + __safeEvalPayload);"
+            + "\n}"
         )
 
 
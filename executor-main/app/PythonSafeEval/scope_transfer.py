@@ -0,0 +1,190 @@
+import array
+import json
+import os
+import sys
+import uuid
+from pathlib import Path
+
+# Typed array dtypes: name -> (.npy descr, array module typecode). All little-endian,
+# the byte order of every platform the sandboxes run on.
+DTYPES = {
+    "int8": ("|i1", "b"),
+    "uint8": ("|u1", "B"),
+    "int16": ("<i2", "h"),
+    "uint16": ("<u2", "H"),
+    "int32": ("<i4", "i"),
+    "uint32": ("<u4", "I"),
+    "float32": ("<f4", "f"),
+    "float64": ("<f8", "d"),
+}
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+class ScopeError(ValueError):
+    """
+    The scope cannot be sent the way it was asked for, e.g. a ragged typed array.
+    """
+
+
+def check_typed_arrays(scope, typed_arrays):
+    """
+    Validate a {variable: dtype} mapping against the scope, including that every
+    array is rectangular and fits its dtype, so a request is rejected before it
+    queues for a sandbox.
+    :return: an error message, or None if every entry names a list in the scope that
+        can be sent as the dtype
+    """
+    if not typed_arrays:
+        return None
+    if not isinstance(typed_arrays, dict):
+        return "'typed_arrays' must map scope variables to dtypes."
+    for name, dtype in typed_arrays.items():
+        if dtype not in DTYPES:
+            return (
+                f"Unsupported dtype for {name}: {dtype}, expected one of: "
+                + ", ".join(DTYPES)
+            )
+        if not isinstance((scope or {}).get(name), list):
+            return f"Typed array {name} must be a list in the scope."
+        try:
+            _pack(scope[name], dtype)
+        except ScopeError as e:
+            return f"Typed array {name}: {e}"
+    return None
+
+
+def _pack(values, dtype):
+    """
+    Flatten a (nested) list of numbers into a little-endian array of dtype.
+    :return: (shape, array.array)
+    :raises ScopeError: if the list is ragged or holds something other than numbers
+    """
+    shape = []
+    level = values
+    while isinstance(level, list):
+        shape.append(len(level))
+        level = level[0] if level else None
+
+    flat = []
+
+    def flatten(value, depth):
+        if depth == len(shape):
+            if isinstance(value, list) or isinstance(value, bool):
+                raise ScopeError("Typed arrays must be rectangular lists of numbers.")
+            flat.append(value)
+            return
+        if not isinstance(value, list) or len(value) != shape[depth]:
+            raise ScopeError("Typed arrays must be rectangular lists of numbers.")
+        for item in value:
+            flatten(item, depth + 1)
+
+    flatten(values, 0)
+    _, typecode = DTYPES[dtype]
+    try:
+        data = array.array(typecode, flat)
+    except (TypeError, OverflowError) as e:
+        raise ScopeError(f"Typed array does not fit {dtype}: {e}") from None
+    if sys.byteorder != "little":
+        data.byteswap()
+    return shape, data
+
+
+def write_npy(path, values, dtype):
+    """
+    Write a (nested) list of numbers as a C-ordered .npy file, without numpy.
+    :return: the array's shape
+    :raises ScopeError: if the list is ragged or holds something other than numbers
+    """
+    shape, data = _pack(values, dtype)
+    descr, _ = DTYPES[dtype]
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({}), }}".format(
+        descr, "".join(f"{size}, " for size in shape)
+    )
+    # The data starts at a multiple of 64 bytes, so it can be viewed in place
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + " " * padding + "\n").encode("latin1")
+    with open(path, "wb") as f:
+        f.write(NPY_MAGIC + len(header).to_bytes(2, "little") + header)
+        data.tofile(f)
+    return shape
+
+
+class ScopeTransfer:
+    """
+    Decides how the scope of one evaluation reaches the program.
+
+    Small scopes are inlined into the program source as before. A scope whose JSON is
+    larger than threshold bytes is written once to a side file in the session volume,
+    which the program loads with a single decode call instead of parsing it as code.
+    Variables listed in typed_arrays always go to .npy files, opened as memory-mapped
+    numpy arrays (or memoryviews without numpy) in Python and as typed arrays in Node.
+
+    Used as a context manager; the side files are removed on exit.
+    """
+
+    def __init__(
+        self, scope, typed_arrays=None, host_dir=None, sandbox_dir=None, threshold=0
+    ):
+        """
+        :param scope: {variable: JSON value}
+        :param typed_arrays: {variable: dtype} of scope lists to send as typed arrays
+        :param host_dir: session volume on the host, None to inline everything
+        :param sandbox_dir: the same directory as the program sees it
+        :param threshold: bytes of scope JSON above which it goes to a side file
+        """
+        self.inline = {}
+        self.json_file = None
+        self.file_variables = []
+        self.arrays = {}
+        self._host_files = []
+
+        typed_arrays = typed_arrays or {}
+        rest = {
+            name: value for name, value in scope.items() if name not in typed_arrays
+        }
+        if host_dir is None:
+            if typed_arrays:
+                raise ScopeError("Typed arrays need a session volume.")
+            self.inline = rest
+            return
+
+        try:
+            for name, dtype in typed_arrays.items():
+                self.arrays[name] = self._side_file(host_dir, sandbox_dir, ".npy")
+                write_npy(self._host_files[-1], scope[name], dtype)
+
+            if rest:
+                encoded = json.dumps(rest)
+                if len(encoded) > threshold:
+                    self.json_file = self._side_file(host_dir, sandbox_dir, ".json")
+                    with open(self._host_files[-1], "w") as f:
+                        f.write(encoded)
+                    self.file_variables = list(rest)
+                else:
+                    self.inline = rest
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for path in self._host_files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._host_files = []
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _side_file(self, host_dir, sandbox_dir, suffix):
+        name = f".scope-{uuid.uuid4().hex}{suffix}"
+        self._host_files.append(Path(host_dir) / name)
+        return f"{sandbox_dir}/{name}"
@@ -0,0 +1,511 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+from .safe_eval import SafeEval, SafeEvalPython
+
+
+class SessionError(Exception):
+    """
+    Base class of the errors of stateful sessions.
+    """
+
+    # How the sandbox manager reports the error to workers
+    kind = "session_error"
+
+
+class SessionNotFound(SessionError):
+    """
+    Raised for a session id that does not exist, or no longer does.
+    """
+
+    kind = "session_not_found"
+
+
+class SessionBusy(SessionError):
+    """
+    Raised when a session is asked to run a cell while it is still running one.
+    """
+
+    kind = "session_busy"
+
+
+class SessionLost(SessionError):
+    """
+    Raised when a session's interpreter is gone: it went over its memory or CPU
+    budget or a cell's time limit, or the session was evicted. Its state is lost.
+    """
+
+    kind = "session_lost"
+
+
+class SessionsExhausted(SessionError):
+    """
+    Raised when no new session can start because every session slot the tenant may
+    use is busy.
+    """
+
+    kind = "sessions_exhausted"
+
+
+# _evict_lru() default: the session may belong to any tenant, including None
+_ANY_TENANT = object()
+
+
+def available_memory():
+    """
+    Bytes of memory the host can still hand out without swapping, None if unknown.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class InterpreterSession:
+    """
+    One long-lived interpreter (session_runner.py) in a sandbox of its own. Cells run
+    one at a time in the interpreter's namespace, which persists between them.
+    """
+
+    runner = "session_runner.py"
+
+    # Seconds past a cell's time limit before the interpreter is killed, for cells
+    # stuck where the in-sandbox alarm cannot interrupt them
+    kill_grace = 5
+
+    def __init__(self, session_id, evaluator, memory_limit, cpu_limit, tenant=None):
+        """
+        :param session_id: id of the session
+        :param evaluator: SafeEval whose sandbox the session owns until it closes
+        :param memory_limit: address space limit of the interpreter in bytes
+        :param cpu_limit: CPU seconds the interpreter may use over its lifetime
+        :param tenant: tenant that started the session, None for the default one
+        """
+        self.id = session_id
+        self.tenant = tenant
+        self.evaluator = evaluator
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._lost = None
+
+        backend = evaluator._backend
+        shutil.copy(
+            evaluator._module_path / self.runner,
+            evaluator._session_path / f".{self.runner}",
+        )
+        # The runner sends stray fd 1 writes to stderr, which is discarded
+        self._process = backend.start_interpreter(
+            f"{backend.volume_path}/.{self.runner}",
+            memory_limit,
+            int(cpu_limit),
+            stderr=subprocess.DEVNULL,
+        )
+
+    @property
+    def busy(self):
+        return self._lock.locked()
+
+    @property
+    def alive(self):
+        return self._lost is None and self._process.poll() is None
+
+    def evaluate(
+        self, code, scope=None, time_limit=SafeEval.max_timelimit, max_output_bytes=None
+    ):
+        """
+        Run code in the session's namespace.
+        :return: dict with "stdout", "stderr" and either "returnValue" or "error",
+            plus "truncated" when the output went over max_output_bytes
+        :raises ValueError: if scope is not a dict
+        :raises SessionBusy: if the session is running another cell
+        :raises SessionLost: if the interpreter died, e.g. over its budget
+        """
+        if scope is not None and not isinstance(scope, dict):
+            raise ValueError("'scope' must be an object.")
+        if not self._lock.acquire(blocking=False):
+            raise SessionBusy(f"Session {self.id} is running another cell.")
+        try:
+            if not self.alive:
+                raise SessionLost(self._lost or self._exit_reason())
+            self.last_used = time.monotonic()
+            request = {
+                "code": code,
+                "scope": scope or {},
+                "time_limit": time_limit,
+                "max_output_bytes": max_output_bytes or SafeEval.max_output_bytes,
+            }
+            watchdog = threading.Timer(time_limit + self.kill_grace, self._kill)
+            watchdog.daemon = True
+            watchdog.start()
+            try:
+                self._process.stdin.write(json.dumps(request).encode("utf-8") + b"\n")
+                self._process.stdin.flush()
+                line = self._process.stdout.readline()
+            except OSError:
+                line = b""
+            finally:
+                watchdog.cancel()
+            if not line:
+                # The interpreter closes its stdout a moment before it can be reaped
+                try:
+                    self._process.wait(timeout=self.kill_grace)
+                except subprocess.TimeoutExpired:
+                    self._kill("The session's interpreter stopped responding.")
+                raise SessionLost(self._lost or self._exit_reason())
+            self.last_used = time.monotonic()
+            return json.loads(line)
+        finally:
+            self._lock.release()
+
+    def close(self, reason="Session closed."):
+        """
+        Stop the interpreter and tear the session's sandbox down.
+        """
+        if self._lost is None:
+            self._lost = reason
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        self._kill(reason)
+        self.evaluator.close()
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _kill(self, reason="A cell went over its time limit; the session was lost."):
+        if self._lost is None and self._process.poll() is None:
+            self._lost = reason
+        if self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+
+    def _exit_reason(self):
+        # Killed directly, or under nsjail or `docker exec`, which exit with 128 + n
+        returncode = self._process.poll() or 0
+        if returncode < 0 or returncode > 128:
+            return (
+                "The session's interpreter was killed (signal "
+                f"{abs(returncode) % 128}), most likely over its memory or CPU budget."
+            )
+        return "The session's interpreter exited."
+
+
+class SessionManager:
+    """
+    Stateful sessions of the host, each with a long-lived interpreter in a sandbox
+    of its own (see InterpreterSession).
+
+    - Every interpreter runs under a memory limit and a lifetime CPU budget.
+    - Sessions idle for longer than idle_timeout are closed.
+    - A tenant (see main.scheduling) has at most max_sessions_per_tenant sessions.
+      When it is at its cap, or all max_sessions are open, it only evicts its own
+      least recently used idle session, so tenants cannot take each other's
+      sessions away.
+    - When the host's available memory drops below min_available_memory, the least
+      recently used idle sessions of any tenant are evicted.
+    Closed and evicted sessions are remembered for a while, so that their clients
+    learn why the session is gone instead of just getting "not found".
+    """
+
+    evaluator_class = SafeEvalPython
+
+    # Closed sessions whose reason is remembered
+    closed_history = 1024
+
+    def __init__(
+        self,
+        max_sessions=32,
+        max_sessions_per_tenant=None,
+        idle_timeout=600,
+        memory_limit=512 * 1024**2,
+        cpu_limit=300,
+        min_available_memory=512 * 1024**2,
+        tmp_dir=None,
+        backend=None,
+    ):
+        """
+        :param max_sessions: sessions open at the same time
+        :param max_sessions_per_tenant: sessions one tenant may have open at the
+            same time, None for max_sessions
+        :param idle_timeout: seconds a session is kept without being used
+        :param memory_limit: address space limit of each interpreter in bytes
+        :param cpu_limit: CPU seconds each interpreter may use over its lifetime
+        :param min_available_memory: bytes of host memory to keep available by
+            evicting sessions
+        :param tmp_dir: optionally override the base directory for .jailfs
+        :param backend: sandbox backend name, e.g. "docker" or "host"
+        """
+        self.max_sessions = max_sessions
+        self.max_sessions_per_tenant = max_sessions_per_tenant or max_sessions
+        self.idle_timeout = idle_timeout
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.min_available_memory = min_available_memory
+        self._tmp_dir = tmp_dir
+        self._backend = backend
+        self._lock = threading.Lock()
+        # session id -> InterpreterSession, least recently used first
+        self._sessions = OrderedDict()
+        # session id -> reason, of recently closed sessions
+        self._closed = OrderedDict()
+        # tenant -> slots taken by its sessions that are still starting
+        self._starting = Counter()
+        self._maintenance_thread = None
+        self._stopped = False
+
+    # --------------------------------------------------------------------------
+    # Public API
+    # --------------------------------------------------------------------------
+    def create(self, version=None, modules=None, tenant=None):
+        """
+        Start a session for tenant. If the tenant is at its cap or every slot is
+        taken, the tenant's least recently used idle session is evicted.
+        :return: the session id
+        :raises SessionsExhausted: if no slot is free and every session of the
+            tenant is busy
+        """
+        self.collect()
+        with self._lock:
+            open_sessions = len(self._sessions) + sum(self._starting.values())
+            tenant_sessions = self._starting[tenant] + sum(
+                session.tenant == tenant for session in self._sessions.values()
+            )
+            if (
+                open_sessions >= self.max_sessions
+                or tenant_sessions >= self.max_sessions_per_tenant
+            ):
+                reason = "Evicted to make room for a new session."
+                if not self._evict_lru(reason, tenant=tenant):
+                    if tenant_sessions >= self.max_sessions_per_tenant:
+                        raise SessionsExhausted(
+                            f"All {self.max_sessions_per_tenant} sessions of the "
+                            "tenant are busy."
+                        )
+                    raise SessionsExhausted(
+                        f"All {self.max_sessions} sessions are taken."
+                    )
+            self._starting[tenant] += 1
+        try:
+            evaluator = self.evaluator_class(
+                version=version,
+                modules=modules,
+                tmp_dir=self._tmp_dir,
+                backend=self._backend,
+            )
+            try:
+                session = InterpreterSession(
+                    "session_" + uuid.uuid4().hex,
+                    evaluator,
+                    self.memory_limit,
+                    self.cpu_limit,
+                    tenant,
+                )
+            except BaseException:
+                evaluator.close()
+                raise
+        finally:
+            with self._lock:
+                self._starting[tenant] -= 1
+                if not self._starting[tenant]:
+                    del self._starting[tenant]
+        with self._lock:
+            self._sessions[session.id] = session
+        return session.id
+
+    def evaluate(
+        self,
+        session_id,
+        code,
+        scope=None,
+        time_limit=SafeEval.max_timelimit,
+        max_output_bytes=None,
+    ):
+        """
+        Run code in a session, see InterpreterSession.evaluate().
+        :raises SessionNotFound: if there is no such session
+        :raises SessionLost: if the session died or was evicted; it is closed
+        """
+        session = self._get(session_id)
+        try:
+            return session.evaluate(code, scope, time_limit, max_output_bytes)
+        except SessionLost as e:
+            self._close(session_id, str(e))
+            raise
+
+    def close(self, session_id):
+        """
+        Close a session.
+        :raises SessionNotFound: if there is no such session
+        """
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            raise SessionNotFound(f"Session not found: {session_id}")
+        session.close()
+
+    def collect(self):
+        """
+        Close dead sessions and ones idle for longer than idle_timeout, then evict
+        idle sessions, least recently used first, while the host is low on memory.
+        :return: list of the closed session ids
+        """
+        now = time.monotonic()
+        closed = []
+        with self._lock:
+            for session_id, session in list(self._sessions.items()):
+                if session.busy:
+                    continue
+                if not session.alive:
+                    reason = session._lost or session._exit_reason()
+                elif now - session.last_used > self.idle_timeout:
+                    reason = "Session closed after being idle."
+                else:
+                    continue
+                del self._sessions[session_id]
+                closed.append((session, reason))
+        for session, reason in closed:
+            self._record_closed(session.id, reason)
+            session.close(reason)
+
+        # Closing a session frees its memory before the next check
+        reason = "Evicted because the host was low on memory."
+        while self._low_on_memory():
+            with self._lock:
+                session = self._evict_lru(reason, close=False)
+            if session is None:
+                break
+            session.close(reason)
+            closed.append((session, reason))
+        return [session.id for session, _ in closed]
+
+    def stats(self):
+        """
+        Return {"sessions", "busy", "max_sessions"}.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            "sessions": len(sessions),
+            "busy": sum(session.busy for session in sessions),
+            "max_sessions": self.max_sessions,
+        }
+
+    def start(self):
+        """
+        Start the background thread that runs collect() periodically.
+        """
+        with self._lock:
+            self._stopped = False
+            if (
+                self._maintenance_thread is not None
+                and self._maintenance_thread.is_alive()
+            ):
+                return
+            self._maintenance_thread = threading.Thread(
+                target=self._maintenance_loop, name="sandbox-sessions", daemon=True
+            )
+        self._maintenance_thread.start()
+
+    def close_all(self):
+        """
+        Close every session and stop the background thread.
+        """
+        with self._lock:
+            self._stopped = True
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close("The server shut down.")
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                return session
+            reason = self._closed.get(session_id)
+        if reason is not None:
+            raise SessionLost(reason)
+        raise SessionNotFound(f"Session not found: {session_id}")
+
+    def _close(self, session_id, reason):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._record_closed(session_id, reason)
+            session.close(reason)
+
+    def _evict_lru(self, reason, close=True, tenant=_ANY_TENANT):
+        """
+        Remove the least recently used idle session, of tenant if given. Called with
+        the lock held.
+        :return: the evicted session, None if every such session is busy
+        """
+        for session_id, session in self._sessions.items():
+            if tenant is not _ANY_TENANT and session.tenant != tenant:
+                continue
+            if not session.busy:
+                del self._sessions[session_id]
+                self._remember(session_id, reason)
+                if close:
+                    threading.Thread(
+                        target=session.close, args=(reason,), daemon=True
+                    ).start()
+                return session
+        return None
+
+    def _record_closed(self, session_id, reason):
+        with self._lock:
+            self._remember(session_id, reason)
+
+    def _remember(self, session_id, reason):
+        self._closed[session_id] = reason
+        while len(self._closed) > self.closed_history:
+            self._closed.popitem(last=False)
+
+    def _low_on_memory(self):
+        if not self.min_available_memory:
+            return False
+        available = available_memory()
+        return available is not None and available < self.min_available_memory
+
+    def _maintenance_loop(self):
+        interval = max(1, min(self.idle_timeout / 4, 30))
+        while not self._stopped:
+            time.sleep(interval)
+            try:
+                self.collect()
+            except Exception:
+                # Keep collecting; a failure here must not leak sessions
+                pass
+
+
+def session_manager_from_env(**kwargs):
+    """
+    Build a SessionManager from the SESSION_* environment variables.
+    """
+    return SessionManager(
+        max_sessions=int(os.getenv("SESSION_MAX", "32")),
+        max_sessions_per_tenant=int(os.getenv("SESSION_MAX_PER_TENANT", "0")) or None,
+        idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", "600")),
+        memory_limit=int(os.getenv("SESSION_MEMORY_BYTES", 512 * 1024**2)),
+        cpu_limit=float(os.getenv("SESSION_CPU_SECONDS", "300")),
+        min_available_memory=int(
+            os.getenv("SESSION_MIN_AVAILABLE_MEMORY_BYTES", 512 * 1024**2)
+        ),
+        **kwargs,
+    )
@@ -0,0 +1,155 @@
+"""
+Interpreter of a stateful evaluation session (see session.py).
+
+The host starts this program once per session inside the sandbox, under the
+session's memory and CPU budgets, and sends it cells to run one at a time. Every
+cell runs in the same module namespace, so variables, functions and imports of one
+call are there for the next. Like a notebook cell, the value of a trailing
+expression is the cell's return value.
+
+The protocol is one JSON object per line on stdin and on the original stdout:
+
+    request  {"code": str, "scope": {...}, "time_limit": number,
+              "max_output_bytes": int}
+    reply    {"stdout": str, "stderr": str, "returnValue": ...}
+             {"stdout": str, "stderr": str, "error": str}
+             plus "truncated": true when the cell's output went over the cap
+
+The scope is merged into the namespace before the cell runs. Cells see an empty
+stdin, and writes straight to file descriptor 1 go to stderr, so user code cannot
+interfere with the protocol.
+
+This file is copied into the sandbox and run with its python3, so it must stay
+standard-library only and compatible with Python 3.6.
+"""
+
+import ast
+import builtins
+import io
+import json
+import os
+import signal
+import sys
+import traceback
+
+
+class CellTimeout(BaseException):
+    """
+    Raised in a cell when it runs past its time limit. Not an Exception, so a bare
+    `except Exception` in user code does not swallow it.
+    """
+
+
+class BoundedWriter(io.TextIOBase):
+    """
+    Text stream that keeps the first limit characters written to it.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.truncated = False
+        self._parts = []
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        room = self.limit - self._size
+        if len(text) > room:
+            self.truncated = True
+        kept = text[: max(room, 0)]
+        self._parts.append(kept)
+        self._size += len(kept)
+        return len(text)
+
+    def getvalue(self):
+        return "".join(self._parts)
+
+
+_armed = False
+
+
+def _on_alarm(signum, frame):
+    if _armed:
+        raise CellTimeout()
+
+
+def run_cell(namespace, code, filename):
+    """
+    Run code in namespace and return the value of its trailing expression, if any.
+    """
+    global _armed
+    tree = ast.parse(code, filename, "exec")
+    last = None
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        last = ast.Expression(tree.body.pop().value)
+    _armed = True
+    try:
+        exec(compile(tree, filename, "exec"), namespace)
+        if last is not None:
+            return eval(compile(last, filename, "eval"), namespace)
+        return None
+    finally:
+        _armed = False
+
+
+def handle(namespace, request, filename):
+    stdout = BoundedWriter(request.get("max_output_bytes", 1024**2))
+    stderr = BoundedWriter(request.get("max_output_bytes", 1024**2))
+    reply = {}
+    sys.stdout, sys.stderr = stdout, stderr
+    signal.setitimer(signal.ITIMER_REAL, request.get("time_limit", 100))
+    try:
+        # Inside the try: a scope that is not a mapping fails the cell, not the
+        # session
+        namespace.update(request.get("scope") or {})
+        reply["returnValue"] = run_cell(namespace, request["code"], filename)
+    except CellTimeout:
+        reply["error"] = "Time limit exceeded."
+    except BaseException as e:
+        # SystemExit and KeyboardInterrupt end the cell, not the session. The
+        # traceback starts at the cell, the runner's own frames are left out.
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != filename:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb)
+        reply["error"] = str(e) or type(e).__name__
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+
+    reply["stdout"] = stdout.getvalue()
+    reply["stderr"] = stderr.getvalue()
+    if stdout.truncated or stderr.truncated:
+        reply["truncated"] = True
+    try:
+        return json.dumps(reply)
+    except (TypeError, ValueError) as e:
+        del reply["returnValue"]
+        reply["error"] = "Return value is not JSON serializable: " + str(e)
+        return json.dumps(reply)
+
+
+def main():
+    # The protocol keeps private copies of stdin and stdout; the cells get an empty
+    # stdin, and their writes to fd 1 land on stderr, which the host discards
+    requests = os.fdopen(os.dup(0), "r", encoding="utf-8")
+    replies = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+    sys.stdin = open(os.devnull, "r")
+
+    signal.signal(signal.SIGALRM, _on_alarm)
+    namespace = {"__name__": "__main__", "__builtins__": builtins}
+    count = 0
+    for line in requests:
+        count += 1
+        reply = handle(namespace, json.loads(line), "<cell {}>".format(count))
+        replies.write(reply + "\n")
+        replies.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+
+# Compiles the submitted code as a function body, like the wrapper runs it, and
+# reports the location of the first syntax error. One JSON line in, one JSON line
+# (null when the code compiles) out.
+_NODE_CHECKER = r"""
+const readline = require("readline");
+const vm = require("vm");
+readline.createInterface({ input: process.stdin }).on("line", (line) => {
+  let error = null;
+  try {
+    vm.compileFunction(JSON.parse(line), [], { filename: "user_code.js" });
+  } catch (e) {
+    if (e instanceof SyntaxError) {
+      const stack = String(e.stack).split("\n");
+      const location = /:(\d+)$/.exec(stack[0]);
+      const caret = stack[2] ? stack[2].indexOf("^") : -1;
+      error = {
+        line: location ? Number(location[1]) : null,
+        column: caret >= 0 ? caret + 1 : null,
+        message: e.message,
+      };
+    }
+  }
+  process.stdout.write(JSON.stringify(error) + "\n");
+});
+"""
+
+
+class SyntaxCheckCache:
+    """
+    LRU of check results keyed by a hash of (language, code), so repeated
+    submissions are answered without parsing them again.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, language, code):
+        return hashlib.sha256(f"{language}\0{code}".encode("utf-8")).digest()
+
+    def get(self, key):
+        """
+        Return (found, error) for a key.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, self._entries[key]
+
+    def set(self, key, error):
+        with self._lock:
+            self._entries[key] = error
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class NodeSyntaxChecker:
+    """
+    A warm host node process that parses JavaScript with vm.compileFunction, so a
+    check costs a pipe round trip instead of a node startup.
+    """
+
+    def __init__(self, node=None):
+        """
+        :param node: path of the host node binary, looked up on PATH by default
+        """
+        self.node = node if node is not None else shutil.which("node")
+        self._process = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.node is not None
+
+    def check(self, code):
+        """
+        Return {"line", "column", "message"} for the first syntax error, None if the
+        code parses or node cannot be reached.
+        """
+        if not self.available:
+            return None
+        request = json.dumps(code) + "\n"
+        with self._lock:
+            # A dead process is restarted once per check
+            for _ in range(2):
+                if self._process is None or self._process.poll() is not None:
+                    self._start()
+                try:
+                    self._process.stdin.write(request)
+                    self._process.stdin.flush()
+                    reply = self._process.stdout.readline()
+                except (BrokenPipeError, OSError):
+                    reply = ""
+                if reply:
+                    return json.loads(reply)
+                self.close()
+        return None
+
+    def close(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+    def _start(self):
+        self._process = subprocess.Popen(
+            [self.node, "-e", _NODE_CHECKER],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+        )
+
+
+_cache = SyntaxCheckCache()
+_node_checker = NodeSyntaxChecker()
+
+# Longest code, in characters, the checks parse; longer code is rejected unparsed
+max_code_length = int(os.getenv("SAFE_EVAL_MAX_CODE_LENGTH", 1024**2))
+
+
+def _too_long(code):
+    if len(code) <= max_code_length:
+        return None
+    return {
+        "line": None,
+        "column": None,
+        "message": f"Code is longer than {max_code_length} characters.",
+    }
+
+
+def check_python(code):
+    """
+    Compile code on the host as the body of a function, like SafeEvalPython runs it.
+    The host interpreter may be newer than the container's, so code relying on
+    syntax the container lacks still fails there; this only catches what no version
+    would accept.
+    :return: {"line", "column", "message"} relative to the submitted code, or None
+    """
+    too_long = _too_long(code)
+    if too_long is not None:
+        return too_long
+    key = _cache.key("python", code)
+    found, error = _cache.get(key)
+    if found:
+        return error
+
+    source = "def user_code():\n" + "".join(
+        "    " + line + "\n" for line in code.split("\n")
+    )
+    try:
+        compile(source, "<user_code>", "exec", dont_inherit=True)
+        error = None
+    except SyntaxError as e:
+        # Undo the function header line and the body's indentation
+        error = {
+            "line": max((e.lineno or 1) - 1, 1),
+            "column": max((e.offset or 1) - 4, 1),
+            "message": e.msg,
+        }
+    except ValueError as e:
+        # e.g. null bytes in the source
+        error = {"line": None, "column": None, "message": str(e)}
+    except (MemoryError, RecursionError):
+        # Nesting too deep for the parser, e.g. "-" * 1000000 + "1"
+        error = {
+            "line": None,
+            "column": None,
+            "message": "Code is nested too deeply to compile.",
+        }
+    _cache.set(key, error)
+    return error
+
+
+def check_javascript(code):
+    """
+    Parse code as a function body with the host's node, like SafeEvalJavaScript runs
+    it. Without node on the host the check is skipped and None is returned.
+    :return: {"line", "column", "message"} relative to the submitted code, or None
+    """
+    too_long = _too_long(code)
+    if too_long is not None:
+        return too_long
+    if not _node_checker.available:
+        return None
+    key = _cache.key("javascript", code)
+    found, error = _cache.get(key)
+    if found:
+        return error
+
+    error = _node_checker.check(code)
+    _cache.set(key, error)
+    return error
+
+
+def format_syntax_error(error):
+    """
+    Render a check result as a one-line message, e.g. for stderr.
+    """
+    if error["line"] is None:
+        return f"SyntaxError: {error['message']}"
+    location = f"line {error['line']}"
+    if error["column"] is not None:
+        location += f", column {error['column']}"
+    return f"SyntaxError: {error['message']} ({location})"
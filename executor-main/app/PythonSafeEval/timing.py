@@ -0,0 +1,57 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Phase durations of the evaluation running in the current context, see record()
+_current_phases = ContextVar("safe_eval_phases", default=None)
+
+# Callables observer(phase, language, version, seconds), called for every phase
+_observers = []
+
+
+def add_observer(observer):
+    """
+    Call observer(phase, language, version, seconds) whenever a phase finishes, e.g.
+    to feed a metrics histogram.
+    """
+    _observers.append(observer)
+
+
+@contextmanager
+def record():
+    """
+    Collect the phases timed in this context (and in threads started with a copy of
+    it) into the yielded {phase: seconds} dict.
+    """
+    phases = {}
+    token = _current_phases.set(phases)
+    try:
+        yield phases
+    finally:
+        _current_phases.reset(token)
+
+
+@contextmanager
+def phase(name, language="", version=""):
+    """
+    Time the block as one phase of an evaluation, e.g. "docker_build" or "exec".
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        phases = _current_phases.get()
+        if phases is not None:
+            phases[name] = phases.get(name, 0) + seconds
+        for observer in _observers:
+            observer(name, language, version, seconds)
+
+
+def server_timing(phases):
+    """
+    Render {phase: seconds} as a Server-Timing header value, in milliseconds.
+    """
+    return ", ".join(
+        f"{name};dur={seconds * 1000:.1f}" for name, seconds in phases.items()
+    )
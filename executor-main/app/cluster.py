@@ -0,0 +1,533 @@
+"""
+Multi-host sandbox cluster.
+
+A coordinator keeps the membership of the cluster. Every sandbox node is a sandbox
+manager listening on TCP (see sandbox_manager.py) that registers with the coordinator
+every few seconds, reporting its capacity and the (language, version, modules) keys
+it has warm sandboxes for. A node that stops heartbeating drops out of the cluster.
+
+The /evaluate front ends route with ClusterSandboxPool: every job goes to the node
+that owns its image key on a consistent hash ring, weighted by capacity, so a key
+keeps hitting the same node's image and warm sandboxes, and adding or removing a
+node only moves the keys of that node. When the owner is unreachable or overloaded
+the job fails over to the next nodes on the ring, preferring ones that already have
+the key warm.
+
+    python -m cluster coordinator 0.0.0.0:7000
+    python -m cluster node 0.0.0.0:7001 --coordinator coordinator:7000 \\
+        --advertise node-1:7001
+
+The coordinator speaks the managers' framing:
+
+    request  {"op": "register", "node": str, "address": "host:port",
+              "capacity": int, "in_flight": int, "warm": [[language, version,
+              modules], ...]}
+             {"op": "deregister", "node": str}
+             {"op": "members"}
+    replies  {"ok": true} or {"members": [{"node", "address", "capacity",
+              "in_flight", "warm"}, ...]}
+
+Requests carry "token", the SANDBOX_CLUSTER_TOKEN secret, as they do to the nodes.
+Neither the coordinator nor a node listens without one.
+"""
+
+import argparse
+import bisect
+import hashlib
+import hmac
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from limiter import Overloaded
+    from PythonSafeEval.executor_daemon import (
+        ExecutorError,
+        read_frame,
+        write_frame,
+    )
+    from PythonSafeEval.pool import SandboxPool
+    from sandbox_manager import (
+        ManagerError,
+        ManagerLost,
+        ManagerUnavailable,
+        RemoteEvaluator,
+        RemoteSandboxPool,
+        format_address,
+        manager_from_env,
+        parse_address,
+        serve,
+    )
+except ImportError:
+    from app.limiter import Overloaded
+    from app.PythonSafeEval.executor_daemon import (
+        ExecutorError,
+        read_frame,
+        write_frame,
+    )
+    from app.PythonSafeEval.pool import SandboxPool
+    from app.sandbox_manager import (
+        ManagerError,
+        ManagerLost,
+        ManagerUnavailable,
+        RemoteEvaluator,
+        RemoteSandboxPool,
+        format_address,
+        manager_from_env,
+        parse_address,
+        serve,
+    )
+
+
+class HashRing:
+    """
+    Consistent hash ring over nodes, with points_per_slot points per unit of a
+    node's capacity, so bigger nodes own a bigger share of the keys.
+    """
+
+    def __init__(self, capacities, points_per_slot=16):
+        """
+        :param capacities: {node: capacity}
+        :param points_per_slot: ring points per unit of capacity
+        """
+        points = []
+        for node, capacity in capacities.items():
+            for i in range(max(1, capacity) * points_per_slot):
+                points.append((self._hash(f"{node}#{i}"), node))
+        points.sort()
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+        self.nodes = set(capacities)
+
+    def preference(self, key):
+        """
+        Return every node, starting with the owner of key and continuing clockwise.
+        """
+        if not self._nodes:
+            return []
+        start = bisect.bisect(self._hashes, self._hash(key))
+        preference = []
+        for i in range(len(self._nodes)):
+            node = self._nodes[(start + i) % len(self._nodes)]
+            if node not in preference:
+                preference.append(node)
+                if len(preference) == len(self.nodes):
+                    break
+        return preference
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+def image_key(language, version=None, modules=None):
+    """
+    The ring key of a sandbox image, the same for equal module lists in any order.
+    """
+    if version is None:
+        version = SandboxPool.evaluator_classes[language].default_version
+    return json.dumps([language, str(version), sorted(modules or [])])
+
+
+# ------------------------------------------------------------------------------
+# Coordinator
+# ------------------------------------------------------------------------------
+
+
+class _CoordinatorHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            request = read_frame(self.request)
+            if request is None:
+                return
+            token = self.server.token
+            if token and not hmac.compare_digest(str(request.get("token", "")), token):
+                write_frame(self.request, {"error": "Invalid cluster token."})
+                return
+            op = request.get("op")
+            if op == "register":
+                self.server.register(request)
+                write_frame(self.request, {"ok": True})
+            elif op == "deregister":
+                self.server.deregister(request["node"])
+                write_frame(self.request, {"ok": True})
+            elif op == "members":
+                write_frame(self.request, {"members": self.server.members()})
+            else:
+                write_frame(self.request, {"error": f"Unknown operation: {op}"})
+        except (OSError, ValueError, KeyError, ExecutorError):
+            pass
+
+
+class Coordinator(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Membership registry of the cluster. Nodes that did not register for
+    heartbeat_timeout seconds are left out of members().
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, heartbeat_timeout=6, token=None):
+        """
+        :param address: (host, port) to listen on
+        :param heartbeat_timeout: seconds after which a silent node is dropped
+        :param token: secret every request has to carry
+        :raises ValueError: if token is empty
+        """
+        if not token:
+            raise ValueError("The coordinator needs a token (SANDBOX_CLUSTER_TOKEN).")
+        self.heartbeat_timeout = heartbeat_timeout
+        self.token = token
+        self._lock = threading.Lock()
+        # node -> (registration, monotonic time it was received)
+        self._nodes = {}
+        super().__init__(address, _CoordinatorHandler)
+
+    @property
+    def address(self):
+        return format_address(self.server_address)
+
+    def register(self, registration):
+        member = {
+            field: registration[field]
+            for field in ("node", "address", "capacity", "in_flight", "warm")
+        }
+        with self._lock:
+            self._nodes[member["node"]] = (member, time.monotonic())
+
+    def deregister(self, node):
+        with self._lock:
+            self._nodes.pop(node, None)
+
+    def members(self):
+        now = time.monotonic()
+        with self._lock:
+            for node, (_, seen) in list(self._nodes.items()):
+                if now - seen > self.heartbeat_timeout:
+                    del self._nodes[node]
+            return [member for member, _ in self._nodes.values()]
+
+
+def coordinator_request(address, request, token=None, timeout=5):
+    """
+    Send one request to the coordinator at "host:port" and return its reply.
+    :raises ManagerUnavailable: if the coordinator cannot be reached
+    """
+    if token:
+        request = dict(request, token=token)
+    try:
+        with socket.create_connection(parse_address(address), timeout) as sock:
+            write_frame(sock, request)
+            reply = read_frame(sock)
+    except (OSError, ValueError, ExecutorError) as e:
+        raise ManagerUnavailable(f"Cluster coordinator {address} failed: {e}")
+    if reply is None or "error" in reply:
+        message = "closed the connection" if reply is None else reply["error"]
+        raise ManagerUnavailable(f"Cluster coordinator {address}: {message}")
+    return reply
+
+
+class NodeRegistration:
+    """
+    Heartbeat of a node: registers the node's manager with the coordinator every
+    interval seconds, and deregisters it when stopped.
+    """
+
+    def __init__(self, manager, coordinator, advertise=None, node=None, interval=2):
+        """
+        :param manager: the node's SandboxManager, listening on TCP
+        :param coordinator: "host:port" of the coordinator
+        :param advertise: "host:port" other hosts reach the manager at, defaults to
+            the address it listens on
+        :param node: name of the node, defaults to the advertised address
+        :param interval: seconds between heartbeats
+        """
+        self.manager = manager
+        self.coordinator = coordinator
+        self.advertise = advertise or manager.address
+        self.node = node or self.advertise
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def registration(self):
+        warm = [
+            [language, version, list(modules)]
+            for (language, version, modules), stats in self.manager.pool.stats().items()
+            if stats["idle"]
+        ]
+        return {
+            "op": "register",
+            "node": self.node,
+            "address": self.advertise,
+            "capacity": self.manager.limiter.max_in_flight,
+            "in_flight": self.manager.limiter.in_flight,
+            "warm": warm,
+        }
+
+    def heartbeat(self):
+        try:
+            coordinator_request(
+                self.coordinator, self.registration(), self.manager.token
+            )
+        except ManagerUnavailable:
+            # The next heartbeat retries, the node keeps serving meanwhile
+            pass
+
+    def start(self):
+        self._stopped.clear()
+        self.heartbeat()
+        self._thread = threading.Thread(
+            target=self._loop, name="cluster-heartbeat", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            coordinator_request(
+                self.coordinator,
+                {"op": "deregister", "node": self.node},
+                self.manager.token,
+            )
+        except ManagerUnavailable:
+            pass
+
+    def _loop(self):
+        while not self._stopped.wait(self.interval):
+            self.heartbeat()
+
+
+# ------------------------------------------------------------------------------
+# Front end
+# ------------------------------------------------------------------------------
+
+
+class ClusterSandboxPool:
+    """
+    Drop-in for SandboxPool in the front end that runs every call on a cluster node,
+    routed by the consistent hash ring of the key's image.
+    """
+
+    evaluator_classes = SandboxPool.evaluator_classes
+
+    def __init__(
+        self,
+        coordinator,
+        token=None,
+        timeout=300,
+        connect_timeout=2,
+        refresh_interval=2,
+        suspect_for=10,
+    ):
+        """
+        :param coordinator: "host:port" of the coordinator
+        :param token: cluster secret, sent to the coordinator and the nodes
+        :param timeout: seconds to wait for a node's reply to a call
+        :param connect_timeout: seconds to wait for a node to accept
+        :param refresh_interval: seconds the membership is cached for
+        :param suspect_for: seconds a node that could not be reached is skipped,
+            before the coordinator notices it is gone
+        """
+        self.coordinator = coordinator
+        self.token = token
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.refresh_interval = refresh_interval
+        self.suspect_for = suspect_for
+        self._lock = threading.Lock()
+        self._members = {}
+        self._ring = HashRing({})
+        self._refreshed_at = None
+        # node -> monotonic time until which it is skipped
+        self._suspects = {}
+
+    @contextmanager
+    def sandbox(self, language, version=None, modules=None, timeout=None):
+        if language not in self.evaluator_classes:
+            raise ValueError(f"Unsupported language: {language}")
+        yield RemoteEvaluator(self, language, version, list(modules or []))
+
+    def members(self):
+        """
+        Return the live members as {node: registration}, refreshed from the
+        coordinator at most every refresh_interval seconds. The last known members
+        are kept while the coordinator is unreachable.
+        """
+        return self._membership()[0]
+
+    def route(self, language, version=None, modules=None):
+        """
+        Return the members to try for a key: its owner on the ring, then the other
+        nodes that have the key warm, then the rest in ring order. Nodes that
+        recently failed to answer go last.
+        """
+        members, ring = self._membership()
+        key = image_key(language, version, modules)
+        preference = ring.preference(key)
+        key = json.loads(key)
+        if not preference:
+            raise ManagerUnavailable("The sandbox cluster has no live nodes.")
+        owner, rest = preference[0], preference[1:]
+        warm = [node for node in rest if key in members[node]["warm"]]
+        order = [owner] + warm + [node for node in rest if node not in warm]
+
+        now = time.monotonic()
+        with self._lock:
+            suspects = {node for node, until in self._suspects.items() if until > now}
+        order = [node for node in order if node not in suspects] + [
+            node for node in order if node in suspects
+        ]
+        return [members[node] for node in order]
+
+    def stats(self):
+        """
+        Pool statistics summed over every reachable node, in the shape of
+        SandboxPool.stats().
+        """
+        totals = {}
+        for node, member in self.members().items():
+            try:
+                stats = self._client(member).stats()
+            except ManagerError:
+                continue
+            for key, values in stats.items():
+                total = totals.setdefault(key, dict.fromkeys(values, 0))
+                for field, value in values.items():
+                    total[field] += value
+        return totals
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def call(self, op, target, args):
+        """
+        Run eval or eval_batch on the first node of the route that accepts it. A job
+        whose node died before replying runs again on the next node.
+        """
+        overloaded = None
+        for member in self.route(**target):
+            try:
+                return self._client(member).call(op, target, args)
+            except (ManagerUnavailable, ManagerLost):
+                self._suspect(member["node"])
+            except Overloaded as e:
+                overloaded = e
+        if overloaded is not None:
+            raise overloaded
+        raise ManagerUnavailable("No node of the sandbox cluster is reachable.")
+
+    def stream(self, target, args):
+        """
+        Run eval_stream on the first node of the route that accepts it. A node that
+        fails after the first frame is not retried, the output already went out.
+        """
+        overloaded = None
+        for member in self.route(**target):
+            frames = self._client(member).stream(target, args)
+            try:
+                first = next(frames)
+            except (ManagerUnavailable, ManagerLost):
+                self._suspect(member["node"])
+                continue
+            except Overloaded as e:
+                overloaded = e
+                continue
+            yield first
+            yield from frames
+            return
+        if overloaded is not None:
+            raise overloaded
+        raise ManagerUnavailable("No node of the sandbox cluster is reachable.")
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _membership(self):
+        """
+        Return (members, ring) of the same refresh. Until a refresh succeeds, every
+        call asks the coordinator again.
+        """
+        with self._lock:
+            if (
+                self._refreshed_at is not None
+                and time.monotonic() - self._refreshed_at < self.refresh_interval
+            ):
+                return self._members, self._ring
+        try:
+            reply = coordinator_request(self.coordinator, {"op": "members"}, self.token)
+        except ManagerUnavailable:
+            with self._lock:
+                if not self._members:
+                    raise
+                return self._members, self._ring
+        members = {member["node"]: member for member in reply["members"]}
+        ring = HashRing({node: member["capacity"] for node, member in members.items()})
+        with self._lock:
+            self._members = members
+            self._ring = ring
+            self._refreshed_at = time.monotonic()
+        return members, ring
+
+    def _client(self, member):
+        return RemoteSandboxPool(
+            member["address"],
+            timeout=self.timeout,
+            connect_timeout=self.connect_timeout,
+            token=self.token,
+        )
+
+    def _suspect(self, node):
+        with self._lock:
+            self._suspects[node] = time.monotonic() + self.suspect_for
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    coordinator = commands.add_parser("coordinator", help="run the coordinator")
+    coordinator.add_argument("listen", help="host:port to listen on")
+    coordinator.add_argument("--heartbeat-timeout", type=float, default=6)
+    node = commands.add_parser("node", help="run a sandbox node")
+    node.add_argument("listen", help="host:port to listen on")
+    node.add_argument("--coordinator", required=True, help="host:port")
+    node.add_argument("--advertise", help="host:port other hosts reach this node at")
+    node.add_argument("--node", help="name of the node, defaults to --advertise")
+    node.add_argument("--heartbeat-interval", type=float, default=2)
+    args = parser.parse_args(argv)
+
+    token = os.getenv("SANDBOX_CLUSTER_TOKEN") or None
+    if token is None:
+        parser.error("SANDBOX_CLUSTER_TOKEN must be set to listen on TCP.")
+    if args.command == "coordinator":
+        server = Coordinator(
+            parse_address(args.listen), args.heartbeat_timeout, token=token
+        )
+        server.serve_forever()
+        return
+
+    manager = manager_from_env(parse_address(args.listen), token=token)
+    serve(
+        manager,
+        NodeRegistration(
+            manager,
+            args.coordinator,
+            advertise=args.advertise,
+            node=args.node,
+            interval=args.heartbeat_interval,
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -17,42 +17,74 @@ def extract_value_after_return(s, h):
     if hash_index == -1:
         return None
 
-    # The substring starts immediately after the hash
-    start_index = hash_index + len(h)
-    target_substring = s[start_index:]
-
-    # Ensure the substring starts with '{"returnValue":'
-    if target_substring.startswith('{"returnValue":'):
-        value_start = len('{"returnValue":')
-
-        # Extract the value by finding the matching closing brace
-        brace_count = 0
-        value_end = None
-        for i, char in enumerate(target_substring[value_start:], start=value_start):
-            if char == "{":
-                brace_count += 1
-            elif char == "}":
-                if brace_count == 0:
-                    value_end = i
-                    break
-                brace_count -= 1
-        if value_end is None:
-            return None
-
-        # Extract the raw value
-        raw_value = target_substring[value_start:value_end].strip()
-
-        # Try to parse the raw value
-        try:
-            return json.loads(raw_value)
-        except json.JSONDecodeError:
-            # Try removing the last character if it's a closing brace
-            if raw_value.endswith("}"):
-                try:
-                    return json.loads(raw_value[:-1].strip())
-                except json.JSONDecodeError:
-                    return raw_value
-            # Fall back to returning the raw string
-            return raw_value
+    # Decode the JSON object that starts immediately after the hash
+    try:
+        value, _ = json.JSONDecoder().raw_decode(s, hash_index + len(h))
+    except json.JSONDecodeError:
+        return None
 
+    if isinstance(value, dict):
+        return value.get("returnValue")
     return None
+
+
+def extract_return_value(result, h):
+    """
+    Extracts the return value of an evaluation.
+
+    Parameters:
+    result (dict): The evaluation result. Its "result" key holds the raw JSON the program
+    wrote to the result channel; without it the value is searched for in "stdout".
+    h (str): The hash that prefixes the return value on stdout.
+
+    Returns:
+    any: The parsed value of "returnValue", or None if the code did not return one.
+    """
+    if "result" in result:
+        return json.loads(result["result"]).get("returnValue")
+    return extract_value_after_return(result.get("stdout") or "", h)
+
+
+def extract_batch_results(result, h, count):
+    """
+    Extracts the per-item results a batch runner wrote.
+
+    Parameters:
+    result (dict): The batch evaluation result. Its "result" key holds one JSON line per
+    item from the result channel; without it the lines are searched for in "stdout",
+    where each one follows the hash.
+    h (str): The hash that prefixes every result line on stdout.
+    count (int): The number of items in the batch.
+
+    Returns:
+    list: One dict per item, {"returnValue": ..., "stdout": ...} or {"error": ..., "stdout": ...}.
+    Items without a result line (e.g. because the batch was killed) are None.
+    """
+    results = [None] * count
+
+    def store(value):
+        index = value.pop("index", None) if isinstance(value, dict) else None
+        if isinstance(index, int) and 0 <= index < count:
+            results[index] = value
+
+    if "result" in result:
+        for line in result["result"].splitlines():
+            try:
+                store(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+        return results
+
+    s = result.get("stdout") or ""
+    decoder = json.JSONDecoder()
+    hash_index = s.find(h)
+    while hash_index != -1:
+        start_index = hash_index + len(h)
+        try:
+            value, end_index = decoder.raw_decode(s, start_index)
+        except json.JSONDecodeError:
+            end_index = start_index
+        else:
+            store(value)
+        hash_index = s.find(h, end_index)
+    return results
@@ -0,0 +1,294 @@
+import bisect
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Item ids are stored as SQLite integers, so both stores take the same signed
+# 64-bit range
+MIN_ITEM_ID = -(2**63)
+MAX_ITEM_ID = 2**63 - 1
+
+
+class MemoryItemStore:
+    """
+    In-process item store holding at most capacity items. Items are spread over
+    shards by id, each with its own lock and its own LRU order, so concurrent
+    requests for different items rarely wait for each other. A full shard evicts its
+    least recently used item. Every shard also keeps its ids sorted, so a page only
+    looks at the ids after its cursor.
+
+    Only the worker that wrote an item sees it; use SQLiteItemStore to share items
+    between the workers of a host.
+    """
+
+    def __init__(self, capacity=100_000, shards=16):
+        """
+        :param capacity: maximum number of items, split evenly over the shards
+        :param shards: number of independently locked partitions
+        """
+        if capacity < shards:
+            shards = max(1, capacity)
+        self.capacity = capacity
+        self._shard_capacity = -(-capacity // shards)
+        self._shards = [OrderedDict() for _ in range(shards)]
+        self._sorted_ids = [[] for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+
+    def get(self, item_id):
+        return self.get_many([item_id]).get(item_id)
+
+    def get_many(self, item_ids):
+        """
+        :return: {item_id: item} of the ids that are in the store
+        """
+        found = {}
+        for shard, ids in self._group(item_ids).items():
+            entries = self._shards[shard]
+            with self._locks[shard]:
+                for item_id in ids:
+                    value = entries.get(item_id)
+                    if value is not None:
+                        entries.move_to_end(item_id)
+                        found[item_id] = value
+        return {item_id: json.loads(value) for item_id, value in found.items()}
+
+    def put(self, item_id, item):
+        self.put_many({item_id: item})
+
+    def put_many(self, items):
+        """
+        Store {item_id: item}. Items are JSON-serializable dicts.
+        """
+        encoded = {item_id: json.dumps(item) for item_id, item in items.items()}
+        for shard, ids in self._group(encoded).items():
+            entries = self._shards[shard]
+            sorted_ids = self._sorted_ids[shard]
+            with self._locks[shard]:
+                for item_id in ids:
+                    if item_id not in entries:
+                        bisect.insort(sorted_ids, item_id)
+                    entries[item_id] = encoded[item_id]
+                    entries.move_to_end(item_id)
+                while len(entries) > self._shard_capacity:
+                    evicted, _ = entries.popitem(last=False)
+                    del sorted_ids[bisect.bisect_left(sorted_ids, evicted)]
+
+    def page(self, after=None, limit=100):
+        """
+        Return up to limit (item_id, item) pairs with ids above after, in id order.
+        Pages do not touch the LRU order.
+        """
+        # The first limit ids after the cursor of every shard, merged
+        runs = []
+        for shard, entries in enumerate(self._shards):
+            sorted_ids = self._sorted_ids[shard]
+            with self._locks[shard]:
+                start = 0 if after is None else bisect.bisect_right(sorted_ids, after)
+                runs.append(
+                    [
+                        (item_id, entries[item_id])
+                        for item_id in sorted_ids[start : start + limit]
+                    ]
+                )
+        merged = heapq.merge(*runs, key=lambda entry: entry[0])
+        return [
+            (item_id, json.loads(value))
+            for item_id, value in itertools.islice(merged, limit)
+        ]
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._shards)
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _group(self, item_ids):
+        groups = {}
+        for item_id in item_ids:
+            groups.setdefault(item_id % len(self._shards), []).append(item_id)
+        return groups
+
+
+class SQLiteItemStore:
+    """
+    On-disk item store shared by every worker on the host, holding at most capacity
+    items. WAL mode lets the workers read concurrently while one of them writes; the
+    least recently used items are evicted when a write goes over capacity. The number
+    of items is kept in a one-row table by triggers, so a write does not count the
+    table to find out whether it went over.
+    """
+
+    # Rows per statement for bulk reads, below SQLite's bound parameter limit
+    chunk_size = 500
+
+    def __init__(self, path, capacity=1_000_000):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS item_store ("
+            "id INTEGER PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS item_store_last_used "
+            "ON item_store (last_used)"
+        )
+        # Counted once when the table is first set up, in the same transaction as
+        # the triggers that keep the count from then on
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS item_store_count ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), n INTEGER NOT NULL)"
+            )
+            self._connection.execute(
+                "INSERT OR IGNORE INTO item_store_count "
+                "SELECT 0, COUNT(*) FROM item_store"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS item_store_inserted "
+                "AFTER INSERT ON item_store BEGIN "
+                "UPDATE item_store_count SET n = n + 1; END"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS item_store_deleted "
+                "AFTER DELETE ON item_store BEGIN "
+                "UPDATE item_store_count SET n = n - 1; END"
+            )
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+
+    def get(self, item_id):
+        return self.get_many([item_id]).get(item_id)
+
+    def get_many(self, item_ids):
+        """
+        :return: {item_id: item} of the ids that are in the store
+        """
+        item_ids = list(dict.fromkeys(item_ids))
+        now = time.time()
+        found = {}
+        with self._lock:
+            for start in range(0, len(item_ids), self.chunk_size):
+                chunk = item_ids[start : start + self.chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(
+                    self._connection.execute(
+                        f"SELECT id, value FROM item_store WHERE id IN ({placeholders})",
+                        chunk,
+                    ).fetchall()
+                )
+            if found:
+                self._touch(list(found), now)
+        return {item_id: json.loads(value) for item_id, value in found.items()}
+
+    def put(self, item_id, item):
+        self.put_many({item_id: item})
+
+    def put_many(self, items):
+        """
+        Store {item_id: item} in one transaction. Items are JSON-serializable dicts.
+        """
+        now = time.time()
+        rows = [(item_id, json.dumps(item), now) for item_id, item in items.items()]
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                # An upsert rather than INSERT OR REPLACE: the rows REPLACE deletes
+                # do not fire the delete trigger
+                self._connection.executemany(
+                    "INSERT INTO item_store VALUES (?, ?, ?) ON CONFLICT (id) "
+                    "DO UPDATE SET value = excluded.value, "
+                    "last_used = excluded.last_used",
+                    rows,
+                )
+                self._evict()
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def page(self, after=None, limit=100):
+        """
+        Return up to limit (item_id, item) pairs with ids above after, in id order.
+        Pages do not touch the LRU order.
+        """
+        with self._lock:
+            if after is None:
+                rows = self._connection.execute(
+                    "SELECT id, value FROM item_store ORDER BY id LIMIT ?", (limit,)
+                ).fetchall()
+            else:
+                rows = self._connection.execute(
+                    "SELECT id, value FROM item_store WHERE id > ? ORDER BY id "
+                    "LIMIT ?",
+                    (after, limit),
+                ).fetchall()
+        return [(item_id, json.loads(value)) for item_id, value in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT n FROM item_store_count"
+            ).fetchone()[0]
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _touch(self, item_ids, now):
+        """
+        Mark the items as used at now, in one transaction.
+        """
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            for start in range(0, len(item_ids), self.chunk_size):
+                chunk = item_ids[start : start + self.chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                self._connection.execute(
+                    f"UPDATE item_store SET last_used = ? WHERE id IN ({placeholders})",
+                    [now] + chunk,
+                )
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+
+    def _evict(self):
+        (count,) = self._connection.execute("SELECT n FROM item_store_count").fetchone()
+        if count <= self.capacity:
+            return
+        self._connection.execute(
+            "DELETE FROM item_store WHERE id IN ("
+            "SELECT id FROM item_store ORDER BY last_used LIMIT ?)",
+            (count - self.capacity,),
+        )
+
+
+def item_store_from_env():
+    """
+    Build the item store configured by ITEM_STORE_BACKEND ("memory", the default, or
+    "sqlite").
+    """
+    backend_name = os.getenv("ITEM_STORE_BACKEND", "memory").lower()
+    if backend_name == "memory":
+        return MemoryItemStore(
+            capacity=int(os.getenv("ITEM_STORE_CAPACITY", "100000")),
+            shards=int(os.getenv("ITEM_STORE_SHARDS", "16")),
+        )
+    if backend_name == "sqlite":
+        return SQLiteItemStore(
+            os.getenv("ITEM_STORE_PATH", "items.db"),
+            capacity=int(os.getenv("ITEM_STORE_CAPACITY", "1000000")),
+        )
+    raise ValueError(f"Unknown ITEM_STORE_BACKEND: {backend_name}")
@@ -0,0 +1,277 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Tenant of jobs that do not name one
+DEFAULT_TENANT = "default"
+
+
+class Overloaded(Exception):
+    """
+    Raised when a job is rejected because the worker already runs max_in_flight jobs.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("Too many evaluations in flight, retry later.")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Overloaded):
+    """
+    Raised when a queued job is shed because it could not start before its deadline.
+    """
+
+    def __init__(self, retry_after):
+        Exception.__init__(self, "The evaluation could not start before its deadline.")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    A slot held by one job, returned by acquire() and passed back to release().
+    """
+
+    __slots__ = ("tenant", "cost", "deadline", "queued_at", "started_at", "_wake")
+
+    def __init__(self, tenant, cost, deadline):
+        self.tenant = tenant
+        self.cost = cost
+        self.deadline = deadline
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self._wake = None
+
+    @property
+    def queue_wait(self):
+        """
+        Seconds the job waited for its slot, 0 while it still waits.
+        """
+        if self.started_at is None:
+            return 0
+        return self.started_at - self.queued_at
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the number of sandbox jobs in flight per worker and runs them on a dedicated
+    thread pool, so blocking docker/nsjail calls never run on the event loop.
+
+    Jobs over the cap wait in per-tenant queues, at most max_queued of them; beyond
+    that they are rejected immediately with Overloaded. A free slot goes to the
+    backlogged tenant that used the least sandbox time relative to its weight, and
+    within a tenant to the job with the smallest time limit. Jobs are charged their
+    time limit when they start and the time they actually ran when they finish. A job
+    still queued at its deadline is shed with DeadlineExceeded.
+    """
+
+    def __init__(
+        self,
+        max_in_flight=8,
+        retry_after=1,
+        max_queued=0,
+        weights=None,
+        default_time_limit=100,
+    ):
+        """
+        :param max_in_flight: maximum number of jobs running at the same time
+        :param retry_after: seconds clients are told to wait after a rejection
+        :param max_queued: maximum number of jobs waiting for a slot
+        :param weights: {tenant: weight} of the fair share, 1 for unlisted tenants
+        :param default_time_limit: time limit charged to jobs that do not give one
+        """
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1.")
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.max_queued = max_queued
+        self.weights = dict(weights or {})
+        self.default_time_limit = default_time_limit
+        self._in_flight = 0
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="sandbox"
+        )
+        # tenant -> heap of (time limit, sequence, ticket) waiting for a slot
+        self._queues = {}
+        # tenant -> weighted seconds charged, kept while the tenant has jobs
+        self._usage = {}
+        # tenant -> jobs of the tenant that hold a slot
+        self._running = {}
+        self._sequence = itertools.count()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def queued(self):
+        return self._queued
+
+    def acquire(self, tenant=None, time_limit=None, deadline=None):
+        """
+        Take a slot for a job that runs outside run(), e.g. a streamed evaluation,
+        waiting in the tenant's queue if none is free.
+        Every successful acquire() must be paired with release().
+        :param tenant: who submitted the job, for the fair share
+        :param time_limit: seconds the job may run, its cost and priority
+        :param deadline: time.monotonic() by which the job must have started
+        :return: the job's Ticket
+        """
+        event = threading.Event()
+        ticket = self._enqueue(tenant, time_limit, deadline, event.set)
+        if ticket.started_at is not None:
+            return ticket
+        timeout = None if deadline is None else max(0, deadline - time.monotonic())
+        if not event.wait(timeout) and not self._cancel(ticket):
+            raise DeadlineExceeded(self.retry_after)
+        return ticket
+
+    async def acquire_async(self, tenant=None, time_limit=None, deadline=None):
+        """
+        acquire() for the event loop: waits for the slot without blocking it.
+        """
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(
+                lambda: granted.done() or granted.set_result(None)
+            )
+
+        ticket = self._enqueue(tenant, time_limit, deadline, wake)
+        if ticket.started_at is not None:
+            return ticket
+        timeout = None if deadline is None else max(0, deadline - time.monotonic())
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), timeout)
+        except asyncio.TimeoutError:
+            if not self._cancel(ticket):
+                raise DeadlineExceeded(self.retry_after)
+        except BaseException:
+            # The request went away, e.g. its client disconnected
+            if self._cancel(ticket):
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket):
+        """
+        Give a slot back and hand it to the next queued job. The ticket's tenant is
+        charged the time its job actually ran instead of its time limit.
+        """
+        with self._lock:
+            self._in_flight -= 1
+            tenant = ticket.tenant
+            ran = time.monotonic() - ticket.started_at
+            self._usage[tenant] += (ran - ticket.cost) / self._weight(tenant)
+            self._running[tenant] -= 1
+            self._forget_if_idle(tenant)
+            self._dispatch()
+
+    async def run(self, func, *args, ticket=None):
+        """
+        Run func(*args) on the sandbox thread pool and return its result. func sees
+        the caller's context variables, e.g. the phase timings of the request.
+        :param ticket: a slot taken with acquire_async(), released when func returns;
+            a slot is taken without a tenant or time limit when there is none
+        """
+        if ticket is None:
+            ticket = await self.acquire_async()
+        try:
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            future = loop.run_in_executor(self._executor, context.run, func, *args)
+        except BaseException:
+            self.release(ticket)
+            raise
+        # The slot is held for as long as func runs, even if the caller is cancelled
+        # and stops waiting for it
+        future.add_done_callback(lambda _: self.release(ticket))
+        return await asyncio.shield(future)
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _enqueue(self, tenant, time_limit, deadline, wake):
+        tenant = tenant or DEFAULT_TENANT
+        if time_limit is None:
+            time_limit = self.default_time_limit
+        ticket = Ticket(tenant, time_limit, deadline)
+        ticket._wake = wake
+        with self._lock:
+            if tenant not in self._usage:
+                # A tenant that was idle starts level with the least served
+                # backlogged tenant, so it cannot bank credit while it submits nothing
+                active = [self._usage[t] for t, queue in self._queues.items() if queue]
+                self._usage[tenant] = min(active, default=0)
+                self._running[tenant] = 0
+            if self._in_flight < self.max_in_flight and not self._queued:
+                self._start(ticket)
+                return ticket
+            if self._queued >= self.max_queued:
+                self._forget_if_idle(tenant)
+                raise Overloaded(self.retry_after)
+            if deadline is not None and deadline <= time.monotonic():
+                self._forget_if_idle(tenant)
+                raise DeadlineExceeded(self.retry_after)
+            heapq.heappush(
+                self._queues.setdefault(tenant, []),
+                (time_limit, next(self._sequence), ticket),
+            )
+            self._queued += 1
+        return ticket
+
+    def _cancel(self, ticket):
+        """
+        Take a job that gave up out of its queue.
+        :return: True if the job got its slot in the meantime and has to release it
+        """
+        with self._lock:
+            if ticket.started_at is not None:
+                return True
+            queue = self._queues.get(ticket.tenant, [])
+            remaining = [entry for entry in queue if entry[2] is not ticket]
+            if len(remaining) < len(queue):
+                # Otherwise _dispatch() already dropped it for its deadline
+                queue[:] = remaining
+                heapq.heapify(queue)
+                self._queued -= 1
+            self._forget_if_idle(ticket.tenant)
+            return False
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._in_flight < self.max_in_flight and self._queued:
+            tenant = min(
+                (tenant for tenant, queue in self._queues.items() if queue),
+                key=self._usage.__getitem__,
+            )
+            queue = self._queues[tenant]
+            _, _, ticket = heapq.heappop(queue)
+            self._queued -= 1
+            if ticket.deadline is not None and ticket.deadline <= now:
+                # Its waiter sheds it, the slot goes to a job that can still start
+                continue
+            self._start(ticket)
+            ticket._wake()
+
+    def _start(self, ticket):
+        ticket.started_at = time.monotonic()
+        self._in_flight += 1
+        self._running[ticket.tenant] += 1
+        self._usage[ticket.tenant] += ticket.cost / self._weight(ticket.tenant)
+
+    def _forget_if_idle(self, tenant):
+        # Tenants without queued or running jobs are not tracked
+        if not self._running.get(tenant) and not self._queues.get(tenant):
+            self._usage.pop(tenant, None)
+            self._running.pop(tenant, None)
+            self._queues.pop(tenant, None)
+
+    def _weight(self, tenant):
+        return self.weights.get(tenant, 1)
@@ -1,21 +1,268 @@
 import asyncio
-from typing import Optional
+import itertools
+import json
+import math
+import os
+import time
+from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Path, Query, Request
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from pydantic import BaseModel, Field
 
 try:
     import helpers
-    from PythonSafeEval.safe_eval import SafeEvalJavaScript, SafeEvalPython
+    from item_store import MAX_ITEM_ID, MIN_ITEM_ID, item_store_from_env
+    from limiter import ConcurrencyLimiter, Overloaded
+    from metrics import Counter, Gauge, Histogram, Registry
+    from result_cache import result_cache_from_env
+    from cluster import ClusterSandboxPool
+    from sandbox_manager import RemoteSandboxPool, RemoteSessionManager
+    from PythonSafeEval.dependencies import validate_modules
+    from PythonSafeEval.output import spilled_output_path
+    from PythonSafeEval.pool import SandboxPool
+    from PythonSafeEval.scope_transfer import ScopeError, check_typed_arrays
+    from PythonSafeEval.session import (
+        SessionBusy,
+        SessionLost,
+        SessionNotFound,
+        SessionsExhausted,
+        session_manager_from_env,
+    )
+    from PythonSafeEval.syntax_check import format_syntax_error
+    from PythonSafeEval import timing
+    from PythonSafeEval.safe_eval import SafeEval, SafeEvalJavaScript, SafeEvalPython
 except:
     from app import helpers
-    from app.PythonSafeEval.safe_eval import SafeEvalJavaScript, SafeEvalPython
+    from app.item_store import MAX_ITEM_ID, MIN_ITEM_ID, item_store_from_env
+    from app.limiter import ConcurrencyLimiter, Overloaded
+    from app.metrics import Counter, Gauge, Histogram, Registry
+    from app.result_cache import result_cache_from_env
+    from app.cluster import ClusterSandboxPool
+    from app.sandbox_manager import RemoteSandboxPool, RemoteSessionManager
+    from app.PythonSafeEval.dependencies import validate_modules
+    from app.PythonSafeEval.output import spilled_output_path
+    from app.PythonSafeEval.pool import SandboxPool
+    from app.PythonSafeEval.scope_transfer import ScopeError, check_typed_arrays
+    from app.PythonSafeEval.session import (
+        SessionBusy,
+        SessionLost,
+        SessionNotFound,
+        SessionsExhausted,
+        session_manager_from_env,
+    )
+    from app.PythonSafeEval.syntax_check import format_syntax_error
+    from app.PythonSafeEval import timing
+    from app.PythonSafeEval.safe_eval import (
+        SafeEval,
+        SafeEvalJavaScript,
+        SafeEvalPython,
+    )
 
 # from app import pythonExecutor
 
 app = FastAPI()
 
+# Warm containers shared by every /evaluate request. With SANDBOX_CLUSTER_COORDINATOR
+# set they live on the nodes of a sandbox cluster (see cluster.py). With
+# SANDBOX_MANAGER_SOCKET set (gunicorn_conf.py does), they live in the host's
+# sandbox manager and are shared by all workers; otherwise this worker owns its
+# own pool.
+sandbox_cluster_coordinator = os.getenv("SANDBOX_CLUSTER_COORDINATOR")
+sandbox_manager_socket = os.getenv("SANDBOX_MANAGER_SOCKET")
+if sandbox_cluster_coordinator:
+    sandbox_pool = ClusterSandboxPool(
+        sandbox_cluster_coordinator,
+        token=os.getenv("SANDBOX_CLUSTER_TOKEN") or None,
+        timeout=float(os.getenv("SANDBOX_MANAGER_TIMEOUT", "300")),
+    )
+elif sandbox_manager_socket:
+    sandbox_pool = RemoteSandboxPool(
+        sandbox_manager_socket,
+        timeout=float(os.getenv("SANDBOX_MANAGER_TIMEOUT", "300")),
+    )
+else:
+    sandbox_pool = SandboxPool(
+        min_size=int(os.getenv("SANDBOX_POOL_MIN_SIZE", "0")),
+        max_size=int(os.getenv("SANDBOX_POOL_MAX_SIZE", "4")),
+        idle_timeout=float(os.getenv("SANDBOX_POOL_IDLE_TIMEOUT", "300")),
+        health_check_interval=float(
+            os.getenv("SANDBOX_POOL_HEALTH_CHECK_INTERVAL", "30")
+        ),
+    )
+
+# Stateful sessions (/sessions), each a long-lived interpreter in its own sandbox.
+# Behind a sandbox manager they live in the manager and every worker reaches all of
+# them; a sandbox cluster does not host sessions.
+if sandbox_cluster_coordinator:
+    session_manager = None
+elif sandbox_manager_socket:
+    session_manager = RemoteSessionManager(sandbox_pool)
+else:
+    session_manager = session_manager_from_env()
+
+# Caps in-flight sandbox jobs per worker and keeps them off the event loop. Jobs
+# over the cap queue per tenant and share the slots by TENANT_WEIGHTS, e.g.
+# '{"batch-jobs": 1, "interactive": 4}'.
+#
+# The tenant is the X-Tenant-ID header, which this server cannot authenticate, so
+# it is only read with TRUST_TENANT_HEADER=1. Set that only behind a trusted proxy
+# that authenticates the client, sets the header itself and drops any X-Tenant-ID
+# the client sent; otherwise every request belongs to the one default tenant.
+trust_tenant_header = os.getenv("TRUST_TENANT_HEADER", "0") == "1"
+evaluation_limiter = ConcurrencyLimiter(
+    max_in_flight=int(os.getenv("MAX_CONCURRENT_EVALUATIONS", "8")),
+    retry_after=int(os.getenv("EVALUATION_RETRY_AFTER", "1")),
+    max_queued=int(os.getenv("MAX_QUEUED_EVALUATIONS", "64")),
+    weights=json.loads(os.getenv("TENANT_WEIGHTS", "{}")),
+    default_time_limit=SafeEval.max_timelimit,
+)
+
+# Opt-in memoization of successful /evaluate responses (RESULT_CACHE_BACKEND)
+result_cache = result_cache_from_env()
+
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+
+# Prometheus metrics of this worker, served on /metrics
+metrics_registry = Registry()
+request_seconds = metrics_registry.register(
+    Histogram(
+        "safe_eval_request_seconds",
+        "Time to respond to an evaluation request.",
+        ["endpoint", "language", "version", "outcome"],
+    )
+)
+requests_total = metrics_registry.register(
+    Counter(
+        "safe_eval_requests_total",
+        "Evaluation requests handled.",
+        ["endpoint", "language", "version", "outcome"],
+    )
+)
+phase_seconds = metrics_registry.register(
+    Histogram(
+        "safe_eval_phase_seconds",
+        "Time spent in each phase of an evaluation.",
+        ["phase", "language", "version"],
+    )
+)
+timing.add_observer(
+    lambda phase, language, version, seconds: phase_seconds.observe(
+        seconds, phase, language, version
+    )
+)
+
+
+def pool_samples(field):
+    """
+    Sum one field of sandbox_pool.stats() per (language, version).
+    """
+    totals = {}
+    for (language, version, _), stats in sandbox_pool.stats().items():
+        value = stats["size"] - stats["idle"] if field == "busy" else stats[field]
+        totals[(language, version)] = totals.get((language, version), 0) + value
+    return list(totals.items())
+
+
+for field, documentation in (
+    ("idle", "Warm sandbox containers waiting for a request."),
+    ("busy", "Sandbox containers checked out or starting."),
+    ("waiting", "Requests waiting for a sandbox container to be released."),
+):
+    metrics_registry.register(
+        Gauge(
+            f"safe_eval_pool_{field}",
+            documentation,
+            ["language", "version"],
+            collect=lambda field=field: pool_samples(field),
+        )
+    )
+metrics_registry.register(
+    Gauge(
+        "safe_eval_in_flight",
+        "Evaluations running on this worker.",
+        collect=lambda: [((), evaluation_limiter.in_flight)],
+    )
+)
+metrics_registry.register(
+    Gauge(
+        "safe_eval_queued",
+        "Evaluations waiting for a slot on this worker.",
+        collect=lambda: [((), evaluation_limiter.queued)],
+    )
+)
+metrics_registry.register(
+    Gauge(
+        "safe_eval_max_in_flight",
+        "Evaluations this worker runs at the same time at most.",
+        collect=lambda: [((), evaluation_limiter.max_in_flight)],
+    )
+)
+metrics_registry.register(
+    Gauge(
+        "safe_eval_teardown_pending",
+        "Containers and session directories waiting for the reaper.",
+        collect=lambda: [((), SafeEval.reaper.pending)],
+    )
+)
+
+
+@app.middleware("http")
+async def time_evaluations(request: Request, call_next):
+    """
+    Times the /evaluate endpoints: a Server-Timing header with the duration of every
+    phase, and request metrics labeled by language, version and outcome.
+    """
+    if request.url.path not in ("/evaluate", "/evaluate/batch", "/evaluate/stream"):
+        return await call_next(request)
+
+    start = time.perf_counter()
+    with timing.record() as phases:
+        response = await call_next(request)
+    seconds = time.perf_counter() - start
+
+    language = getattr(request.state, "language", "")
+    version = ""
+    if language:
+        version = SandboxPool.evaluator_classes[language].default_version
+    if response.headers.get("X-Cache") == "HIT":
+        outcome = "cached"
+    else:
+        outcome = {200: "ok", 400: "error", 503: "overloaded"}.get(
+            response.status_code, "internal_error"
+        )
+    labels = (request.url.path, language, version, outcome)
+    request_seconds.observe(seconds, *labels)
+    requests_total.inc(*labels)
+
+    phases["total"] = seconds
+    response.headers["Server-Timing"] = timing.server_timing(phases)
+    return response
+
+
+@app.on_event("startup")
+def start_sandbox_pool():
+    # Containers of crashed workers would otherwise run until the host reboots
+    if not isinstance(sandbox_pool, (RemoteSandboxPool, ClusterSandboxPool)):
+        SafeEval.sweep_orphans()
+    sandbox_pool.start()
+    if session_manager is not None:
+        session_manager.start()
+
+
+@app.on_event("shutdown")
+def close_sandbox_pool():
+    sandbox_pool.close()
+    if session_manager is not None:
+        session_manager.close_all()
+    SafeEval.reaper.flush()
+
 
 # Define the data structure for the request body
 class Item(BaseModel):
@@ -25,39 +272,230 @@ class Item(BaseModel):
     item_name: Optional[str] = None
 
 
-# In-memory data store
-items_store = {}
+class ItemWithId(Item):
+    id: int = Field(ge=MIN_ITEM_ID, le=MAX_ITEM_ID)
+
+
+class ItemBatch(BaseModel):
+    items: List[ItemWithId]
+
+
+# Capacity-bounded item store (ITEM_STORE_BACKEND). The "sqlite" backend is shared
+# by every worker of the host, the default "memory" one is per worker.
+items_store = item_store_from_env()
+
+MAX_BULK_ITEMS = int(os.getenv("MAX_BULK_ITEMS", "1000"))
 
 
 @app.put("/items/{item_id}")
-async def update_item(item: Item, item_id: int):
+def update_item(item: Item, item_id: int = Path(ge=MIN_ITEM_ID, le=MAX_ITEM_ID)):
     """
-    Stores an item in the in-memory data store.
+    Stores an item in the data store.
     """
     item.item_name = item.name
-    items_store[item_id] = item
+    items_store.put(item_id, item.model_dump())
     return item
 
 
+@app.put("/items")
+def update_items(batch: ItemBatch):
+    """
+    Stores many items ({"items": [{"id", "name", ...}, ...]}) in one round trip.
+    """
+    if len(batch.items) > MAX_BULK_ITEMS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_BULK_ITEMS} items per request."
+        )
+    items = {}
+    for item in batch.items:
+        item.item_name = item.name
+        items[item.id] = item.model_dump(exclude={"id"})
+    items_store.put_many(items)
+    return {
+        "items": [{"item_id": item_id, "data": data} for item_id, data in items.items()]
+    }
+
+
+@app.get("/items")
+def get_items(
+    ids: Optional[str] = None,
+    cursor: Optional[int] = Query(None, ge=MIN_ITEM_ID, le=MAX_ITEM_ID),
+    limit: int = Query(100, ge=1, le=MAX_BULK_ITEMS),
+):
+    """
+    Retrieves the items listed in ids ("1,2,3"), or else one page of all items in id
+    order: pass the "next_cursor" of a page as cursor to get the next one.
+    """
+    if ids is not None:
+        try:
+            item_ids = [int(item_id) for item_id in ids.split(",") if item_id]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be integers.")
+        if any(not MIN_ITEM_ID <= item_id <= MAX_ITEM_ID for item_id in item_ids):
+            raise HTTPException(
+                status_code=400, detail="ids must fit in a signed 64-bit integer."
+            )
+        if len(item_ids) > MAX_BULK_ITEMS:
+            raise HTTPException(
+                status_code=400, detail=f"At most {MAX_BULK_ITEMS} ids per request."
+            )
+        found = items_store.get_many(item_ids)
+        return {
+            "items": [
+                {"item_id": item_id, "data": found[item_id]}
+                for item_id in dict.fromkeys(item_ids)
+                if item_id in found
+            ],
+            "missing": [
+                item_id for item_id in dict.fromkeys(item_ids) if item_id not in found
+            ],
+        }
+
+    # One extra item tells whether there is a next page
+    page = items_store.page(after=cursor, limit=limit + 1)
+    next_cursor = page[limit - 1][0] if len(page) > limit else None
+    return {
+        "items": [{"item_id": item_id, "data": data} for item_id, data in page[:limit]],
+        "next_cursor": next_cursor,
+    }
+
+
 @app.get("/items/{item_id}")
-async def get_item(item_id: int, q: str = None):
+def get_item(item_id: int = Path(ge=MIN_ITEM_ID, le=MAX_ITEM_ID), q: str = None):
     """
-    Retrieves an item from the in-memory data store.
+    Retrieves an item from the data store.
     """
-    if item_id not in items_store:
+    item = items_store.get(item_id)
+    if item is None:
         raise HTTPException(status_code=404, detail="Item not found")
-    item = items_store[item_id]
     response = {"item_id": item_id, "data": item}
     if q:
         response["query"] = q
     return response
 
 
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(
+        metrics_registry.render(), media_type=metrics_registry.content_type
+    )
+
+
 @app.get("/")
 def root():
     return {"message": "Hello, World!"}
 
 
+def overloaded_response(e):
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(e)},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def run_evaluation(
+    language,
+    code,
+    scope,
+    max_output_bytes=None,
+    typed_arrays=None,
+    time_limit=SafeEval.max_timelimit,
+    modules=None,
+):
+    """
+    Blocking part of /evaluate: checks a warm evaluator with the requested modules
+    out of the pool and runs the code in it. Runs on the limiter's thread pool.
+    """
+    with sandbox_pool.sandbox(language, modules=modules) as evaluator:
+        return evaluator.eval(
+            code=code,
+            time_limit=time_limit,
+            scope=scope,
+            max_output_bytes=max_output_bytes,
+            typed_arrays=typed_arrays,
+        )
+
+
+def scheduling(request, body, default_time_limit=SafeEval.max_timelimit):
+    """
+    How the limiter queues an evaluation request: its tenant (X-Tenant-ID header, if
+    trust_tenant_header is set; see above),
+    its time limit ("time_limit" seconds, bounded by the server maximum) and its
+    deadline ("deadline_ms" after arrival by which it must have started).
+    :return: (tenant, time_limit, deadline) as taken by ConcurrencyLimiter.acquire()
+    :raises ValueError: if "time_limit" or "deadline_ms" is not a positive number
+    """
+    received_at = time.monotonic()
+    tenant = None
+    if trust_tenant_header:
+        tenant = request.headers.get("X-Tenant-ID") or None
+
+    time_limit = body.get("time_limit", default_time_limit)
+    if isinstance(time_limit, bool) or not isinstance(time_limit, (int, float)):
+        raise ValueError("'time_limit' must be a number of seconds.")
+    if time_limit <= 0:
+        raise ValueError("'time_limit' must be positive.")
+    time_limit = min(math.ceil(time_limit), SafeEval.max_timelimit)
+
+    deadline = None
+    deadline_ms = body.get("deadline_ms")
+    if deadline_ms is not None:
+        if isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float)):
+            raise ValueError("'deadline_ms' must be a number of milliseconds.")
+        if deadline_ms <= 0:
+            raise ValueError("'deadline_ms' must be positive.")
+        deadline = received_at + deadline_ms / 1000
+    return tenant, time_limit, deadline
+
+
+async def admit(language, tenant, time_limit, deadline):
+    """
+    Wait for a limiter slot, timed as the "queue" phase of the request.
+    """
+    version = SandboxPool.evaluator_classes[language].default_version
+    with timing.phase("queue", language, version):
+        return await evaluation_limiter.acquire_async(tenant, time_limit, deadline)
+
+
+def queue_wait_ms(ticket):
+    return round(ticket.queue_wait * 1000, 1)
+
+
+def output_cap(body):
+    """
+    Per-request stdout/stderr cap: "max_output_bytes", bounded by the server maximum.
+    """
+    requested = body.get("max_output_bytes")
+    if not isinstance(requested, int) or requested <= 0:
+        return SafeEvalPython.max_output_bytes
+    return min(requested, SafeEvalPython.max_output_bytes)
+
+
+def scope_error_response(message):
+    return JSONResponse(status_code=400, content={"error": message})
+
+
+async def syntax_error_response(language, code):
+    """
+    Rejects code that does not parse on the host, before a sandbox is involved.
+    Returns None when the code passes the check. Parsing untrusted code, and the
+    round trip to the node checker, run on a thread so they do not block the event
+    loop.
+    """
+    check_syntax = SandboxPool.evaluator_classes[language].check_syntax
+    syntax_error = await asyncio.to_thread(check_syntax, code)
+    if syntax_error is None:
+        return None
+    return JSONResponse(
+        status_code=400,
+        content={
+            "error": f"An error occurred: {format_syntax_error(syntax_error)}",
+            "syntax_error": syntax_error,
+        },
+    )
+
+
 @app.post("/evaluate")
 async def evaluate(request: Request):
     try:
@@ -74,34 +512,449 @@ async def evaluate(request: Request):
                 content={"error": "Both 'code' and 'language' fields are required."},
             )
 
-        # Choose the appropriate evaluator
-        if language == "python":
-            evaluator = SafeEvalPython(
-                version="3.8", modules=[]
-            )  # TODO: add more modules here that could work.  need to figure out what you can do
-        elif language == "javascript":
-            evaluator = SafeEvalJavaScript(version="16", modules=[])
-        else:
+        if language not in SandboxPool.evaluator_classes:
             return JSONResponse(
                 status_code=400, content={"error": f"Unsupported language: {language}"}
             )
+        request.state.language = language
+
+        rejected = await syntax_error_response(language, code)
+        if rejected is not None:
+            return rejected
+
+        # Scope lists to send as typed arrays, {variable: dtype}
+        typed_arrays = body.get("typed_arrays") or None
+        scope_error = check_typed_arrays(scope, typed_arrays)
+        if scope_error is not None:
+            return scope_error_response(scope_error)
 
-        # Evaluate the code
-        result, hashed_s = evaluator.eval(code=code, scope=scope)
+        try:
+            tenant, time_limit, deadline = scheduling(request, body)
+            modules = validate_modules(language, body.get("modules"))
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+
+        # Serve byte-identical payloads from the result cache unless the caller opts out
+        cache_key = None
+        cache_headers = {}
+        if result_cache is not None:
+            if body.get("cache", True) and "no-cache" not in request.headers.get(
+                "Cache-Control", ""
+            ):
+                version = SandboxPool.evaluator_classes[language].default_version
+                cache_scope = scope
+                if typed_arrays:
+                    cache_scope = {"scope": scope, "typed_arrays": typed_arrays}
+                cache_key = result_cache.key(
+                    language, version, modules, code, cache_scope
+                )
+                cached = result_cache.get(cache_key)
+                if cached is not None:
+                    return JSONResponse(
+                        status_code=200, content=cached, headers={"X-Cache": "HIT"}
+                    )
+                cache_headers = {"X-Cache": "MISS"}
+            else:
+                cache_headers = {"X-Cache": "BYPASS"}
+
+        # Wait for a slot in the tenant's queue, then evaluate the code on the
+        # sandbox thread pool
+        try:
+            ticket = await admit(language, tenant, time_limit, deadline)
+            result, hashed_s = await evaluation_limiter.run(
+                run_evaluation,
+                language,
+                code,
+                scope,
+                output_cap(body),
+                typed_arrays,
+                time_limit,
+                modules,
+                ticket=ticket,
+            )
+        except Overloaded as e:
+            return overloaded_response(e)
+        except ScopeError as e:
+            return scope_error_response(str(e))
 
         out = result.get("stdout")
         err = result.get("stderr")
         returncode = result.get("returncode")
         if returncode != 0:
+            content = {"error": f"An error occurred: {err}"}
+            if "truncation" in result:
+                content["truncation"] = result["truncation"]
+            content["queue_wait_ms"] = queue_wait_ms(ticket)
+            return JSONResponse(status_code=400, content=content, headers=cache_headers)
+
+        if returncode == 0:
+            version = SandboxPool.evaluator_classes[language].default_version
+            with timing.phase("parse", language, version):
+                output = helpers.extract_return_value(result, hashed_s)
+            content = {"output": output, "stdout": out}
+            if "truncation" in result:
+                # Spilled outputs expire, so truncated responses are not cached
+                content["truncation"] = result["truncation"]
+            elif cache_key is not None:
+                result_cache.set(cache_key, content)
+            # Not part of the cached content, a cache hit does not queue
+            content = {**content, "queue_wait_ms": queue_wait_ms(ticket)}
+            return JSONResponse(status_code=200, content=content, headers=cache_headers)
+
+    except Exception as e:
+        # Handle unexpected errors
+        return JSONResponse(
+            status_code=500,
+            content={
+                "error": f"An error occurred: {str(e)}",
+            },
+        )
+
+
+@app.get("/outputs/{output_id}")
+def get_spilled_output(output_id: str):
+    """
+    Returns the full output stream of an evaluation whose output was truncated. The id
+    is the "output_id" from the response's "truncation" metadata.
+    """
+    path = spilled_output_path(output_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Output not found")
+    return FileResponse(path, media_type="text/plain; charset=utf-8")
+
+
+def run_batch_evaluation(language, items, item_time_limit, modules=None):
+    """
+    Blocking part of /evaluate/batch: runs every item in one sandboxed interpreter.
+    """
+    with sandbox_pool.sandbox(language, modules=modules) as evaluator:
+        return evaluator.eval_batch(items, item_time_limit=item_time_limit)
+
+
+@app.post("/evaluate/batch")
+async def evaluate_batch(request: Request):
+    """
+    Evaluates one code body over a list of scopes ({"code", "scopes"}) or a list of
+    {"code", "scope"} items, all inside a single sandbox launch. Results come back in
+    order; a failing item does not fail the others.
+    """
+    try:
+        body = await request.json()
+        language = body.get("language")
+        if "items" in body:
+            items = [
+                (item.get("code"), item.get("scope", {})) for item in body["items"]
+            ]
+        else:
+            items = [(body.get("code"), scope) for scope in body.get("scopes", [])]
+
+        # Validate required fields
+        if not language or not items or not all(code for code, _ in items):
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "error": "'language' and 'code' with 'scopes', or 'items', are required."
+                },
+            )
+        if len(items) > MAX_BATCH_SIZE:
             return JSONResponse(
-                status_code=400, content={"error": f"An error occurred: {err}"}
+                status_code=400,
+                content={"error": f"Batches are limited to {MAX_BATCH_SIZE} items."},
+            )
+        if language not in SandboxPool.evaluator_classes:
+            return JSONResponse(
+                status_code=400, content={"error": f"Unsupported language: {language}"}
             )
+        request.state.language = language
 
-        if returncode == 0:
-            output = helpers.extract_value_after_return(out, hashed_s)
+        # "time_limit" is per item here, the batch as a whole is charged for all
+        try:
+            tenant, item_time_limit, deadline = scheduling(request, body)
+            modules = validate_modules(language, body.get("modules"))
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        batch_time_limit = min(item_time_limit * len(items), SafeEval.max_timelimit)
+
+        try:
+            ticket = await admit(language, tenant, batch_time_limit, deadline)
+            result, hashed_s = await evaluation_limiter.run(
+                run_batch_evaluation,
+                language,
+                items,
+                item_time_limit,
+                modules,
+                ticket=ticket,
+            )
+        except Overloaded as e:
+            return overloaded_response(e)
+
+        results = helpers.extract_batch_results(result, hashed_s, len(items))
+        if result.get("returncode") != 0 and not any(results):
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"An error occurred: {result.get('stderr')}"},
+            )
+
+        response = []
+        for item in results:
+            if item is None:
+                response.append({"error": "The batch stopped before this item ran."})
+            elif "error" in item:
+                response.append({"error": item["error"], "stdout": item["stdout"]})
+            else:
+                response.append(
+                    {"output": item.get("returnValue"), "stdout": item["stdout"]}
+                )
+        return JSONResponse(
+            status_code=200,
+            content={"results": response, "queue_wait_ms": queue_wait_ms(ticket)},
+        )
+
+    except Exception as e:
+        # Handle unexpected errors
+        return JSONResponse(
+            status_code=500,
+            content={
+                "error": f"An error occurred: {str(e)}",
+            },
+        )
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_evaluation(
+    language, code, scope, typed_arrays, time_limit, ticket, modules=None
+):
+    """
+    Blocking generator behind /evaluate/stream, iterated on starlette's thread pool.
+    Releases the limiter slot (ticket) taken by the handler once the stream ends.
+
+    The first item is an SSE comment yielded before any work: the handler takes it
+    right away, so the generator is inside its try block before the response starts,
+    and a response that is dropped without being sent still releases the slot when
+    the generator is closed.
+    """
+    try:
+        yield ": admitted\n\n"
+        with sandbox_pool.sandbox(language, modules=modules) as evaluator:
+            frames = evaluator.eval_stream(
+                code, time_limit=time_limit, scope=scope, typed_arrays=typed_arrays
+            )
+            for frame in frames:
+                if "stream" in frame:
+                    yield sse_event(frame["stream"], {"data": frame["data"]})
+                elif frame["returncode"] == 0:
+                    result = {"output": frame.get("returnValue"), "returncode": 0}
+                    result["queue_wait_ms"] = queue_wait_ms(ticket)
+                    yield sse_event("result", result)
+                else:
+                    result = {
+                        "error": f"Process exited with code {frame['returncode']}",
+                        "returncode": frame["returncode"],
+                        "queue_wait_ms": queue_wait_ms(ticket),
+                    }
+                    yield sse_event("result", result)
+    except Exception as e:
+        result = {"error": f"An error occurred: {str(e)}", "returncode": None}
+        yield sse_event("result", result)
+    finally:
+        evaluation_limiter.release(ticket)
+
+
+@app.post("/evaluate/stream")
+async def evaluate_stream(request: Request):
+    """
+    Like /evaluate, but streams Server-Sent Events while the code runs: "stdout" and
+    "stderr" events with output chunks, then one "result" event with the return value
+    (or error) and the exit code.
+    """
+    try:
+        body = await request.json()
+        code = body.get("code")
+        scope = body.get("scope", {})
+        language = body.get("language")
+
+        # Validate required fields
+        if not code or not language:
+            return JSONResponse(
+                status_code=400,
+                content={"error": "Both 'code' and 'language' fields are required."},
+            )
+        if language not in SandboxPool.evaluator_classes:
+            return JSONResponse(
+                status_code=400, content={"error": f"Unsupported language: {language}"}
+            )
+        request.state.language = language
+        rejected = await syntax_error_response(language, code)
+        if rejected is not None:
+            return rejected
+        typed_arrays = body.get("typed_arrays") or None
+        scope_error = check_typed_arrays(scope, typed_arrays)
+        if scope_error is not None:
+            return scope_error_response(scope_error)
+        try:
+            tenant, time_limit, deadline = scheduling(request, body)
+            modules = validate_modules(language, body.get("modules"))
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+
+        try:
+            ticket = await admit(language, tenant, time_limit, deadline)
+        except Overloaded as e:
+            return overloaded_response(e)
+        stream = stream_evaluation(
+            language, code, scope, typed_arrays, time_limit, ticket, modules
+        )
+        # From here on closing the stream, or dropping it, releases the ticket
+        first = next(stream)
+        return StreamingResponse(
+            itertools.chain([first], stream),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    except Exception as e:
+        # Handle unexpected errors
+        return JSONResponse(
+            status_code=500,
+            content={
+                "error": f"An error occurred: {str(e)}",
+            },
+        )
+
+
+# Status codes of the errors of stateful sessions
+session_error_status = {
+    SessionNotFound: 404,
+    SessionBusy: 409,
+    SessionLost: 410,
+    SessionsExhausted: 503,
+}
+
+
+def session_error_response(e):
+    headers = {}
+    if isinstance(e, SessionsExhausted):
+        headers["Retry-After"] = str(evaluation_limiter.retry_after)
+    return JSONResponse(
+        status_code=session_error_status[type(e)],
+        content={"error": str(e)},
+        headers=headers,
+    )
+
+
+def sessions_unavailable_response():
+    return JSONResponse(
+        status_code=501,
+        content={"error": "Sessions are not available on a sandbox cluster."},
+    )
+
+
+@app.post("/sessions")
+async def create_session(request: Request):
+    """
+    Starts a stateful session: a long-lived Python interpreter whose globals persist
+    between calls to /sessions/{session_id}/evaluate. Optional "version" and
+    "modules" are as for /evaluate.
+    """
+    if session_manager is None:
+        return sessions_unavailable_response()
+    try:
+        body = await request.json()
+        language = body.get("language", SafeEvalPython.language)
+        if language != SafeEvalPython.language:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Sessions are not supported for {language}."},
+            )
+        try:
+            tenant, _, deadline = scheduling(request, body)
+            modules = validate_modules(language, body.get("modules"))
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+
+        # Starting the sandbox takes a slot like an evaluation does
+        try:
+            ticket = await admit(language, tenant, SafeEval.max_timelimit, deadline)
+            session_id = await evaluation_limiter.run(
+                session_manager.create,
+                body.get("version"),
+                modules,
+                tenant,
+                ticket=ticket,
+            )
+        except Overloaded as e:
+            return overloaded_response(e)
+        except SessionsExhausted as e:
+            return session_error_response(e)
+        return JSONResponse(status_code=201, content={"session_id": session_id})
+
+    except Exception as e:
+        # Handle unexpected errors
+        return JSONResponse(
+            status_code=500,
+            content={
+                "error": f"An error occurred: {str(e)}",
+            },
+        )
+
+
+@app.post("/sessions/{session_id}/evaluate")
+async def evaluate_in_session(session_id: str, request: Request):
+    """
+    Runs "code" in the session's interpreter, after merging the optional "scope" into
+    its globals. Like a notebook cell, the value of a trailing expression is the
+    "output". A session runs one call at a time; a call made while another one runs
+    gets 409. A session that went over its budgets or a time limit is gone (410).
+    """
+    if session_manager is None:
+        return sessions_unavailable_response()
+    try:
+        body = await request.json()
+        code = body.get("code")
+        scope = body.get("scope", {})
+        if not code:
             return JSONResponse(
-                status_code=200, content={"output": output, "stdout": out}
+                status_code=400, content={"error": "The 'code' field is required."}
             )
+        if not isinstance(scope, dict):
+            return JSONResponse(
+                status_code=400, content={"error": "'scope' must be an object."}
+            )
+        try:
+            tenant, time_limit, deadline = scheduling(request, body)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+
+        try:
+            ticket = await admit(SafeEvalPython.language, tenant, time_limit, deadline)
+            reply = await evaluation_limiter.run(
+                session_manager.evaluate,
+                session_id,
+                code,
+                scope,
+                time_limit,
+                output_cap(body),
+                ticket=ticket,
+            )
+        except Overloaded as e:
+            return overloaded_response(e)
+        except (SessionNotFound, SessionBusy, SessionLost) as e:
+            return session_error_response(e)
+
+        content = {"stdout": reply["stdout"], "stderr": reply["stderr"]}
+        if reply.get("truncated"):
+            content["truncated"] = True
+        content["queue_wait_ms"] = queue_wait_ms(ticket)
+        if "error" in reply:
+            return JSONResponse(
+                status_code=400, content={"error": reply["error"], **content}
+            )
+        return JSONResponse(
+            status_code=200, content={"output": reply["returnValue"], **content}
+        )
 
     except Exception as e:
         # Handle unexpected errors
@@ -113,6 +966,20 @@ async def evaluate(request: Request):
         )
 
 
+@app.delete("/sessions/{session_id}", status_code=204)
+def delete_session(session_id: str):
+    """
+    Closes a session and tears its sandbox down.
+    """
+    if session_manager is None:
+        return sessions_unavailable_response()
+    try:
+        session_manager.close(session_id)
+    except SessionNotFound as e:
+        return session_error_response(e)
+    return Response(status_code=204)
+
+
 if __name__ == "__main__":
     evaluator = SafeEvalJavaScript(
         version="16", modules=[]
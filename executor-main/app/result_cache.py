@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBackend:
+    """
+    In-process LRU store with a memory budget. Values are JSON strings, so their size
+    is known exactly.
+    """
+
+    def __init__(self, max_bytes=64 * 1024**2):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.time() + ttl)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._size -= len(value)
+
+
+class SQLiteBackend:
+    """
+    On-disk LRU store shared by every worker on the host. WAL mode lets the workers
+    read concurrently while one of them writes.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024**2):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)"
+        )
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM results WHERE key = ? AND expires_at >= ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE results SET last_used = ? WHERE key = ?", (now, key)
+            )
+        return row[0]
+
+    def set(self, key, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), now + ttl, now),
+                )
+                self._connection.execute(
+                    "DELETE FROM results WHERE expires_at < ?", (now,)
+                )
+                self._evict()
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def _evict(self):
+        (total,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        # Walk the least recently used rows until enough bytes are freed
+        excess = total - self.max_bytes
+        keys = []
+        for key, size in self._connection.execute(
+            "SELECT key, size FROM results ORDER BY last_used"
+        ):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._connection.executemany("DELETE FROM results WHERE key = ?", keys)
+
+
+class ResultCache:
+    """
+    Memoizes evaluation responses keyed by a hash of the normalized
+    (language, version, modules, code, scope) payload.
+    """
+
+    def __init__(self, backend, ttl=300):
+        """
+        :param backend: MemoryBackend or SQLiteBackend
+        :param ttl: seconds a result stays valid
+        """
+        self.backend = backend
+        self.ttl = ttl
+
+    def key(self, language, version, modules, code, scope):
+        payload = json.dumps(
+            {
+                "language": language,
+                "version": version,
+                "modules": sorted(modules or []),
+                "code": code,
+                "scope": scope or {},
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.backend.set(key, json.dumps(value, separators=(",", ":")), self.ttl)
+
+
+def result_cache_from_env():
+    """
+    Build the result cache configured by RESULT_CACHE_BACKEND ("memory" or "sqlite").
+    Returns None when result caching is off, which is the default.
+    """
+    backend_name = os.getenv("RESULT_CACHE_BACKEND", "").lower()
+    max_bytes = int(os.getenv("RESULT_CACHE_BYTES", 64 * 1024**2))
+    if backend_name == "memory":
+        backend = MemoryBackend(max_bytes=max_bytes)
+    elif backend_name == "sqlite":
+        backend = SQLiteBackend(
+            os.getenv("RESULT_CACHE_PATH", "result_cache.db"), max_bytes=max_bytes
+        )
+    elif backend_name in ("", "off", "none"):
+        return None
+    else:
+        raise ValueError(f"Unknown RESULT_CACHE_BACKEND: {backend_name}")
+    return ResultCache(backend, ttl=float(os.getenv("RESULT_CACHE_TTL", "300")))
@@ -0,0 +1,611 @@
+"""
+Host-wide sandbox manager.
+
+gunicorn starts one manager per host (see gunicorn_conf.py) and every worker talks
+to it over a Unix socket instead of owning containers itself. The manager holds the
+only SandboxPool of the host, so warm sandboxes are shared by all workers and the
+number of evaluations running at once is capped for the whole host rather than per
+worker.
+
+A manager can also listen on TCP (host:port instead of a socket path) and serve as
+a node of a multi-host cluster, see cluster.py. Nodes check a shared token then,
+and refuse to start without one: anyone who reaches the port could run code.
+
+Requests and replies use the executor daemon's framing, one request per connection:
+
+    request  {"op": "eval" | "eval_batch" | "eval_stream" | "stats",
+              "language": str, "version": str | None, "modules": [str],
+              "args": {keyword arguments of the evaluator method},
+              "token": str (only when the manager has one)}
+             {"op": "session_create", "version": str | None, "modules": [str],
+              "tenant": str | None}
+             {"op": "session_eval", "session": str,
+              "args": {keyword arguments of SessionManager.evaluate()}}
+             {"op": "session_close", "session": str}
+    replies  eval, eval_batch  {"response": {...}, "hashed": str, "result": n}
+                               followed by n raw bytes when "result" is present
+             eval_stream       {"frame": {...}}, one per frame, the last one holds
+                               the "returncode"
+             stats             {"stats": [[language, version, modules, {...}], ...],
+                                "in_flight": int, "max_in_flight": int,
+                                "sessions": {...}}
+             session_create    {"session": str}
+             session_eval      {"reply": {...}}
+             session_close     {"closed": true}
+             on failure        {"error": str, "kind": "overloaded" | "scope" | "error"
+                                | the kind of a SessionError, "retry_after": int}
+
+Stateful sessions (see PythonSafeEval/session.py) live in the manager too, so every
+worker reaches every session of the host.
+"""
+
+import argparse
+import hmac
+import os
+import signal
+import socket
+import socketserver
+import threading
+from contextlib import contextmanager
+
+try:
+    from limiter import ConcurrencyLimiter, Overloaded
+    from PythonSafeEval.executor_daemon import (
+        ExecutorError,
+        _recv_exactly,
+        read_frame,
+        write_frame,
+    )
+    from PythonSafeEval.pool import SandboxPool
+    from PythonSafeEval.safe_eval import SafeEval
+    from PythonSafeEval.scope_transfer import ScopeError
+    from PythonSafeEval.session import (
+        SessionBusy,
+        SessionError,
+        SessionLost,
+        SessionNotFound,
+        SessionsExhausted,
+        session_manager_from_env,
+    )
+except ImportError:
+    from app.limiter import ConcurrencyLimiter, Overloaded
+    from app.PythonSafeEval.executor_daemon import (
+        ExecutorError,
+        _recv_exactly,
+        read_frame,
+        write_frame,
+    )
+    from app.PythonSafeEval.pool import SandboxPool
+    from app.PythonSafeEval.safe_eval import SafeEval
+    from app.PythonSafeEval.scope_transfer import ScopeError
+    from app.PythonSafeEval.session import (
+        SessionBusy,
+        SessionError,
+        SessionLost,
+        SessionNotFound,
+        SessionsExhausted,
+        session_manager_from_env,
+    )
+
+# Session errors by the "kind" they are sent as
+session_errors = {
+    error.kind: error
+    for error in (SessionNotFound, SessionBusy, SessionLost, SessionsExhausted)
+}
+
+
+class ManagerError(Exception):
+    """
+    Raised in a worker when the sandbox manager is unreachable or failed a request.
+    """
+
+
+class ManagerUnavailable(ManagerError):
+    """
+    Raised when the manager could not be reached, before it got the request.
+    """
+
+
+class ManagerLost(ManagerError):
+    """
+    Raised when the connection to the manager broke before it replied, e.g. because
+    the manager died while running the job.
+    """
+
+
+def parse_address(address):
+    """
+    Turn "host:port" into a (host, port) TCP address; anything else is a Unix socket
+    path.
+    """
+    address = str(address)
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit() and "/" not in address:
+        return host, int(port)
+    return address
+
+
+def format_address(address):
+    if isinstance(address, tuple):
+        return f"{address[0]}:{address[1]}"
+    return str(address)
+
+
+# ------------------------------------------------------------------------------
+# Manager side
+# ------------------------------------------------------------------------------
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            request = read_frame(self.request)
+        except (OSError, ValueError):
+            return
+        if request is None:
+            return
+
+        op = request.get("op")
+        token = self.server.token
+        if token and not hmac.compare_digest(str(request.get("token", "")), token):
+            self._reply_error("Invalid cluster token.", "error")
+            return
+        try:
+            if op == "stats":
+                write_frame(self.request, self.server.stats())
+                return
+            if op == "session_close":
+                self._session(op, request)
+                return
+            if op not in (
+                "eval",
+                "eval_batch",
+                "eval_stream",
+                "session_create",
+                "session_eval",
+            ):
+                raise ValueError(f"Unknown operation: {op}")
+            ticket = self.server.limiter.acquire()
+            try:
+                if op.startswith("session_"):
+                    self._session(op, request)
+                else:
+                    self._evaluate(op, request)
+            finally:
+                self.server.limiter.release(ticket)
+        except OSError:
+            # The worker went away, e.g. its client disconnected from a stream
+            pass
+        except Overloaded as e:
+            self._reply_error(e, "overloaded", e.retry_after)
+        except ScopeError as e:
+            self._reply_error(e, "scope")
+        except SessionError as e:
+            self._reply_error(e, e.kind)
+        except Exception as e:
+            self._reply_error(e, "error")
+
+    def _evaluate(self, op, request):
+        pool = self.server.pool
+        args = request.get("args", {})
+        with pool.sandbox(
+            request["language"], request.get("version"), request.get("modules")
+        ) as evaluator:
+            if op == "eval_stream":
+                frames = evaluator.eval_stream(**args)
+                try:
+                    for frame in frames:
+                        write_frame(self.request, {"frame": frame})
+                finally:
+                    frames.close()
+                return
+
+            method = evaluator.eval if op == "eval" else evaluator.eval_batch
+            response, hashed_s = method(**args)
+
+        # The sandbox is back in the pool before the worker can send its next job
+        response = dict(response)
+        result = response.pop("result", None)
+        reply = {"response": response, "hashed": hashed_s}
+        if result is None:
+            write_frame(self.request, reply)
+        else:
+            reply["result"] = len(result)
+            write_frame(self.request, reply)
+            self.request.sendall(result)
+
+    def _session(self, op, request):
+        sessions = self.server.sessions
+        if sessions is None:
+            raise ValueError("This sandbox manager does not host sessions.")
+        if op == "session_create":
+            session_id = sessions.create(
+                request.get("version"), request.get("modules"), request.get("tenant")
+            )
+            reply = {"session": session_id}
+        elif op == "session_eval":
+            reply = {
+                "reply": sessions.evaluate(
+                    request["session"], **request.get("args", {})
+                )
+            }
+        else:
+            sessions.close(request["session"])
+            reply = {"closed": True}
+        write_frame(self.request, reply)
+
+    def _reply_error(self, error, kind, retry_after=None):
+        try:
+            write_frame(
+                self.request,
+                {"error": str(error), "kind": kind, "retry_after": retry_after},
+            )
+        except OSError:
+            pass
+
+
+class SandboxManager(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Serves evaluations from one SandboxPool to every worker of the host. At most
+    max_in_flight evaluations run at the same time; requests over the cap are
+    rejected with "overloaded", like the per-worker limiter does.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        address,
+        pool,
+        max_in_flight=8,
+        retry_after=1,
+        token=None,
+        sessions=None,
+    ):
+        """
+        :param address: path of the Unix socket to listen on, or (host, port)
+        :param pool: SandboxPool the evaluations run in
+        :param max_in_flight: evaluations running at the same time on the whole host
+        :param retry_after: seconds workers tell clients to wait after a rejection
+        :param token: secret every request has to carry, required for TCP
+            listeners
+        :param sessions: SessionManager of the host's stateful sessions, None to
+            host none
+        :raises ValueError: if the manager listens on TCP without a token
+        """
+        self.socket_path = None
+        if isinstance(address, tuple) and not token:
+            raise ValueError(
+                "A sandbox manager listening on TCP needs a token "
+                "(SANDBOX_CLUSTER_TOKEN)."
+            )
+        if not isinstance(address, tuple):
+            self.address_family = socket.AF_UNIX
+            self.socket_path = address = str(address)
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        self.pool = pool
+        self.sessions = sessions
+        self.token = token
+        self.limiter = ConcurrencyLimiter(
+            max_in_flight=max_in_flight, retry_after=retry_after
+        )
+        super().__init__(address, _RequestHandler)
+        if self.socket_path is not None:
+            # Workers run as the same user, nobody else gets to submit code
+            os.chmod(self.socket_path, 0o600)
+
+    @property
+    def address(self):
+        """
+        Where clients reach the manager: the socket path or "host:port".
+        """
+        return format_address(self.server_address)
+
+    def stats(self):
+        stats = {
+            "stats": [
+                [language, version, list(modules), stats]
+                for (language, version, modules), stats in self.pool.stats().items()
+            ],
+            "in_flight": self.limiter.in_flight,
+            "max_in_flight": self.limiter.max_in_flight,
+        }
+        if self.sessions is not None:
+            stats["sessions"] = self.sessions.stats()
+        return stats
+
+    def server_close(self):
+        super().server_close()
+        if self.socket_path is None:
+            return
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def serve(server, registration=None):
+    """
+    Run a manager until SIGTERM or SIGINT, then tear down the pool's sandboxes and
+    the sessions.
+    :param server: the SandboxManager to run
+    :param registration: optional object whose start() and stop() are called when
+        the manager starts and stops serving, e.g. cluster.NodeRegistration
+    """
+    # Sandboxes of a manager that crashed would otherwise run until the host reboots
+    SafeEval.sweep_orphans()
+    server.pool.start()
+    if server.sessions is not None:
+        server.sessions.start()
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if registration is not None:
+        registration.start()
+    try:
+        server.serve_forever()
+    finally:
+        if registration is not None:
+            registration.stop()
+        server.server_close()
+        server.pool.close()
+        if server.sessions is not None:
+            server.sessions.close_all()
+        SafeEval.reaper.flush()
+
+
+def manager_from_env(address, token=None):
+    """
+    Build a SandboxManager, its pool and its sessions from the SANDBOX_MANAGER_*,
+    SANDBOX_POOL_* and SESSION_* environment variables.
+    """
+    max_in_flight = int(
+        os.getenv("SANDBOX_MANAGER_MAX_IN_FLIGHT", str(os.cpu_count() or 1))
+    )
+    pool = SandboxPool(
+        min_size=int(os.getenv("SANDBOX_POOL_MIN_SIZE", "0")),
+        # Every running evaluation may need its own sandbox of the same key
+        max_size=int(os.getenv("SANDBOX_POOL_MAX_SIZE", str(max_in_flight))),
+        idle_timeout=float(os.getenv("SANDBOX_POOL_IDLE_TIMEOUT", "300")),
+        health_check_interval=float(
+            os.getenv("SANDBOX_POOL_HEALTH_CHECK_INTERVAL", "30")
+        ),
+        tmp_dir=os.getenv("SANDBOX_POOL_TMP_DIR") or None,
+    )
+    return SandboxManager(
+        address,
+        pool,
+        max_in_flight=max_in_flight,
+        retry_after=int(os.getenv("EVALUATION_RETRY_AFTER", "1")),
+        token=token,
+        sessions=session_manager_from_env(
+            tmp_dir=os.getenv("SANDBOX_POOL_TMP_DIR") or None
+        ),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "address", help="path of the Unix socket to listen on, or host:port"
+    )
+    args = parser.parse_args(argv)
+    address = parse_address(args.address)
+    token = os.getenv("SANDBOX_CLUSTER_TOKEN") or None
+    if isinstance(address, tuple) and token is None:
+        parser.error("SANDBOX_CLUSTER_TOKEN must be set to listen on TCP.")
+    serve(manager_from_env(address, token))
+
+
+# ------------------------------------------------------------------------------
+# Worker side
+# ------------------------------------------------------------------------------
+
+
+class RemoteEvaluator:
+    """
+    Stand-in for a SafeEval instance whose calls run in a sandbox of the manager.
+    """
+
+    def __init__(self, client, language, version, modules):
+        self._client = client
+        self._target = {"language": language, "version": version, "modules": modules}
+
+    def eval(self, **kwargs):
+        return self._client.call("eval", self._target, kwargs)
+
+    def eval_batch(self, items, **kwargs):
+        kwargs["items"] = [list(item) for item in items]
+        return self._client.call("eval_batch", self._target, kwargs)
+
+    def eval_stream(self, code, **kwargs):
+        kwargs["code"] = code
+        return self._client.stream(self._target, kwargs)
+
+
+class RemoteSandboxPool:
+    """
+    Drop-in for SandboxPool in a worker when a sandbox manager runs on the host.
+    Sandboxes are checked out by the manager for the duration of each call, so there
+    is nothing to start, close or release here.
+    """
+
+    evaluator_classes = SandboxPool.evaluator_classes
+
+    def __init__(self, address, timeout=300, connect_timeout=5, token=None):
+        """
+        :param address: Unix socket path or "host:port" of the manager
+        :param timeout: seconds to wait for the manager's reply to a call
+        :param connect_timeout: seconds to wait for the manager to accept
+        :param token: secret of a manager that listens on TCP
+        """
+        self.address = parse_address(address)
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.token = token
+
+    @contextmanager
+    def sandbox(self, language, version=None, modules=None, timeout=None):
+        if language not in self.evaluator_classes:
+            raise ValueError(f"Unsupported language: {language}")
+        yield RemoteEvaluator(self, language, version, list(modules or []))
+
+    def stats(self):
+        """
+        Pool statistics of the manager, in the shape of SandboxPool.stats().
+        """
+        reply = self.request({"op": "stats"})
+        return {
+            (language, version, tuple(modules)): stats
+            for language, version, modules, stats in reply["stats"]
+        }
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def request(self, request):
+        """
+        Send one request to the manager and return its single reply frame.
+        """
+        with self._connect() as sock:
+            write_frame(sock, self._request(request))
+            return self._read_reply(sock)
+
+    def call(self, op, target, args):
+        """
+        Run eval or eval_batch in the manager and return its (response, hashed_s).
+        """
+        with self._connect() as sock:
+            write_frame(sock, self._request(dict(target, op=op, args=args)))
+            reply = self._read_reply(sock)
+            response = reply["response"]
+            if "result" in reply:
+                response["result"] = _recv_exactly(sock, reply["result"])
+                if response["result"] is None:
+                    raise ManagerError("Sandbox manager closed the connection.")
+        return response, reply["hashed"]
+
+    def stream(self, target, args):
+        """
+        Run eval_stream in the manager and yield its frames as they arrive.
+        Closing the generator early closes the connection, which stops the job.
+        """
+        with self._connect() as sock:
+            write_frame(sock, self._request(dict(target, op="eval_stream", args=args)))
+            while True:
+                frame = self._read_reply(sock)["frame"]
+                yield frame
+                if "returncode" in frame:
+                    return
+
+    # --------------------------------------------------------------------------
+    # Internal helper methods
+    # --------------------------------------------------------------------------
+    def _request(self, request):
+        if self.token:
+            request["token"] = self.token
+        return request
+
+    def _connect(self):
+        if isinstance(self.address, tuple):
+            family = socket.AF_INET6 if ":" in self.address[0] else socket.AF_INET
+        else:
+            family = socket.AF_UNIX
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(self.address)
+        except OSError as e:
+            sock.close()
+            raise ManagerUnavailable(
+                "Failed to connect to the sandbox manager at "
+                f"{format_address(self.address)}: {e}"
+            )
+        sock.settimeout(self.timeout)
+        return sock
+
+    def _read_reply(self, sock):
+        try:
+            reply = read_frame(sock)
+        except (OSError, ExecutorError) as e:
+            raise ManagerLost(f"Sandbox manager connection failed: {e}")
+        if reply is None:
+            raise ManagerLost("Sandbox manager closed the connection.")
+        if "error" in reply:
+            if reply["kind"] == "overloaded":
+                raise Overloaded(reply["retry_after"])
+            if reply["kind"] == "scope":
+                raise ScopeError(reply["error"])
+            if reply["kind"] in session_errors:
+                raise session_errors[reply["kind"]](reply["error"])
+            raise ManagerError(reply["error"])
+        return reply
+
+
+class RemoteSessionManager:
+    """
+    Drop-in for SessionManager in a worker when a sandbox manager runs on the host.
+    The sessions live in the manager, so a session created through one worker can be
+    used through any other.
+    """
+
+    def __init__(self, pool):
+        """
+        :param pool: RemoteSandboxPool of the manager, whose connection settings the
+            session calls share
+        """
+        self._pool = pool
+
+    def create(self, version=None, modules=None, tenant=None):
+        reply = self._pool.request(
+            {
+                "op": "session_create",
+                "version": version,
+                "modules": modules or [],
+                "tenant": tenant,
+            }
+        )
+        return reply["session"]
+
+    def evaluate(
+        self,
+        session_id,
+        code,
+        scope=None,
+        time_limit=SafeEval.max_timelimit,
+        max_output_bytes=None,
+    ):
+        args = {
+            "code": code,
+            "scope": scope,
+            "time_limit": time_limit,
+            "max_output_bytes": max_output_bytes,
+        }
+        reply = self._pool.request(
+            {"op": "session_eval", "session": session_id, "args": args}
+        )
+        return reply["reply"]
+
+    def close(self, session_id):
+        self._pool.request({"op": "session_close", "session": session_id})
+
+    def stats(self):
+        return self._pool.request({"op": "stats"}).get("sessions", {})
+
+    def start(self):
+        pass
+
+    def close_all(self):
+        pass
+
+
+if __name__ == "__main__":
+    main()
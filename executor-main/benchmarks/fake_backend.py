@@ -0,0 +1,82 @@
+"""
+Docker-free sandbox backend for the benchmarks, so they run on any Linux box without
+a Docker daemon.
+
+Two modes:
+- "inprocess": nothing is executed. After an optional simulated exec latency the
+  evaluator reports a null return value. Measures everything around the sandbox:
+  routing, limiter, pool, wrapping, result parsing.
+- "subprocess": the wrapped program runs with the host's python3/node on the host
+  backend's plain rlimit sandbox (never nsjail, so results compare across hosts).
+  Adds realistic interpreter startup and execution cost.
+"""
+
+import tempfile
+import time
+
+from app.PythonSafeEval.backends import HostBackend
+from app.PythonSafeEval.safe_eval import SafeEvalJavaScript, SafeEvalPython
+
+
+class FakeBackend(HostBackend):
+    """
+    Host backend that can skip execution altogether and add a fixed latency.
+    """
+
+    name = "fake"
+    nsjail = None
+    unsafe = True
+    mode = "inprocess"
+    exec_latency = 0.0
+
+    def prepare(self):
+        if self.mode == "subprocess":
+            super().prepare()
+
+    def execute(self, code, interpreter, extension, time_limit):
+        if self.exec_latency:
+            time.sleep(self.exec_latency)
+        if self.mode == "inprocess":
+            yield {"result": b'{"returnValue": null}'}
+            yield {"returncode": 0}
+            return
+        yield from super().execute(code, interpreter, extension, time_limit)
+
+
+class FakeEvaluatorMixin:
+    """
+    Keeps the session directories of the fake evaluators out of the source tree.
+    """
+
+    def __init__(self, version=None, modules=None, tmp_dir=None, backend=None):
+        super().__init__(
+            version=version,
+            modules=modules,
+            tmp_dir=tmp_dir or tempfile.gettempdir(),
+            backend=backend,
+        )
+
+
+def fake_evaluator_classes(mode="inprocess", exec_latency=0.0):
+    """
+    Return {language: class} to put in place of SandboxPool.evaluator_classes.
+    :param mode: "inprocess" or "subprocess", see the module docstring
+    :param exec_latency: seconds added to every execution
+    """
+    if mode not in ("inprocess", "subprocess"):
+        raise ValueError(f"Unknown fake backend mode: {mode}")
+    backend = type(
+        "FakeBackend", (FakeBackend,), {"mode": mode, "exec_latency": exec_latency}
+    )
+    return {
+        "python": type(
+            "FakeSafeEvalPython",
+            (FakeEvaluatorMixin, SafeEvalPython),
+            {"backend": backend},
+        ),
+        "javascript": type(
+            "FakeSafeEvalJavaScript",
+            (FakeEvaluatorMixin, SafeEvalJavaScript),
+            {"backend": backend},
+        ),
+    }
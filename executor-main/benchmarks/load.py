@@ -0,0 +1,287 @@
+"""
+Load test for the /evaluate endpoint.
+
+Drives /evaluate at a fixed concurrency with a configurable language mix and payload
+size, then reports throughput and latency percentiles. By default the app runs in
+this process on a fake sandbox backend (see fake_backend.py), so no Docker daemon is
+needed; --url points it at a running server instead.
+
+    python -m benchmarks.load --concurrency 32 --requests 2000 \
+        --mix python=0.7,javascript=0.3 --payload-bytes 4096 --output load.json
+    python -m benchmarks.load --compare load.json --max-regression 10
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import sys
+import time
+
+import httpx
+
+# Snippets per language; the scope carries the payload
+SNIPPETS = {
+    "python": "return len(payload) + x",
+    "javascript": "return payload.length + x;",
+}
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def parse_mix(mix):
+    """
+    Parse "python=0.7,javascript=0.3" into {language: weight}.
+    """
+    weights = {}
+    for part in mix.split(","):
+        language, _, weight = part.partition("=")
+        weights[language.strip()] = float(weight or 1)
+    unknown = set(weights) - set(SNIPPETS)
+    if unknown:
+        raise ValueError(f"Unknown languages in --mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def make_payloads(weights, payload_bytes, count, seed=0):
+    rng = random.Random(seed)
+    languages = list(weights)
+    chosen = rng.choices(languages, [weights[lang] for lang in languages], k=count)
+    return [
+        {
+            "language": language,
+            "code": SNIPPETS[language],
+            "scope": {"x": index, "payload": "x" * payload_bytes},
+            "cache": False,
+        }
+        for index, language in enumerate(chosen)
+    ]
+
+
+def summarize(latencies, failures, elapsed):
+    latencies = sorted(latencies)
+    completed = len(latencies) + failures
+    return {
+        "requests": completed,
+        "failures": failures,
+        "throughput_rps": completed / elapsed if elapsed else None,
+        "latency_ms": {
+            "p50": _ms(percentile(latencies, 0.50)),
+            "p95": _ms(percentile(latencies, 0.95)),
+            "p99": _ms(percentile(latencies, 0.99)),
+            "max": _ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+async def drive(client, payloads, concurrency):
+    """
+    Send payloads with at most `concurrency` requests in flight.
+    :return: {language: (latencies, failures)} and the elapsed seconds
+    """
+    queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+    results = {}
+
+    async def worker():
+        while not queue.empty():
+            payload = queue.get_nowait()
+            latencies, failures = results.setdefault(payload["language"], ([], [0]))
+            start = time.perf_counter()
+            try:
+                response = await client.post("/evaluate", json=payload)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                failures[0] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {lang: (lat, fail[0]) for lang, (lat, fail) in results.items()}, elapsed
+
+
+def in_process_client(backend, exec_latency, max_in_flight):
+    """
+    Build an httpx client that calls the app in this process on a fake backend.
+    """
+    from app import main
+    from app.limiter import ConcurrencyLimiter
+    from app.PythonSafeEval.pool import SandboxPool
+
+    from .fake_backend import fake_evaluator_classes
+
+    SandboxPool.evaluator_classes = fake_evaluator_classes(backend, exec_latency)
+    main.sandbox_pool = SandboxPool(max_size=max_in_flight)
+    main.evaluation_limiter = ConcurrencyLimiter(max_in_flight=max_in_flight)
+    main.result_cache = None
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=main.app),
+        base_url="http://benchmark",
+        timeout=None,
+    )
+
+
+def run_load(
+    concurrency=16,
+    requests=1000,
+    mix="python=1",
+    payload_bytes=64,
+    url=None,
+    backend="inprocess",
+    exec_latency=0.0,
+):
+    """
+    Run one load test and return the JSON-serializable report.
+    """
+    weights = parse_mix(mix)
+    payloads = make_payloads(weights, payload_bytes, requests)
+
+    async def main():
+        if url is None:
+            client = in_process_client(backend, exec_latency, concurrency)
+        else:
+            client = httpx.AsyncClient(base_url=url, timeout=None)
+        async with client:
+            return await drive(client, payloads, concurrency)
+
+    per_language, elapsed = asyncio.run(main())
+    latencies = [value for lat, _ in per_language.values() for value in lat]
+    failures = sum(fail for _, fail in per_language.values())
+    report = {
+        "config": {
+            "concurrency": concurrency,
+            "requests": requests,
+            "mix": weights,
+            "payload_bytes": payload_bytes,
+            "target": url or f"in-process ({backend})",
+            "exec_latency": exec_latency,
+            "python": platform.python_version(),
+        },
+        "elapsed_s": round(elapsed, 3),
+        "overall": summarize(latencies, failures, elapsed),
+        "languages": {
+            language: summarize(lat, fail, elapsed)
+            for language, (lat, fail) in per_language.items()
+        },
+    }
+    return report
+
+
+def compare(report, baseline, max_regression):
+    """
+    Print throughput and latency deltas against a baseline report.
+    :return: True if no metric regressed by more than max_regression percent
+    """
+    ok = True
+    current, previous = report["overall"], baseline["overall"]
+    rows = [("throughput_rps", current, previous, -1)] + [
+        (name, current["latency_ms"], previous["latency_ms"], 1)
+        for name in ("p50", "p95", "p99")
+    ]
+    for name, now, before, direction in rows:
+        if not before.get(name) or now.get(name) is None:
+            continue
+        change = (now[name] - before[name]) / before[name] * 100
+        regressed = change * direction > max_regression
+        ok = ok and not regressed
+        flag = "  REGRESSION" if regressed else ""
+        print(
+            f"{name:>15}: {before[name]:>10.2f} -> {now[name]:>10.2f} "
+            f"({change:+.1f}%){flag}"
+        )
+    return ok
+
+
+def print_report(report):
+    overall = report["overall"]
+    latency = overall["latency_ms"]
+    print(f"target:      {report['config']['target']}")
+    print(
+        f"requests:    {overall['requests']} ({overall['failures']} failed) "
+        f"in {report['elapsed_s']} s"
+    )
+    print(f"throughput:  {overall['throughput_rps']:.1f} req/s")
+    print(
+        f"latency ms:  p50 {latency['p50']}  p95 {latency['p95']}  "
+        f"p99 {latency['p99']}  max {latency['max']}"
+    )
+    for language, summary in report["languages"].items():
+        latency = summary["latency_ms"]
+        print(
+            f"  {language:<11} {summary['requests']:>7} req  "
+            f"p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument(
+        "--mix", default="python=1", help="e.g. python=0.7,javascript=0.3"
+    )
+    parser.add_argument("--payload-bytes", type=int, default=64)
+    parser.add_argument(
+        "--url", help="benchmark a running server instead of the app in this process"
+    )
+    parser.add_argument(
+        "--backend", choices=("inprocess", "subprocess"), default="inprocess"
+    )
+    parser.add_argument(
+        "--exec-latency",
+        type=float,
+        default=0.0,
+        help="seconds added to every fake execution",
+    )
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="JSON report to compare against")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=10.0,
+        help="percent, fails the run when exceeded",
+    )
+    args = parser.parse_args(argv)
+
+    report = run_load(
+        concurrency=args.concurrency,
+        requests=args.requests,
+        mix=args.mix,
+        payload_bytes=args.payload_bytes,
+        url=args.url,
+        backend=args.backend,
+        exec_latency=args.exec_latency,
+    )
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Micro-benchmarks of the per-request host work around the sandbox: return value
+extraction and code wrapping.
+
+    python -m benchmarks.micro --output micro.json
+"""
+
+import argparse
+import json
+import sys
+import timeit
+
+from app import helpers
+from app.PythonSafeEval.safe_eval import SafeEvalJavaScript, SafeEvalPython
+
+MARKER = "a" * 32
+
+
+def wrapper(cls):
+    evaluator = object.__new__(cls)
+    evaluator._random_string = MARKER
+    return evaluator
+
+
+def cases():
+    """
+    Yield (name, callable) pairs.
+    """
+    for stdout_bytes in (100, 100_000, 10_000_000):
+        stdout = "x" * (stdout_bytes - 1) + "\n" + MARKER + '{"returnValue": [1, 2]}\n'
+        yield (
+            f"extract_value_after_return/stdout={stdout_bytes}",
+            lambda stdout=stdout: helpers.extract_value_after_return(stdout, MARKER),
+        )
+    result = {"stdout": "", "result": json.dumps({"returnValue": list(range(1000))})}
+    yield (
+        "extract_return_value/result_channel",
+        lambda: helpers.extract_return_value(result, MARKER),
+    )
+
+    code = "total = 0\nfor value in values:\n    total += value\nreturn total"
+    js_code = (
+        "let total = 0;\nfor (const value of values) total += value;\nreturn total;"
+    )
+    for scope_size in (1, 100, 10_000):
+        scope = {"values": list(range(scope_size)), "x": 1}
+        python = wrapper(SafeEvalPython)
+        javascript = wrapper(SafeEvalJavaScript)
+        yield (
+            f"SafeEvalPython._wrap_code/scope={scope_size}",
+            lambda scope=scope: python._wrap_code(code, scope),
+        )
+        yield (
+            f"SafeEvalJavaScript._wrap_code/scope={scope_size}",
+            lambda scope=scope: javascript._wrap_code(js_code, scope),
+        )
+
+
+def measure(func, min_time=0.2):
+    """
+    Return seconds per call, using timeit's autorange and the best of 3 repeats.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--filter", default="", help="only run cases containing this")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    report = {}
+    for name, func in cases():
+        if args.filter not in name:
+            continue
+        seconds = measure(func)
+        report[name] = {"us_per_call": round(seconds * 1e6, 3)}
+        print(f"{name:<50} {seconds * 1e6:>12.2f} us")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
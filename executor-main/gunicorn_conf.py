@@ -3,6 +3,10 @@
 import json
 import multiprocessing
 import os
+import subprocess
+import sys
+import threading
+import time
 
 workers_per_core_str = os.getenv("WORKERS_PER_CORE", "1")
 web_concurrency_str = os.getenv("WEB_CONCURRENCY", None)
@@ -10,6 +14,13 @@ host = os.getenv("HOST", "0.0.0.0")
 port = os.getenv("PORT", "8000")
 bind_env = os.getenv("BIND", None)
 use_loglevel = os.getenv("LOG_LEVEL", "info")
+# Front ends of a sandbox cluster send their jobs to the cluster's nodes instead
+use_sandbox_manager = os.getenv("SANDBOX_MANAGER", "1") == "1" and not os.getenv(
+    "SANDBOX_CLUSTER_COORDINATOR"
+)
+sandbox_manager_socket = os.getenv(
+    "SANDBOX_MANAGER_SOCKET", "/tmp/safe-eval-sandbox-manager.sock"
+)
 if bind_env:
     use_bind = bind_env
 else:
@@ -40,5 +51,63 @@ log_data = {
     "workers_per_core": workers_per_core,
     "host": host,
     "port": port,
+    "sandbox_manager": sandbox_manager_socket if use_sandbox_manager else None,
 }
 print(json.dumps(log_data))
+
+# One sandbox manager per host owns the containers of every worker. Workers are
+# forked after this file is loaded, so they find the socket in their environment.
+if use_sandbox_manager:
+    os.environ["SANDBOX_MANAGER_SOCKET"] = sandbox_manager_socket
+
+# Items written through one worker have to be readable through the others
+os.environ.setdefault("ITEM_STORE_BACKEND", "sqlite")
+
+sandbox_manager = {"process": None, "stopping": False}
+
+
+def start_sandbox_manager():
+    process = subprocess.Popen(
+        [sys.executable, "-m", "sandbox_manager", sandbox_manager_socket]
+    )
+    sandbox_manager["process"] = process
+    return process
+
+
+def supervise_sandbox_manager(server, process):
+    # Restart the manager if it dies, workers fail their evaluations until then
+    while not sandbox_manager["stopping"]:
+        returncode = process.wait()
+        if sandbox_manager["stopping"]:
+            return
+        server.log.error(f"Sandbox manager exited with {returncode}, restarting")
+        time.sleep(1)
+        process = start_sandbox_manager()
+
+
+def on_starting(server):
+    if not use_sandbox_manager:
+        return
+    # A socket left behind by a previous run would look like a started manager
+    if os.path.exists(sandbox_manager_socket):
+        os.remove(sandbox_manager_socket)
+    process = start_sandbox_manager()
+    deadline = time.monotonic() + 30
+    while not os.path.exists(sandbox_manager_socket):
+        if process.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError("The sandbox manager failed to start.")
+        time.sleep(0.05)
+    threading.Thread(
+        target=supervise_sandbox_manager, args=(server, process), daemon=True
+    ).start()
+
+
+def on_exit(server):
+    sandbox_manager["stopping"] = True
+    process = sandbox_manager["process"]
+    if process is not None and process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
@@ -0,0 +1,11 @@
+#!/bin/sh
+
+set -e
+
+CURRENT_DIR=$(CDPATH= cd -- "$(dirname -- "$0")" && pwd)
+BASE_DIR="$(dirname "$CURRENT_DIR")"
+
+cd $BASE_DIR
+
+python -m benchmarks.micro --output "${BASE_DIR}/benchmarks/micro.json"
+python -m benchmarks.load --output "${BASE_DIR}/benchmarks/load.json" "$@"
@@ -1,9 +1,13 @@
 import os
+import subprocess
+from pathlib import Path
 
 import pytest
 from starlette.testclient import TestClient
 
 from app.main import app
+from app.PythonSafeEval import safe_eval
+from app.PythonSafeEval.executor_daemon import iter_output
 
 
 @pytest.fixture(scope="function")
@@ -13,3 +17,34 @@ def testclient():
         # Application 'startup' handlers are called on entering the block.
         yield client
     # Application 'shutdown' handlers are called on exiting the block.
+
+
+@pytest.fixture
+def local_evaluator():
+    """
+    Build evaluators without a container that run their programs on the host.
+    """
+
+    def build(cls, interpreter):
+        evaluator = object.__new__(cls)
+        evaluator._module_path = Path(safe_eval.__file__).parent
+        evaluator._random_string = "marker"
+        evaluator.interpreter = interpreter
+
+        def stream_code(code, interpreter, extension, time_limit):
+            process = subprocess.Popen(
+                [interpreter, "-"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            process.stdin.write(code.encode("utf-8"))
+            process.stdin.close()
+            for stream, data in iter_output(process):
+                yield {"stream": stream, "data": data}
+            yield {"returncode": process.wait()}
+
+        evaluator._stream_code = stream_code
+        return evaluator
+
+    return build
@@ -0,0 +1,86 @@
+import shutil
+
+import pytest
+
+from app import helpers
+from app.PythonSafeEval.backends import (
+    DockerBackend,
+    HostBackend,
+    backend_class,
+)
+from app.PythonSafeEval.safe_eval import SafeEvalJavaScript, SafeEvalPython
+
+
+class PlainHostBackend(HostBackend):
+    # Always the rlimit sandbox, even where nsjail is installed
+    nsjail = None
+    unsafe = True
+
+
+def test_backend_is_selected_per_deployment(monkeypatch):
+    monkeypatch.delenv("SAFE_EVAL_BACKEND", raising=False)
+    assert backend_class() is DockerBackend
+    monkeypatch.setenv("SAFE_EVAL_BACKEND", "host")
+    assert backend_class() is HostBackend
+    assert backend_class(PlainHostBackend) is PlainHostBackend
+    with pytest.raises(ValueError):
+        backend_class("podman")
+
+
+def test_host_backend_runs_python(tmp_path):
+    with SafeEvalPython(tmp_dir=tmp_path, backend=PlainHostBackend) as evaluator:
+        assert evaluator.is_healthy()
+        result, h = evaluator.eval("print('hi')\nreturn x * 2", scope={"x": 21})
+
+    assert result["returncode"] == 0, result["stderr"]
+    assert helpers.extract_return_value(result, h) == 42
+    assert result["stdout"] == "hi\n"
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_host_backend_runs_javascript(tmp_path):
+    with SafeEvalJavaScript(tmp_dir=tmp_path, backend=PlainHostBackend) as evaluator:
+        result, h = evaluator.eval("return [x, process.env.HOME];", scope={"x": 1})
+
+    assert result["returncode"] == 0, result["stderr"]
+    assert helpers.extract_return_value(result, h) == [1, None]
+
+
+def test_host_backend_kills_programs_over_the_time_limit(tmp_path):
+    with SafeEvalPython(tmp_dir=tmp_path, backend=PlainHostBackend) as evaluator:
+        result, _ = evaluator.eval("import time\ntime.sleep(30)", time_limit=1)
+
+    assert result["returncode"] != 0
+
+
+def test_host_backend_needs_nsjail_or_an_explicit_opt_in(tmp_path):
+    backend = type("UnconfinedHostBackend", (PlainHostBackend,), {"unsafe": False})
+    with pytest.raises(RuntimeError, match="SAFE_EVAL_HOST_UNSAFE"):
+        SafeEvalPython(tmp_dir=tmp_path, backend=backend)
+
+    # The opted-in plain mode runs programs in a user namespace of their own
+    with SafeEvalPython(tmp_dir=tmp_path, backend=PlainHostBackend) as evaluator:
+        result, h = evaluator.eval("import os\nreturn os.getuid()")
+    assert result["returncode"] == 0, result["stderr"]
+    assert helpers.extract_return_value(result, h) != 0
+
+
+def test_host_backend_rejects_modules(tmp_path, monkeypatch):
+    monkeypatch.setenv("SAFE_EVAL_ALLOWED_PYTHON_MODULES", "numpy")
+    with pytest.raises(RuntimeError):
+        SafeEvalPython(modules=["numpy"], tmp_dir=tmp_path, backend=PlainHostBackend)
+
+
+def test_close_tears_the_backend_down_once(tmp_path, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(
+        SafeEvalPython.reaper, "submit", lambda *args: submitted.append(args)
+    )
+    evaluator = SafeEvalPython(tmp_dir=tmp_path, backend=PlainHostBackend)
+    session_path = evaluator._session_path
+
+    evaluator.close()
+    evaluator.close()
+
+    assert submitted == [(None, session_path)]
+    assert not evaluator.is_healthy()
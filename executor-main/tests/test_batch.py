@@ -0,0 +1,58 @@
+import shutil
+import sys
+
+import pytest
+
+from app import helpers
+from app.PythonSafeEval.safe_eval import SafeEvalJavaScript, SafeEvalPython
+
+
+def test_python_batch_isolates_items(local_evaluator):
+    evaluator = local_evaluator(SafeEvalPython, sys.executable)
+    items = [
+        ("print('hi')\nreturn x * x", {"x": 2}),
+        ("return x * x", {"x": 3}),
+        ("return 1 / x", {"x": 0}),
+        ("while True:\n    pass", {}),
+        ("returnn 1", {}),
+    ]
+    result, marker = evaluator.eval_batch(items, item_time_limit=0.2)
+    results = helpers.extract_batch_results(result, marker, len(items))
+
+    assert results[0] == {"returnValue": 4, "stdout": "hi\n"}
+    assert results[1]["returnValue"] == 9
+    assert results[2]["error"].startswith("ZeroDivisionError")
+    assert results[3]["error"] == "Time limit exceeded"
+    assert results[4]["error"].startswith("SyntaxError")
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_javascript_batch_isolates_items(local_evaluator):
+    evaluator = local_evaluator(SafeEvalJavaScript, shutil.which("node"))
+    items = [
+        ("console.log('hi'); return x + 1;", {"x": 2}),
+        ("throw new Error('no')", {}),
+    ]
+    result, marker = evaluator.eval_batch(items, item_time_limit=1)
+    results = helpers.extract_batch_results(result, marker, len(items))
+
+    assert results == [
+        {"returnValue": 3, "stdout": "hi\n"},
+        {"error": "no", "stdout": ""},
+    ]
+
+
+def test_extract_batch_results_marks_missing_items():
+    s = 'noise h{"index": 1, "returnValue": {"a": "}"}, "stdout": ""}\n'
+    assert helpers.extract_batch_results({"stdout": s}, "h", 2) == [
+        None,
+        {"returnValue": {"a": "}"}, "stdout": ""},
+    ]
+
+
+def test_extract_batch_results_reads_result_channel():
+    result = {"result": b'{"index": 0, "error": "x", "stdout": ""}\n', "stdout": ""}
+    assert helpers.extract_batch_results(result, "h", 2) == [
+        {"error": "x", "stdout": ""},
+        None,
+    ]
@@ -0,0 +1,37 @@
+import shutil
+
+import pytest
+
+from app import main
+from app.PythonSafeEval.pool import SandboxPool
+from benchmarks import load
+from benchmarks.fake_backend import fake_evaluator_classes
+
+
+@pytest.fixture
+def restore_app(monkeypatch):
+    # The in-process load test swaps the app's pool, limiter and evaluator classes
+    for name in ("sandbox_pool", "evaluation_limiter", "result_cache"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    monkeypatch.setattr(SandboxPool, "evaluator_classes", SandboxPool.evaluator_classes)
+
+
+def test_load_reports_percentiles_on_the_fake_backend(restore_app):
+    report = load.run_load(concurrency=4, requests=20, mix="python=1,javascript=1")
+
+    assert report["overall"]["requests"] == 20
+    assert report["overall"]["failures"] == 0
+    assert set(report["overall"]["latency_ms"]) == {"p50", "p95", "p99", "max"}
+    assert load.percentile([1, 2, 3, 4], 0.5) == 2
+    assert load.percentile([1, 2, 3, 4], 0.99) == 4
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_javascript_scope_may_use_the_wrapper_names():
+    evaluator = fake_evaluator_classes("subprocess")["javascript"]()
+    result, h = evaluator.eval(
+        "return payload + result;", scope={"payload": 1, "result": 2}
+    )
+
+    assert result["returncode"] == 0, result["stderr"]
+    assert main.helpers.extract_return_value(result, h) == 3
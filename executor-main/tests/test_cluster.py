@@ -0,0 +1,175 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from app import cluster as cluster_module
+from app.cluster import ClusterSandboxPool, Coordinator, HashRing, image_key
+from app.sandbox_manager import ManagerUnavailable, RemoteSandboxPool, SandboxManager
+
+TOKEN = "cluster-secret"
+
+
+def test_hash_ring_only_moves_the_keys_of_a_removed_node():
+    keys = [image_key("python", "3.8", [f"module{i}"]) for i in range(200)]
+    ring = HashRing({"a": 4, "b": 4, "c": 4})
+    owners = {key: ring.preference(key)[0] for key in keys}
+    assert set(owners.values()) == {"a", "b", "c"}
+    assert sorted(ring.preference(keys[0])) == ["a", "b", "c"]
+
+    smaller = HashRing({"a": 4, "c": 4})
+    for key in keys:
+        if owners[key] != "b":
+            assert smaller.preference(key)[0] == owners[key]
+        else:
+            # The keys of the removed node go to its successor on the ring
+            assert smaller.preference(key)[0] == ring.preference(key)[1]
+
+
+def test_hash_ring_weights_nodes_by_capacity():
+    ring = HashRing({"big": 12, "small": 1})
+    keys = [image_key("python", "3.8", [f"module{i}"]) for i in range(300)]
+    owners = [ring.preference(key)[0] for key in keys]
+    assert owners.count("big") > 5 * owners.count("small")
+
+
+def test_image_key_ignores_module_order():
+    assert image_key("python", None, ["b", "a"]) == image_key(
+        "python", "3.8", ["a", "b"]
+    )
+
+
+def test_cluster_servers_refuse_to_listen_without_a_token():
+    with pytest.raises(ValueError, match="token"):
+        Coordinator(("127.0.0.1", 0))
+    with pytest.raises(ValueError, match="token"):
+        SandboxManager(("127.0.0.1", 0), pool=None)
+
+    env = {k: v for k, v in os.environ.items() if k != "SANDBOX_CLUSTER_TOKEN"}
+    process = subprocess.run(
+        [sys.executable, "-m", "app.cluster", "node", "127.0.0.1:0"]
+        + ["--coordinator", "127.0.0.1:1"],
+        cwd=Path(__file__).parent.parent,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert process.returncode == 2
+    assert "SANDBOX_CLUSTER_TOKEN" in process.stderr
+
+
+def test_membership_is_only_cached_after_a_refresh(monkeypatch):
+    calls = []
+
+    def coordinator_request(address, request, token=None, timeout=5):
+        calls.append(request)
+        if len(calls) == 1:
+            raise ManagerUnavailable("The coordinator is down.")
+        member = {"node": "a", "address": "a:1", "capacity": 1, "in_flight": 0}
+        return {"members": [dict(member, warm=[])]}
+
+    monkeypatch.setattr(cluster_module, "coordinator_request", coordinator_request)
+    pool = ClusterSandboxPool("coordinator:7000", refresh_interval=60)
+    with pytest.raises(ManagerUnavailable):
+        pool.members()
+    # The failed attempt is not cached as a refresh
+    assert list(pool.members()) == ["a"]
+    assert [member["node"] for member in pool.route("python")] == ["a"]
+    assert len(calls) == 2
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    """
+    A coordinator in this process and sandbox nodes as separate processes on
+    localhost, running jobs on the host backend.
+    """
+    coordinator = Coordinator(("127.0.0.1", 0), heartbeat_timeout=1, token=TOKEN)
+    threading.Thread(target=coordinator.serve_forever, daemon=True).start()
+    env = dict(
+        os.environ,
+        SAFE_EVAL_BACKEND="host",
+        SAFE_EVAL_HOST_UNSAFE="1",
+        SANDBOX_MANAGER_MAX_IN_FLIGHT="2",
+        SANDBOX_POOL_TMP_DIR=str(tmp_path),
+        SANDBOX_CLUSTER_TOKEN=TOKEN,
+    )
+    nodes = {}
+
+    def start_node(name):
+        nodes[name] = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "app.cluster",
+                "node",
+                "127.0.0.1:0",
+                "--coordinator",
+                coordinator.address,
+                "--node",
+                name,
+                "--heartbeat-interval",
+                "0.2",
+            ],
+            cwd=Path(__file__).parent.parent,
+            env=env,
+        )
+
+    def wait_for(condition, timeout=20):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "Cluster did not converge in time."
+            time.sleep(0.05)
+
+    yield coordinator, nodes, start_node, wait_for
+    for process in nodes.values():
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=10)
+    coordinator.shutdown()
+    coordinator.server_close()
+
+
+def test_cluster_routes_by_image_and_fails_over(cluster):
+    coordinator, nodes, start_node, wait_for = cluster
+    for name in ("node-a", "node-b", "node-c"):
+        start_node(name)
+    wait_for(lambda: len(coordinator.members()) == 3)
+
+    pool = ClusterSandboxPool(coordinator.address, token=TOKEN, refresh_interval=0.1)
+    owner = pool.route("python")[0]
+    for _ in range(3):
+        with pool.sandbox("python") as evaluator:
+            result, _ = evaluator.eval(code="return x * 2", scope={"x": 21})
+        assert result["result"] == b'{"returnValue": 42}'
+
+    # Every job of the key ran on the owner, reusing one warm sandbox
+    owner_stats = RemoteSandboxPool(owner["address"], token=TOKEN).stats()
+    assert [stats["size"] for stats in owner_stats.values()] == [1]
+    for member in pool.route("python")[1:]:
+        assert RemoteSandboxPool(member["address"], token=TOKEN).stats() == {}
+    wait_for(lambda: pool.route("python")[0]["warm"])
+
+    # The owner dies: jobs fail over at once, the coordinator drops it shortly after
+    nodes[owner["node"]].kill()
+    nodes[owner["node"]].wait()
+    with pool.sandbox("python") as evaluator:
+        result, _ = evaluator.eval(code="return 1", scope={})
+    assert result["returncode"] == 0
+    wait_for(lambda: len(coordinator.members()) == 2)
+    assert pool.route("python")[0]["node"] != owner["node"]
+
+    # A node that shuts down deregisters right away
+    survivor = coordinator.members()[0]["node"]
+    nodes[survivor].send_signal(signal.SIGTERM)
+    nodes[survivor].wait(timeout=10)
+    assert survivor not in {member["node"] for member in coordinator.members()}
+
+    with pool.sandbox("python") as evaluator:
+        frames = list(evaluator.eval_stream("print('hi')\nreturn 3"))
+    assert frames[-1] == {"returncode": 0, "returnValue": 3}
@@ -0,0 +1,204 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from app.PythonSafeEval.dependencies import (
+    DependencyCache,
+    Npm,
+    Pip,
+    module_dockerfile,
+    validate_modules,
+)
+from app.PythonSafeEval.image_cache import ImageCache
+
+
+@pytest.fixture
+def allow_modules(monkeypatch):
+    monkeypatch.setenv(
+        "SAFE_EVAL_ALLOWED_PYTHON_MODULES", "requests, flask, numpy, attrs"
+    )
+    monkeypatch.setenv("SAFE_EVAL_ALLOWED_JAVASCRIPT_MODULES", "lodash,@types/node")
+
+
+def test_validate_modules_sorts_and_deduplicates(allow_modules):
+    assert validate_modules("python", ["requests", "Flask", "numpy==1.24.*"]) == [
+        "Flask",
+        "numpy==1.24.*",
+        "requests",
+    ]
+    assert validate_modules("javascript", ["lodash", "@types/node@^18", "lodash"]) == [
+        "@types/node@^18",
+        "lodash",
+    ]
+    assert validate_modules("python", None) == []
+
+
+@pytest.mark.parametrize(
+    "language, spec",
+    [
+        ("python", "--index-url=http://example.com"),
+        ("python", "git+https://example.com/x.git"),
+        ("python", "../local"),
+        ("python", "numpy; rm -rf /"),
+        ("javascript", "file:../x"),
+        ("javascript", "lodash@git+ssh://example.com/x"),
+        ("javascript", "$(id)"),
+        ("python", {}),
+        ("python", ["numpy"]),
+    ],
+)
+def test_validate_modules_rejects_anything_but_registry_packages(language, spec):
+    with pytest.raises(ValueError):
+        validate_modules(language, [spec])
+
+
+def test_validate_modules_applies_the_allowlist(monkeypatch):
+    monkeypatch.delenv("SAFE_EVAL_ALLOWED_PYTHON_MODULES", raising=False)
+    with pytest.raises(ValueError, match="not allowed"):
+        validate_modules("python", ["numpy"])
+
+    monkeypatch.setenv("SAFE_EVAL_ALLOWED_PYTHON_MODULES", "numpy, scikit-learn")
+    assert validate_modules("python", ["scikit_learn>=1.0", "numpy"])
+    with pytest.raises(ValueError, match="not allowed"):
+        validate_modules("python", ["requests"])
+
+
+def test_each_module_is_its_own_offline_layer(allow_modules):
+    dockerfile = module_dockerfile("python", "lang:1", ["requests", "numpy"])
+    lines = dockerfile.splitlines()
+    assert lines[0] == "FROM lang:1"
+    assert len(lines) == 3
+    assert lines[1].endswith("pip3 install --no-index --find-links=/wheelhouse numpy")
+    assert lines[2].endswith("requests")
+    assert all("--mount=type=bind,from=wheelhouse" in line for line in lines[1:])
+
+    # Adding a module keeps the layers before it, so they stay in the build cache
+    more = module_dockerfile("python", "lang:1", ["requests", "numpy", "attrs"])
+    assert more.splitlines()[2:] == lines[1:]
+
+    npm = module_dockerfile("javascript", "lang:2", ["lodash"]).splitlines()
+    assert npm[1].endswith(
+        "npm install -g --offline --ignore-scripts --cache /npm-cache lodash"
+    )
+
+
+@pytest.fixture
+def docker_runs(monkeypatch):
+    runs = []
+
+    def fake_run(cmd, **kwargs):
+        runs.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, stdout=b"0", stderr=b"")
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    return runs
+
+
+def test_dependency_cache_fetches_each_module_once_per_version(tmp_path, docker_runs):
+    cache = DependencyCache(tmp_path)
+    assert cache.fetch("python", "3.8", ["numpy", "requests"], "lang:1") == [
+        "numpy",
+        "requests",
+    ]
+    assert cache.fetch("python", "3.8", ["numpy", "attrs"], "lang:1") == ["attrs"]
+    assert cache.fetch("python", "3.9", ["numpy"], "lang:2") == ["numpy"]
+    assert len(docker_runs) == 4
+    # Downloads go to a directory of their own, over the default network, as this
+    # user, and take wheels only
+    mount = docker_runs[0][docker_runs[0].index("-v") + 1]
+    assert mount.endswith(":/wheelhouse")
+    assert not mount.startswith(f"{tmp_path / 'wheelhouse'}:")
+    assert not any(arg.startswith("--network") for arg in docker_runs[0])
+    assert "--cap-drop=ALL" in docker_runs[0]
+    assert "--only-binary=:all:" in docker_runs[0][-1]
+
+    assert (
+        DependencyCache(tmp_path, offline=True).fetch(
+            "python", "3.10", ["numpy"], "lang:3"
+        )
+        == []
+    )
+    assert len(docker_runs) == 4
+
+
+def test_downloads_are_merged_into_the_cache(tmp_path):
+    downloaded, wheelhouse = tmp_path / "download", tmp_path / "wheelhouse"
+    downloaded.mkdir()
+    wheelhouse.mkdir()
+    (downloaded / "a-1.0-py3-none-any.whl").write_bytes(b"new")
+    (downloaded / "b-1.0.tar.gz").write_bytes(b"sdist")
+    (downloaded / "c-1.0-py3-none-any.whl").symlink_to("/etc/passwd")
+    (wheelhouse / "a-1.0-py3-none-any.whl").write_bytes(b"cached")
+    (downloaded / "d-1.0-py3-none-any.whl").write_bytes(b"d")
+    Pip().merge(downloaded, wheelhouse)
+    assert sorted(path.name for path in wheelhouse.iterdir()) == [
+        "a-1.0-py3-none-any.whl",
+        "d-1.0-py3-none-any.whl",
+    ]
+    assert (wheelhouse / "a-1.0-py3-none-any.whl").read_bytes() == b"cached"
+
+    downloaded, npm_cache = tmp_path / "npm-download", tmp_path / "npm-cache"
+    for directory in (downloaded, npm_cache):
+        (directory / "_cacache" / "index-v5" / "ab").mkdir(parents=True)
+        (directory / "_cacache" / "index-v5" / "ab" / "bucket").write_text("old\n")
+    (downloaded / "_cacache" / "index-v5" / "ab" / "bucket").write_text("new\n")
+    (downloaded / "_cacache" / "content-v2" / "sha512").mkdir(parents=True)
+    (downloaded / "_cacache" / "content-v2" / "sha512" / "cd").write_text("x")
+    (downloaded / "_cacache" / "_logs").mkdir()
+    (downloaded / "_cacache" / "_logs" / "debug.log").write_text("log")
+    Npm().merge(downloaded, npm_cache)
+    cache = npm_cache / "_cacache"
+    assert (cache / "index-v5" / "ab" / "bucket").read_text() == "old\nnew\n"
+    assert (cache / "content-v2" / "sha512" / "cd").read_text() == "x"
+    assert not (cache / "_logs").exists()
+
+
+def test_module_layers_build_on_the_language_image(
+    tmp_path, docker_runs, monkeypatch, allow_modules
+):
+    from app.PythonSafeEval import safe_eval
+    from app.PythonSafeEval.backends import DockerBackend
+    from app.PythonSafeEval.safe_eval import SafeEvalPython
+
+    monkeypatch.setattr(ImageCache, "exists", lambda self, tag: False)
+    monkeypatch.setattr(DockerBackend, "image_cache", ImageCache(tmp_path / "images"))
+    monkeypatch.setattr(
+        DockerBackend, "dependency_cache", DependencyCache(tmp_path / "deps")
+    )
+    evaluator = object.__new__(SafeEvalPython)
+    evaluator._module_path = Path(safe_eval.__file__).parent
+    evaluator._session_id = "safe_eval_python_test"
+    evaluator.python_version = "3.8"
+    evaluator.modules = ["numpy"]
+    backend = DockerBackend(evaluator)
+    backend._image_tag = "lang:1"
+    backend._build_module_layers()
+
+    fetch, build = [cmd for cmd in docker_runs if cmd[1] in ("run", "build")]
+    assert fetch[:2] == ["docker", "run"] and "lang:1" in fetch
+    assert f"wheelhouse={tmp_path / 'deps' / 'wheelhouse'}" in build
+    assert "--network=none" in build
+    assert backend._image_tag != "lang:1"
+
+
+def test_javascript_modules_bypass_the_node_pool(tmp_path, docker_runs, monkeypatch):
+    from app.PythonSafeEval import safe_eval
+    from app.PythonSafeEval.backends import DockerBackend
+    from app.PythonSafeEval.safe_eval import SafeEvalJavaScript
+
+    monkeypatch.setattr(SafeEvalJavaScript, "node_pool", True)
+    evaluator = object.__new__(SafeEvalJavaScript)
+    evaluator._module_path = Path(safe_eval.__file__).parent
+    evaluator._session_id = "safe_eval_javascript_test"
+    evaluator._session_path = tmp_path
+    backend = DockerBackend(evaluator)
+    backend.container = "container"
+    monkeypatch.setattr(backend, "executor_startup_timeout", 0)
+    for modules in ([], ["lodash"]):
+        evaluator.modules = modules
+        backend._start_executor()
+
+    pooled, unpooled = docker_runs
+    assert "--node-pool" in pooled
+    assert "--node-pool" not in unpooled
@@ -0,0 +1,248 @@
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from app import helpers
+from app.PythonSafeEval import executor_daemon, safe_eval
+from app.PythonSafeEval.executor_daemon import (
+    ZYGOTE_USER,
+    ExecutorClient,
+    ExecutorError,
+    make_server,
+)
+from app.PythonSafeEval.safe_eval import SafeEvalJavaScript, SafeEvalPython
+from app.PythonSafeEval.scope_transfer import ScopeTransfer
+
+
+@pytest.fixture
+def executor(tmp_path, monkeypatch):
+    # Run jobs under coreutils `timeout` instead of nsjail
+    monkeypatch.setattr(
+        executor_daemon,
+        "build_command",
+        lambda time_limit, result_fd, argv: ["timeout", str(time_limit)] + argv,
+    )
+    server = make_server(str(tmp_path / ".executor.sock"), [sys.executable])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = ExecutorClient(tmp_path / ".executor.sock")
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_executor_runs_jobs_on_one_connection(executor, tmp_path):
+    code = "import sys\nprint('out')\nprint('err', file=sys.stderr)\nsys.exit(3)"
+    for _ in range(2):
+        result = executor.run(code, sys.executable, ".py", 5)
+        assert result == {"stdout": "out\n", "stderr": "err\n", "returncode": 3}
+    # Programs arrive over stdin and leave nothing behind in the volume
+    assert [p.name for p in tmp_path.iterdir()] == [".executor.sock"]
+
+
+def test_executor_refuses_other_interpreters_and_caps_time_limits(
+    executor, tmp_path, monkeypatch
+):
+    assert (tmp_path / ".executor.sock").stat().st_mode & 0o777 == 0o600
+    with pytest.raises(ExecutorError, match="Interpreter not allowed"):
+        executor.run("", "/bin/sh", ".sh", 5)
+
+    time_limits = []
+    monkeypatch.setattr(
+        executor_daemon,
+        "build_command",
+        lambda time_limit, result_fd, argv: time_limits.append(time_limit) or argv,
+    )
+    executor.run("", sys.executable, ".py", 10**6)
+    assert time_limits == [executor_daemon.MAX_TIME_LIMIT]
+
+
+def test_executor_streams_output_frames(executor):
+    frames = list(executor.stream("print('a' * 10)", sys.executable, ".py", 5))
+    assert all(frame["stream"] == "stdout" for frame in frames[:-1])
+    assert "".join(frame["data"] for frame in frames[:-1]) == "a" * 10 + "\n"
+    assert frames[-1] == {"returncode": 0}
+
+
+def test_executor_returns_value_over_result_channel(executor):
+    evaluator = object.__new__(SafeEvalPython)
+    evaluator._random_string = "marker"
+    code = evaluator._wrap_code("print('{')\nreturn ['x' * 100000, x]", {"x": 1})
+    result = executor.run(code, sys.executable, ".py", 5)
+
+    assert result["stdout"] == "{\n"
+    assert helpers.extract_return_value(result, "marker") == ["x" * 100000, 1]
+
+
+@pytest.fixture
+def zygote_executor(tmp_path):
+    server = make_server(
+        str(tmp_path / ".executor.sock"),
+        [sys.executable],
+        zygote_interpreter=sys.executable,
+        preload=["json", "decimal"],
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not (tmp_path / ".zygote.sock").exists() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    client = ExecutorClient(tmp_path / ".executor.sock")
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_zygote_forks_jobs_with_preloaded_modules(zygote_executor):
+    evaluator = object.__new__(SafeEvalPython)
+    evaluator._random_string = "marker"
+    code = evaluator._wrap_code(
+        "import sys\nprint('hi')\nreturn ['decimal' in sys.modules, x]", {"x": 1}
+    )
+    for _ in range(2):
+        result = zygote_executor.run(code, sys.executable, ".py", 5)
+        assert result["returncode"] == 0, result["stderr"]
+        assert result["stdout"] == "hi\n"
+        assert helpers.extract_return_value(result, "marker") == [True, 1]
+
+
+def test_zygote_jobs_are_confined(zygote_executor):
+    code = "import os, sys\nprint(os.getuid(), dict(os.environ))\nsys.exit(4)"
+    result = zygote_executor.run(code, sys.executable, ".py", 5)
+
+    assert result["returncode"] == 4
+    uid = ZYGOTE_USER if os.geteuid() == 0 else os.getuid()
+    assert result["stdout"] == f"{uid} {{}}\n"
+
+    result = zygote_executor.run("while True: pass", sys.executable, ".py", 1)
+    assert result["returncode"] != 0
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="the zygote needs root")
+def test_zygote_jobs_take_what_they_leave_running_down(zygote_executor):
+    # A detached grandchild holding stdout would keep the job's output open
+    code = (
+        "import os, subprocess\n"
+        "subprocess.Popen(['/bin/sleep', '30'], start_new_session=True)\n"
+        "print(len(os.listdir('/proc')))\n"
+        "try:\n"
+        "    open('/tmp/zygote-job', 'w')\n"
+        "except OSError as e:\n"
+        "    print(e.strerror)\n"
+    )
+    started = time.monotonic()
+    result = zygote_executor.run(code, sys.executable, ".py", 5)
+
+    assert time.monotonic() - started < 5
+    assert result["returncode"] == 0, result["stderr"]
+    assert result["stdout"] == "0\nRead-only file system\n"
+
+
+@pytest.fixture
+def node_pool_executor(tmp_path, monkeypatch):
+    node = shutil.which("node")
+    if node is None:
+        pytest.skip("node is not installed")
+    # Run the pool without nsjail
+    monkeypatch.setattr(executor_daemon, "build_service_command", lambda argv: argv)
+    shutil.copy(
+        Path(safe_eval.__file__).parent / "node_pool.js", tmp_path / ".node_pool.js"
+    )
+    server = make_server(str(tmp_path / ".executor.sock"), [node], node_pool=node)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = ExecutorClient(tmp_path / ".executor.sock")
+    yield client, node
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_node_pool_runs_wrapped_programs(node_pool_executor):
+    client, node = node_pool_executor
+    evaluator = object.__new__(SafeEvalJavaScript)
+    evaluator._random_string = "marker"
+    for x in (1, 2):
+        # The second run compiles the same body from the code cache
+        code = evaluator._wrap_code(
+            "console.log('hi', x); console.error('oops');"
+            "return [x, typeof setTimeout];",
+            {"x": x},
+        )
+        result = client.run(code, node, ".js", 5)
+        assert result["returncode"] == 0, result["stderr"]
+        assert (result["stdout"], result["stderr"]) == (f"hi {x}\n", "oops\n")
+        assert helpers.extract_return_value(result, "marker") == [x, "undefined"]
+
+
+def test_node_pool_reads_side_files_and_typed_arrays(node_pool_executor, tmp_path):
+    client, node = node_pool_executor
+    evaluator = object.__new__(SafeEvalJavaScript)
+    evaluator._random_string = "marker"
+    evaluator._module_path = Path(safe_eval.__file__).parent
+    scope = {"values": list(range(100)), "matrix": [[1, 2, 3], [4, 5, 6]]}
+    with ScopeTransfer(
+        scope, {"matrix": "int16"}, host_dir=tmp_path, sandbox_dir=str(tmp_path)
+    ) as transfer:
+        code = evaluator._wrap_code(
+            "return [values.length, matrix.constructor.name, matrix[5], matrix.shape];",
+            scope,
+            transfer,
+        )
+        result = client.run(code, node, ".js", 5)
+
+    assert result["returncode"] == 0, result["stderr"]
+    assert helpers.extract_return_value(result, "marker") == [
+        100,
+        "Int16Array",
+        6,
+        [2, 3],
+    ]
+
+
+def test_node_pool_keeps_exit_codes_and_time_limits(node_pool_executor):
+    client, node = node_pool_executor
+
+    result = client.run("console.log(1);\nprocess.exit(3);", node, ".js", 5)
+    assert (result["stdout"], result["returncode"]) == ("1\n", 3)
+
+    result = client.run("throw new Error('boom');", node, ".js", 5)
+    assert result["returncode"] == 1
+    assert "Error: boom" in result["stderr"]
+
+    result = client.run("while (true) {}", node, ".js", 1)
+    assert result["returncode"] == 137
+
+    # The pool replaced the killed worker
+    assert client.run("console.log(2);", node, ".js", 5)["stdout"] == "2\n"
+
+
+def test_node_pool_jobs_share_nothing(node_pool_executor):
+    client, node = node_pool_executor
+
+    code = "Buffer.leak = (Buffer.leak || 0) + 1; console.log(Buffer.leak);"
+    for _ in range(2):
+        assert client.run(code, node, ".js", 5)["stdout"] == "1\n"
+
+    # Promise callbacks finish with the job that queued them
+    code = "Promise.resolve().then(() => console.log('late'));"
+    assert client.run(code, node, ".js", 5)["stdout"] == "late\n"
+    assert client.run("console.log(1);", node, ".js", 5)["stdout"] == "1\n"
+
+    # Constructors reachable from the context lead to the context's realm only
+    code = (
+        "const host = this.constructor.constructor('return process')();\n"
+        "console.log(typeof host.pid, typeof host.binding);\n"
+        "const f = console.log.constructor('return this')();\n"
+        "console.log(typeof f.require);"
+    )
+    result = client.run(code, node, ".js", 5)
+    assert result["returncode"] == 0, result["stderr"]
+    assert result["stdout"] == "undefined undefined\nfunction\n"
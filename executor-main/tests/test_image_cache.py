@@ -0,0 +1,60 @@
+import subprocess
+from pathlib import Path
+
+from app.PythonSafeEval.image_cache import ImageCache
+
+
+def test_tag_is_content_addressed(tmp_path):
+    cache = ImageCache(tmp_path)
+    tag = cache.tag_for("FROM ubuntu:18.04\n", "abc")
+    assert tag == cache.tag_for("FROM ubuntu:18.04\n", "abc")
+    assert tag != cache.tag_for("FROM ubuntu:18.04\n", "abd")
+    assert tag != cache.tag_for("FROM ubuntu:20.04\n", "abc")
+    assert tag.startswith("safe_eval_cache:")
+
+
+def test_collect_garbage_removes_least_recently_used(tmp_path, monkeypatch):
+    removed = []
+
+    def fake_run(cmd, **kwargs):
+        removed.append(cmd[-1])
+        return subprocess.CompletedProcess(cmd, 0, stderr=b"")
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    cache = ImageCache(tmp_path, disk_budget=250)
+    for tag in ("a:1", "b:2", "c:3"):
+        cache.touch(tag, size=100)
+    cache.touch("a:1")
+
+    assert cache.collect_garbage() == ["b:2"]
+    assert removed == ["b:2"]
+    assert cache.collect_garbage() == []
+
+
+def test_language_images_build_from_the_nsjail_base(tmp_path, monkeypatch):
+    from app.PythonSafeEval import safe_eval
+    from app.PythonSafeEval.backends import DockerBackend
+    from app.PythonSafeEval.safe_eval import SafeEvalPython
+
+    builds = []
+
+    def fake_run(cmd, **kwargs):
+        builds.append((cmd, kwargs.get("input")))
+        return subprocess.CompletedProcess(cmd, 0, stdout=b"0", stderr=b"")
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    monkeypatch.setattr(ImageCache, "exists", lambda self, tag: False)
+    monkeypatch.setattr(DockerBackend, "image_cache", ImageCache(tmp_path))
+    evaluator = object.__new__(SafeEvalPython)
+    evaluator._module_path = Path(safe_eval.__file__).parent
+    evaluator._session_path = tmp_path
+    evaluator._session_id = "safe_eval_python_test"
+    evaluator.python_version = "3.8"
+    evaluator.modules = []
+    evaluator._create_dockerfile(DockerBackend(evaluator).base_image())
+
+    base_dockerfile = builds[0][1].decode("utf-8")
+    assert "COPY --from=build /nsjail/nsjail /bin/nsjail" in base_dockerfile
+    dockerfile = (tmp_path / "Dockerfile").read_text()
+    assert dockerfile.startswith(f"FROM {builds[0][0][-2]}\n")
+    assert "gcc" not in dockerfile and ".nsjail" not in dockerfile
@@ -0,0 +1,98 @@
+import pytest
+from starlette.testclient import TestClient
+
+from app.item_store import MemoryItemStore, SQLiteItemStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryItemStore(capacity=4, shards=1)
+    return SQLiteItemStore(str(tmp_path / "items.db"), capacity=4)
+
+
+def test_store_evicts_least_recently_used(store):
+    store.put_many({0: {"name": "a"}, 2: {"name": "b"}})
+    store.get(0)
+    store.put_many({4: {"name": "c"}, 6: {"name": "d"}, 8: {"name": "e"}})
+    assert len(store) == 4
+    assert store.get(2) is None
+    assert store.get_many([0, 8, 10]) == {0: {"name": "a"}, 8: {"name": "e"}}
+
+
+def test_memory_store_bounds_every_shard():
+    store = MemoryItemStore(capacity=4, shards=2)
+    store.put_many({item_id: {"n": item_id} for item_id in range(8)})
+    assert len(store) == 4
+    assert sorted(store.get_many(range(8))) == [4, 5, 6, 7]
+
+
+def test_store_pages_in_id_order(store):
+    store.put_many({3: {"n": 3}, 1: {"n": 1}, 2: {"n": 2}})
+    assert store.page(limit=2) == [(1, {"n": 1}), (2, {"n": 2})]
+    assert store.page(after=2, limit=2) == [(3, {"n": 3})]
+    assert store.page(after=3) == []
+
+
+def test_memory_store_pages_across_shards():
+    store = MemoryItemStore(capacity=40, shards=4)
+    store.put_many({item_id: {"n": item_id} for item_id in range(30, 0, -1)})
+    page = store.page(after=10, limit=5)
+    assert [item_id for item_id, _ in page] == list(range(11, 16))
+    assert [item_id for item_id, _ in store.page(after=28)] == [29, 30]
+
+
+def test_sqlite_store_counts_replaced_items_once(tmp_path):
+    path = str(tmp_path / "items.db")
+    store = SQLiteItemStore(path, capacity=4)
+    for _ in range(3):
+        store.put_many({1: {"n": 1}, 2: {"n": 2}})
+    assert len(store) == 2
+    # A second connection to the same file shares the count
+    SQLiteItemStore(path, capacity=4).put_many({3: {"n": 3}, 4: {"n": 4}, 5: {}})
+    assert len(store) == 4
+
+
+def test_sqlite_store_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "items.db")
+    SQLiteItemStore(path).put(1, {"name": "a"})
+    assert SQLiteItemStore(path).get(1) == {"name": "a"}
+
+
+def test_bulk_item_endpoints(testclient: TestClient, monkeypatch):
+    from app import main
+
+    monkeypatch.setattr(main, "items_store", MemoryItemStore())
+    items = [
+        {"id": i, "name": f"item {i}", "price": "1.00", "is_offer": False}
+        for i in range(5)
+    ]
+    r = testclient.put("/items", json={"items": items})
+    assert r.status_code == 200, r.text
+    assert r.json()["items"][0]["data"]["item_name"] == "item 0"
+
+    r = testclient.get("/items", params={"ids": "3,1,9"})
+    assert [item["item_id"] for item in r.json()["items"]] == [3, 1]
+    assert r.json()["missing"] == [9]
+    assert testclient.get("/items/4").json()["data"]["name"] == "item 4"
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        page = testclient.get("/items", params=params).json()
+        seen.extend(item["item_id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [0, 1, 2, 3, 4]
+
+    assert testclient.get("/items", params={"ids": "1,x"}).status_code == 400
+
+    # Ids beyond SQLite's 64-bit integers are refused, not a server error
+    too_large = 2**63
+    assert testclient.get("/items", params={"ids": str(too_large)}).status_code == 400
+    assert testclient.get(f"/items/{too_large}").status_code == 422
+    assert testclient.get("/items", params={"cursor": too_large}).status_code == 422
+    items[0]["id"] = too_large
+    assert testclient.put("/items", json={"items": items}).status_code == 422
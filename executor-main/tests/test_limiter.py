@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.limiter import ConcurrencyLimiter, DeadlineExceeded, Overloaded
+
+
+def grant_order(limiter, jobs):
+    """
+    Queue jobs [(name, tenant, time_limit, seconds)] behind a held slot, in order.
+    :return: the names in the order the jobs got a slot
+    """
+
+    async def scenario():
+        holder = await limiter.acquire_async()
+        order = []
+
+        async def job(name, tenant, time_limit, seconds):
+            ticket = await limiter.acquire_async(tenant, time_limit)
+            order.append(name)
+            time.sleep(seconds)
+            limiter.release(ticket)
+
+        tasks = []
+        for spec in jobs:
+            tasks.append(asyncio.create_task(job(*spec)))
+            await asyncio.sleep(0)
+        limiter.release(holder)
+        await asyncio.gather(*tasks)
+        return order
+
+    return asyncio.run(scenario())
+
+
+def test_limiter_runs_short_budgets_first_within_a_tenant():
+    limiter = ConcurrencyLimiter(max_in_flight=1, max_queued=8)
+    jobs = [("slow", "a", 50, 0), ("fast", "a", 1, 0), ("medium", "a", 10, 0)]
+    assert grant_order(limiter, jobs) == ["fast", "medium", "slow"]
+
+
+def test_limiter_shares_slots_fairly_between_tenants():
+    limiter = ConcurrencyLimiter(max_in_flight=1, max_queued=8)
+    heavy = [(f"heavy{i}", "heavy", 1, 0.05) for i in range(3)]
+    light = [(f"light{i}", "light", 1, 0) for i in range(3)]
+    order = grant_order(limiter, heavy + light)
+
+    # The tenant that used the sandbox for longer waits for the other one
+    assert order[:2] == ["heavy0", "light0"]
+    assert order.index("light2") < order.index("heavy1")
+
+
+def test_limiter_sheds_jobs_that_miss_their_deadline():
+    limiter = ConcurrencyLimiter(max_in_flight=1, max_queued=8)
+    holder = limiter.acquire()
+
+    with pytest.raises(DeadlineExceeded):
+        limiter.acquire("a", deadline=time.monotonic() + 0.02)
+
+    async def shed():
+        await limiter.acquire_async("a", deadline=time.monotonic() + 0.02)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(shed())
+    assert limiter.queued == 0
+
+    limiter.release(holder)
+    ticket = limiter.acquire("a", deadline=time.monotonic() + 0.02)
+    assert ticket.queue_wait < 0.01
+    limiter.release(ticket)
+    assert limiter.in_flight == 0
+
+
+def test_limiter_rejects_when_the_queue_is_full():
+    limiter = ConcurrencyLimiter(max_in_flight=1, max_queued=1, retry_after=2)
+    holder = limiter.acquire()
+    granted = []
+    waiter = threading.Thread(target=lambda: granted.append(limiter.acquire("a")))
+    waiter.start()
+    while not limiter.queued:
+        time.sleep(0.001)
+
+    with pytest.raises(Overloaded) as e:
+        limiter.acquire("b")
+    assert e.value.retry_after == 2
+
+    limiter.release(holder)
+    waiter.join()
+    assert granted[0].queue_wait > 0
+    limiter.release(granted[0])
+
+
+def test_limiter_holds_the_slot_of_a_cancelled_run_until_the_job_ends():
+    limiter = ConcurrencyLimiter(max_in_flight=2)
+    started, finish = threading.Event(), threading.Event()
+
+    def job():
+        started.set()
+        finish.wait(5)
+        return 1
+
+    async def scenario():
+        task = asyncio.create_task(limiter.run(job))
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The job is still running on the executor thread
+        assert limiter.in_flight == 1
+        finish.set()
+        while limiter.in_flight:
+            await asyncio.sleep(0.001)
+
+    asyncio.run(scenario())
+    assert limiter.in_flight == 0
@@ -78,3 +78,116 @@ def test_evaluate_javascript(testclient: TestClient):
     assert response.status_code == 200, response.text
     assert "output" in response.json()
     assert response.json()["output"] == 3  # Adjust based on your endpoint logic
+
+
+def test_evaluate_rejects_when_overloaded(testclient: TestClient, monkeypatch):
+    from app import main
+    from app.limiter import ConcurrencyLimiter
+
+    limiter = ConcurrencyLimiter(max_in_flight=1, retry_after=3)
+    limiter._in_flight = 1
+    monkeypatch.setattr(main, "evaluation_limiter", limiter)
+
+    data = {"code": "return 1", "language": "python"}
+    response = testclient.post("/evaluate", json=data)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert "error" in response.json()
+
+
+def test_evaluate_sheds_jobs_past_their_deadline(testclient: TestClient, monkeypatch):
+    from app import main
+    from app.limiter import ConcurrencyLimiter
+
+    limiter = ConcurrencyLimiter(max_in_flight=1, max_queued=4)
+    limiter._in_flight = 1
+    monkeypatch.setattr(main, "evaluation_limiter", limiter)
+
+    data = {"code": "return 1", "language": "python", "deadline_ms": 20}
+    response = testclient.post("/evaluate", json=data)
+
+    assert response.status_code == 503
+    assert "deadline" in response.json()["error"]
+    assert limiter.queued == 0
+
+
+def test_evaluate_validates_time_limit(testclient: TestClient):
+    for time_limit in (0, "fast", True):
+        data = {"code": "return 1", "language": "python", "time_limit": time_limit}
+        response = testclient.post("/evaluate", json=data)
+        assert response.status_code == 400
+        assert "time_limit" in response.json()["error"]
+
+
+def test_tenant_header_is_only_trusted_when_configured(monkeypatch):
+    from types import SimpleNamespace
+
+    from app import main
+
+    request = SimpleNamespace(headers={"X-Tenant-ID": "interactive"})
+    assert main.scheduling(request, {})[0] is None
+
+    monkeypatch.setattr(main, "trust_tenant_header", True)
+    assert main.scheduling(request, {})[0] == "interactive"
+
+
+def test_evaluate_validates_modules(testclient: TestClient):
+    for modules in ("numpy", ["--index-url=http://evil"], ["git+https://x/y.git"]):
+        data = {"code": "return 1", "language": "python", "modules": modules}
+        response = testclient.post("/evaluate", json=data)
+        assert response.status_code == 400
+        assert "module" in response.json()["error"].lower()
+
+
+def test_evaluate_batch_requires_items(testclient: TestClient):
+    data = {"code": "return x", "scopes": [], "language": "python"}
+    response = testclient.post("/evaluate/batch", json=data)
+
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_evaluate_serves_cached_results(testclient: TestClient, monkeypatch):
+    from app import main
+    from app.result_cache import MemoryBackend, ResultCache
+
+    cache = ResultCache(MemoryBackend())
+    monkeypatch.setattr(main, "result_cache", cache)
+    data = {"code": "return x * x", "scope": {"x": 2}, "language": "python"}
+    cache.set(
+        cache.key("python", "3.8", [], data["code"], data["scope"]),
+        {"output": 4, "stdout": ""},
+    )
+
+    response = testclient.post("/evaluate", json=data)
+    assert response.status_code == 200
+    assert response.headers["X-Cache"] == "HIT"
+    assert response.json()["output"] == 4
+
+    response = testclient.post("/evaluate", json={**data, "cache": False})
+    assert response.headers.get("X-Cache") != "HIT"
+
+
+def test_evaluate_rejects_syntax_errors_before_sandbox(testclient: TestClient):
+    data = {"code": "x = 1\nreturnn x", "language": "python"}
+    response = testclient.post("/evaluate", json=data)
+
+    assert response.status_code == 400
+    assert response.json()["syntax_error"]["line"] == 2
+
+
+def test_stream_releases_its_slot_when_the_response_is_dropped(monkeypatch):
+    from app import main
+    from app.limiter import ConcurrencyLimiter
+
+    limiter = ConcurrencyLimiter(max_in_flight=1)
+    monkeypatch.setattr(main, "evaluation_limiter", limiter)
+    ticket = limiter.acquire()
+    stream = main.stream_evaluation("python", "return 1", {}, None, 5, ticket)
+
+    # The handler takes the first item before returning the response; a response
+    # that is never sent leaves the generator to be closed, not to be started
+    assert next(stream).startswith(":")
+    del stream
+    assert limiter.in_flight == 0
@@ -0,0 +1,76 @@
+from starlette.testclient import TestClient
+
+from app.metrics import Counter, Gauge, Histogram, Registry
+from app.PythonSafeEval import timing
+
+
+def test_registry_renders_text_exposition_format():
+    registry = Registry()
+    counter = registry.register(Counter("jobs_total", "Jobs.", ["outcome"]))
+    histogram = registry.register(
+        Histogram("job_seconds", "Job time.", ["outcome"], buckets=(0.1, 1))
+    )
+    registry.register(Gauge("in_flight", "In flight.", collect=lambda: [((), 2)]))
+    counter.inc("ok")
+    counter.inc("ok")
+    histogram.observe(0.5, "ok")
+    histogram.observe(5, "ok")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE jobs_total counter" in lines
+    assert 'jobs_total{outcome="ok"} 2' in lines
+    assert 'job_seconds_bucket{outcome="ok",le="0.1"} 0' in lines
+    assert 'job_seconds_bucket{outcome="ok",le="1"} 1' in lines
+    assert 'job_seconds_bucket{outcome="ok",le="+Inf"} 2' in lines
+    assert 'job_seconds_count{outcome="ok"} 2' in lines
+    assert 'job_seconds_sum{outcome="ok"} 5.5' in lines
+    assert "in_flight 2" in lines
+
+
+def test_phases_are_recorded_per_context():
+    with timing.record() as phases:
+        with timing.phase("exec", "python", "3.8"):
+            pass
+    with timing.phase("exec"):
+        pass
+
+    assert list(phases) == ["exec"]
+    assert timing.server_timing({"exec": 0.0123}) == "exec;dur=12.3"
+
+
+def test_evaluate_reports_server_timing_and_metrics(testclient: TestClient):
+    data = {"code": "returnn 1", "language": "python"}
+    response = testclient.post("/evaluate", json=data)
+    assert "total;dur=" in response.headers["Server-Timing"]
+
+    metrics = testclient.get("/metrics")
+    assert metrics.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert (
+        'safe_eval_requests_total{endpoint="/evaluate",language="python",'
+        'version="3.8",outcome="error"}'
+    ) in metrics.text
+    assert "safe_eval_in_flight 0" in metrics.text
+
+
+def test_server_timing_includes_phases_run_on_the_sandbox_pool(
+    testclient: TestClient, monkeypatch
+):
+    from app import main
+
+    def run_evaluation(
+        language, code, scope, max_output_bytes, typed_arrays, time_limit, modules
+    ):
+        with timing.phase("exec", language, "3.8"):
+            result = {"stdout": "", "stderr": "", "returncode": 0}
+        return {**result, "result": b'{"returnValue": 1}'}, "marker"
+
+    monkeypatch.setattr(main, "run_evaluation", run_evaluation)
+    response = testclient.post(
+        "/evaluate", json={"code": "return 1", "language": "python"}
+    )
+
+    assert response.json()["output"] == 1
+    assert response.json()["queue_wait_ms"] >= 0
+    assert "queue;dur=" in response.headers["Server-Timing"]
+    assert "exec;dur=" in response.headers["Server-Timing"]
+    assert "parse;dur=" in response.headers["Server-Timing"]
@@ -0,0 +1,48 @@
+import sys
+
+from app import helpers
+from app.PythonSafeEval import output
+from app.PythonSafeEval.output import BoundedOutput
+from app.PythonSafeEval.safe_eval import SafeEvalPython
+
+
+def test_bounded_output_keeps_head_and_tail(tmp_path, monkeypatch):
+    monkeypatch.setattr(output, "SPILL_DIR", tmp_path)
+    bounded = BoundedOutput(10)
+    for chunk in ["abcde", "fghij", "klmno", "pqrst"]:
+        bounded.write(chunk)
+
+    assert bounded.getvalue() == "abcde\n... [10 bytes truncated] ...\npqrst"
+    metadata = bounded.metadata()
+    assert metadata["truncated"]
+    assert metadata["total_bytes"] == 20
+    spilled = output.spilled_output_path(metadata["output_id"])
+    assert spilled.read_text() == "abcdefghijklmnopqrst"
+
+
+def test_bounded_output_under_cap_does_not_spill(tmp_path, monkeypatch):
+    monkeypatch.setattr(output, "SPILL_DIR", tmp_path)
+    bounded = BoundedOutput(10)
+    bounded.write("short")
+
+    assert bounded.getvalue() == "short"
+    assert not bounded.truncated
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spilled_output_path_rejects_invalid_ids():
+    assert output.spilled_output_path("../../etc/passwd") is None
+
+
+def test_eval_truncates_output_but_keeps_return_value(
+    local_evaluator, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(output, "SPILL_DIR", tmp_path)
+    evaluator = local_evaluator(SafeEvalPython, sys.executable)
+    result, h = evaluator.eval(
+        "print('x' * 5000)\nreturn 42", scope={}, max_output_bytes=100
+    )
+
+    assert result["truncation"]["stdout"]["total_bytes"] >= 5001
+    assert len(result["stdout"]) < 200
+    assert helpers.extract_return_value(result, h) == 42
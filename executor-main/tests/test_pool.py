@@ -0,0 +1,69 @@
+import pytest
+
+from app.PythonSafeEval.pool import PoolExhausted, SandboxPool
+
+
+class FakeEvaluator:
+    default_version = "1"
+
+    def __init__(self, version=None, modules=None, tmp_dir=None):
+        self.version = version
+        self.modules = modules
+        self.healthy = True
+        self.scrubbed = 0
+        self.closed = False
+
+    def is_healthy(self):
+        return self.healthy
+
+    def scrub_volume(self):
+        self.scrubbed += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(SandboxPool):
+    evaluator_classes = {"fake": FakeEvaluator}
+
+
+def test_pool_reuses_released_sandbox():
+    pool = FakePool(max_size=2)
+    first = pool.checkout("fake", modules=["b", "a"])
+    pool.release(first)
+    second = pool.checkout("fake", modules=["a", "b"])
+    assert second is first
+    assert first.scrubbed == 1
+
+
+def test_pool_respects_max_size():
+    pool = FakePool(max_size=1)
+    pool.checkout("fake")
+    with pytest.raises(PoolExhausted):
+        pool.checkout("fake", timeout=0.01)
+
+
+def test_pool_discards_unhealthy_and_failed_sandboxes():
+    pool = FakePool(max_size=1, health_check_interval=0)
+    evaluator = pool.checkout("fake")
+    pool.release(evaluator)
+    evaluator.healthy = False
+    replacement = pool.checkout("fake")
+    assert replacement is not evaluator and evaluator.closed
+    pool.release(replacement)
+
+    with pytest.raises(RuntimeError):
+        with pool.sandbox("fake"):
+            raise RuntimeError("boom")
+    assert replacement.closed
+    assert pool.stats()[("fake", "1", ())]["size"] == 0
+
+
+def test_pool_evicts_idle_above_min_size():
+    pool = FakePool(min_size=1, max_size=3, idle_timeout=0)
+    evaluators = [pool.checkout("fake") for _ in range(3)]
+    for evaluator in evaluators:
+        pool.release(evaluator)
+    pool.evict_idle()
+    assert pool.stats()[("fake", "1", ())] == {"size": 1, "idle": 1, "waiting": 0}
+    assert sum(evaluator.closed for evaluator in evaluators) == 2
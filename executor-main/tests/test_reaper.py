@@ -0,0 +1,80 @@
+import os
+import shutil
+import subprocess
+
+from app.PythonSafeEval.backends import DockerBackend
+from app.PythonSafeEval.reaper import Reaper, sweep_orphans
+from app.PythonSafeEval.safe_eval import SafeEvalPython
+
+
+def fake_docker(monkeypatch, outputs=None):
+    calls = []
+
+    def fake_run(cmd, **kwargs):
+        calls.append(cmd)
+        stdout = (outputs or {}).get(tuple(cmd[:3]), "")
+        return subprocess.CompletedProcess(cmd, 0, stdout=stdout.encode("utf-8"))
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    monkeypatch.setattr(shutil, "which", lambda name: "/usr/bin/" + name)
+    return calls
+
+
+def test_reaper_batches_container_removal(tmp_path, monkeypatch):
+    calls = fake_docker(monkeypatch)
+    sessions = [tmp_path / name for name in ("a", "b", "c")]
+    for session in sessions:
+        session.mkdir()
+
+    container_reaper = Reaper(batch_interval=0.2)
+    for name, session in zip(("a", "b", "c"), sessions):
+        container_reaper.submit(name, session)
+    assert container_reaper.flush(timeout=5)
+
+    assert calls == [["docker", "rm", "-f", "a", "b", "c"]]
+    assert not any(session.exists() for session in sessions)
+
+
+def test_close_hands_teardown_to_the_reaper(tmp_path, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(
+        SafeEvalPython.reaper, "submit", lambda *args: submitted.append(args)
+    )
+    evaluator = object.__new__(SafeEvalPython)
+    evaluator._module_path = tmp_path
+    evaluator._session_id = "safe_eval_python_test"
+    evaluator._session_path = tmp_path
+    evaluator._backend = DockerBackend(evaluator)
+    evaluator._backend._container_has_started = True
+
+    with evaluator:
+        pass
+    evaluator.close()
+
+    assert submitted == [("safe_eval_python_test", tmp_path)]
+
+
+def test_sweep_removes_orphans_of_dead_processes(tmp_path, monkeypatch):
+    dead_pid = 2**22 + 1
+    calls = fake_docker(
+        monkeypatch,
+        {
+            ("docker", "ps", "-a"): (
+                f"safe_eval_python_dead {dead_pid}\n"
+                f"safe_eval_python_live {os.getpid()}\n"
+            ),
+            ("docker", "images", "--format"): (
+                "safe_eval_cache:abc\nsafe_eval_pythonold:latest\nubuntu:18.04\n"
+            ),
+        },
+    )
+    for name in ("safe_eval_python_live", "safe_eval_python_gone"):
+        (tmp_path / name).mkdir()
+        os.utime(tmp_path / name, (0, 0))
+
+    removed = sweep_orphans(tmp_path, "safe_eval_cache")
+
+    assert removed["containers"] == ["safe_eval_python_dead"]
+    assert removed["images"] == ["safe_eval_pythonold:latest"]
+    assert removed["sessions"] == ["safe_eval_python_gone"]
+    assert ["docker", "rm", "-f", "safe_eval_python_dead"] in calls
@@ -0,0 +1,43 @@
+import time
+
+from app.result_cache import MemoryBackend, ResultCache, SQLiteBackend
+
+
+def test_key_normalizes_payload():
+    cache = ResultCache(MemoryBackend())
+    key = cache.key("python", "3.8", ["b", "a"], "return x", {"x": 1, "y": 2})
+    assert key == cache.key("python", "3.8", ["a", "b"], "return x", {"y": 2, "x": 1})
+    assert key != cache.key("python", "3.8", ["a", "b"], "return x", {"y": 2, "x": 2})
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_bytes=10)
+    backend.set("a", "1234", ttl=60)
+    backend.set("b", "1234", ttl=60)
+    backend.get("a")
+    backend.set("c", "1234", ttl=60)
+    assert backend.get("a") == "1234"
+    assert backend.get("b") is None
+    assert backend.get("c") == "1234"
+
+
+def test_memory_backend_expires_entries():
+    backend = MemoryBackend()
+    backend.set("a", "1", ttl=-1)
+    assert backend.get("a") is None
+
+
+def test_sqlite_backend_is_shared_and_bounded(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResultCache(SQLiteBackend(path, max_bytes=30))
+    cache.set("a", {"output": 1})
+    time.sleep(0.01)
+    cache.set("b", {"output": 2})
+
+    # A second connection, like another worker, sees the same entries
+    other = ResultCache(SQLiteBackend(path, max_bytes=30))
+    assert other.get("a") == {"output": 1}
+    time.sleep(0.01)
+    other.set("c", {"output": 3})
+    assert other.get("b") is None
+    assert other.get("a") == {"output": 1}
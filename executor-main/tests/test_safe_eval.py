@@ -0,0 +1,23 @@
+import sys
+
+from app.PythonSafeEval.safe_eval import ReturnValueFilter, SafeEvalPython
+
+
+def test_return_value_filter_handles_split_marker():
+    return_filter = ReturnValueFilter("marker")
+    out = return_filter.feed("hello\nmar")
+    out += return_filter.feed('ker{"returnValue": [1, "}"]}\n')
+    out += return_filter.finish()
+
+    assert out == "hello\n"
+    assert return_filter.has_return_value
+    assert return_filter.return_value == [1, "}"]
+
+
+def test_eval_stream_yields_output_then_result(local_evaluator):
+    evaluator = local_evaluator(SafeEvalPython, sys.executable)
+    frames = list(evaluator.eval_stream("print('a')\nreturn x + 1", scope={"x": 1}))
+
+    stdout = "".join(f["data"] for f in frames if f.get("stream") == "stdout")
+    assert stdout == "a\n"
+    assert frames[-1] == {"returncode": 0, "returnValue": 2}
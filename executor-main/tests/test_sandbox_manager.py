@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+
+from app.limiter import Overloaded
+from app.PythonSafeEval.pool import SandboxPool
+from app.PythonSafeEval.scope_transfer import ScopeError
+from app.sandbox_manager import ManagerError, RemoteSandboxPool, SandboxManager
+from benchmarks.fake_backend import fake_evaluator_classes
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """
+    Start a manager on a pool of host-run evaluators and return a client pool.
+    """
+    servers = []
+
+    def start(max_in_flight=4, mode="subprocess"):
+        pool_class = type(
+            "FakeSandboxPool",
+            (SandboxPool,),
+            {"evaluator_classes": fake_evaluator_classes(mode)},
+        )
+        pool = pool_class(max_size=max_in_flight, tmp_dir=tmp_path)
+        server = SandboxManager(
+            tmp_path / "manager.sock", pool, max_in_flight=max_in_flight
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return RemoteSandboxPool(server.socket_path, timeout=30), server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+        server.pool.close()
+
+
+def test_manager_runs_evaluations_for_workers(manager):
+    remote, server = manager()
+    with remote.sandbox("python") as evaluator:
+        result, hashed_s = evaluator.eval(
+            code="print('hi')\nreturn x + 1", scope={"x": 1}
+        )
+    assert result["returncode"] == 0
+    assert result["stdout"] == "hi\n"
+    assert result["result"] == b'{"returnValue": 2}'
+    assert hashed_s
+
+    # The sandbox went back to the manager's pool and is shared by the next call
+    with remote.sandbox("python") as evaluator:
+        evaluator.eval(code="return 1", scope={})
+    version = SandboxPool.evaluator_classes["python"].default_version
+    assert remote.stats()[("python", version, ())]["size"] == 1
+
+
+def test_manager_streams_and_batches(manager):
+    remote, _ = manager()
+    with remote.sandbox("python") as evaluator:
+        frames = list(evaluator.eval_stream("print('a')\nreturn 2"))
+        result, _ = evaluator.eval_batch([("return x", {"x": 1}), ("return 2", {})])
+    assert frames[0] == {"stream": "stdout", "data": "a\n"}
+    assert frames[-1] == {"returncode": 0, "returnValue": 2}
+    assert result["returncode"] == 0 and len(result["result"].splitlines()) == 2
+
+
+def test_manager_reports_scope_errors(manager):
+    remote, _ = manager()
+    with remote.sandbox("python") as evaluator:
+        with pytest.raises(ScopeError):
+            evaluator.eval(
+                code="return x", scope={"x": [[1], [1, 2]]}, typed_arrays={"x": "int8"}
+            )
+
+
+def test_manager_caps_evaluations_for_the_whole_host(manager):
+    remote, server = manager(max_in_flight=1, mode="inprocess")
+    ticket = server.limiter.acquire()
+    with remote.sandbox("python") as evaluator:
+        with pytest.raises(Overloaded):
+            evaluator.eval(code="return 1", scope={})
+    server.limiter.release(ticket)
+    with remote.sandbox("python") as evaluator:
+        result, _ = evaluator.eval(code="return 1", scope={})
+    assert result["returncode"] == 0
+
+
+def test_remote_pool_without_manager(tmp_path):
+    remote = RemoteSandboxPool(tmp_path / "missing.sock")
+    with remote.sandbox("python") as evaluator:
+        with pytest.raises(ManagerError):
+            evaluator.eval(code="return 1", scope={})
+    with pytest.raises(ValueError):
+        with remote.sandbox("cobol"):
+            pass
@@ -0,0 +1,124 @@
+import shutil
+
+import pytest
+
+from app import helpers
+from app.PythonSafeEval.backends import HostBackend
+from app.PythonSafeEval.safe_eval import SafeEvalJavaScript, SafeEvalPython
+from app.PythonSafeEval.scope_transfer import (
+    ScopeError,
+    ScopeTransfer,
+    check_typed_arrays,
+    write_npy,
+)
+
+
+class PlainHostBackend(HostBackend):
+    nsjail = None
+    unsafe = True
+
+
+def host_evaluator(cls, tmp_path, monkeypatch, threshold=0):
+    monkeypatch.setattr(cls, "scope_file_threshold", threshold)
+    return cls(tmp_dir=tmp_path, backend=PlainHostBackend)
+
+
+def test_write_npy_pads_the_header_and_checks_the_shape(tmp_path):
+    path = tmp_path / "a.npy"
+    assert write_npy(path, [[1, 2, 3], [4, 5, 6]], "int32") == [2, 3]
+    data = path.read_bytes()
+    header_end = 10 + int.from_bytes(data[8:10], "little")
+    assert header_end % 64 == 0
+    assert b"'shape': (2, 3, )" in data[:header_end]
+    assert len(data) - header_end == 6 * 4
+
+    with pytest.raises(ScopeError):
+        write_npy(path, [[1, 2], [3]], "int32")
+    with pytest.raises(ScopeError):
+        write_npy(path, [1.5], "int8")
+
+
+def test_check_typed_arrays():
+    assert check_typed_arrays({"a": [1]}, {"a": "float64"}) is None
+    assert "dtype" in check_typed_arrays({"a": [1]}, {"a": "complex"})
+    assert "list" in check_typed_arrays({"a": 1}, {"a": "float64"})
+    assert "rectangular" in check_typed_arrays({"a": [[1], [2, 3]]}, {"a": "int8"})
+    assert "fit" in check_typed_arrays({"a": [1.5]}, {"a": "int8"})
+
+
+def test_small_scopes_stay_inline(tmp_path):
+    with ScopeTransfer({"x": 1}, host_dir=tmp_path, threshold=100) as transfer:
+        assert transfer.inline == {"x": 1}
+        assert transfer.json_file is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_python_reads_large_scopes_from_a_side_file(tmp_path, monkeypatch):
+    with host_evaluator(SafeEvalPython, tmp_path, monkeypatch) as evaluator:
+        scope = {"values": list(range(1000)), "name": "x"}
+        with evaluator._scope_transfer(scope) as transfer:
+            wrapped = evaluator._wrap_code("return 1", scope, transfer)
+        assert "999" not in wrapped
+
+        result, h = evaluator.eval("return [sum(values), name]", scope=scope)
+        assert result["returncode"] == 0, result["stderr"]
+        assert helpers.extract_return_value(result, h) == [499500, "x"]
+
+        # The loader binds no names of its own next to the scope variables
+        scope = {"scope_file": 1, "f": 2}
+        result, h = evaluator.eval("return sorted(locals())", scope=scope)
+        names = helpers.extract_return_value(result, h)
+        assert names == ["f", "scope_file", "user_code"]
+        assert not list(evaluator._session_path.glob(".scope-*"))
+
+
+def test_python_maps_typed_arrays(tmp_path, monkeypatch):
+    with host_evaluator(SafeEvalPython, tmp_path, monkeypatch) as evaluator:
+        result, h = evaluator.eval(
+            "return [matrix[1, 2], list(matrix.shape), x]",
+            scope={"matrix": [[1, 2, 3], [4, 5, 6]], "x": 1},
+            typed_arrays={"matrix": "float64"},
+        )
+
+    assert result["returncode"] == 0, result["stderr"]
+    assert helpers.extract_return_value(result, h) == [6.0, [2, 3], 1]
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_javascript_reads_side_files_and_typed_arrays(tmp_path, monkeypatch):
+    with host_evaluator(SafeEvalJavaScript, tmp_path, monkeypatch) as evaluator:
+        result, h = evaluator.eval(
+            "return [values.length, matrix.constructor.name, matrix[5], matrix.shape];",
+            scope={"values": list(range(100)), "matrix": [[1, 2, 3], [4, 5, 6]]},
+            typed_arrays={"matrix": "int16"},
+        )
+
+    assert result["returncode"] == 0, result["stderr"]
+    assert helpers.extract_return_value(result, h) == [100, "Int16Array", 6, [2, 3]]
+
+
+def test_evaluate_rejects_unknown_dtypes(testclient):
+    response = testclient.post(
+        "/evaluate",
+        json={
+            "language": "python",
+            "code": "return 1",
+            "scope": {"a": [1]},
+            "typed_arrays": {"a": "complex"},
+        },
+    )
+
+    assert response.status_code == 400
+    assert "dtype" in response.json()["error"]
+
+    response = testclient.post(
+        "/evaluate/stream",
+        json={
+            "language": "python",
+            "code": "return 1",
+            "scope": {"a": [[1, 2], [3]]},
+            "typed_arrays": {"a": "int32"},
+        },
+    )
+    assert response.status_code == 400
+    assert "rectangular" in response.json()["error"]
@@ -0,0 +1,218 @@
+import json
+import threading
+import time
+
+import pytest
+from starlette.testclient import TestClient
+
+from app.PythonSafeEval import session as session_module
+from app.PythonSafeEval import session_runner
+from app.PythonSafeEval.backends import HostBackend
+from app.PythonSafeEval.pool import SandboxPool
+from app.PythonSafeEval.session import (
+    SessionBusy,
+    SessionLost,
+    SessionManager,
+    SessionNotFound,
+    SessionsExhausted,
+)
+from app.sandbox_manager import RemoteSandboxPool, RemoteSessionManager, SandboxManager
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    """
+    Build session managers whose interpreters run on the host backend.
+    """
+    monkeypatch.setattr(HostBackend, "unsafe", True)
+    managers = []
+
+    def build(**kwargs):
+        manager = SessionManager(tmp_dir=tmp_path, backend="host", **kwargs)
+        managers.append(manager)
+        return manager
+
+    yield build
+    for manager in managers:
+        manager.close_all()
+
+
+def test_session_keeps_globals_between_calls(sessions):
+    manager = sessions()
+    session_id = manager.create()
+    reply = manager.evaluate(session_id, "import math\nx = 21\nprint('hi')\nx * 2")
+    assert reply == {"returnValue": 42, "stdout": "hi\n", "stderr": ""}
+
+    reply = manager.evaluate(session_id, "math.sqrt(x + y)", scope={"y": 4})
+    assert reply["returnValue"] == 5
+
+    # A failing cell, a cell over its time limit and stray writes to fd 1 do not
+    # cost the session its state
+    reply = manager.evaluate(session_id, "def f():\n    return 1 / 0\nf()")
+    assert reply["error"] == "division by zero"
+    assert reply["stderr"].startswith("Traceback")
+    assert "session_runner" not in reply["stderr"]
+    reply = manager.evaluate(session_id, "while True:\n    pass", time_limit=1)
+    assert reply["error"] == "Time limit exceeded."
+    reply = manager.evaluate(session_id, "import os\nos.write(1, b'junk')\nx")
+    assert reply["returnValue"] == 21
+    reply = manager.evaluate(session_id, "object()")
+    assert "not JSON serializable" in reply["error"]
+    with pytest.raises(ValueError, match="scope"):
+        manager.evaluate(session_id, "x", scope=[1])
+
+    # The runner itself fails the cell, not the session, on a scope that is no dict
+    namespace = {"x": 1}
+    reply = session_runner.handle(namespace, {"code": "x", "scope": [1]}, "<cell>")
+    assert "error" in json.loads(reply)
+    assert namespace == {"x": 1}
+
+    manager.close(session_id)
+    with pytest.raises(SessionNotFound):
+        manager.evaluate(session_id, "x")
+
+
+def resident_memory():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+
+
+def test_output_outside_cells_does_not_pile_up_in_the_host(sessions):
+    manager = sessions()
+    session_id = manager.create()
+    before = resident_memory()
+    code = "import os\nfor _ in range(1024):\n    os.write(1, b'x' * 65536)\n1"
+    assert manager.evaluate(session_id, code)["returnValue"] == 1
+    # 64 MB went to fd 1
+    assert resident_memory() - before < 16 * 1024**2
+
+
+def test_session_budgets(sessions):
+    manager = sessions(memory_limit=256 * 1024**2, cpu_limit=1)
+    session_id = manager.create()
+
+    # Allocations over the memory limit fail inside the cell
+    reply = manager.evaluate(session_id, "x = 1\nblob = bytearray(512 * 1024**2)")
+    assert reply["error"] == "MemoryError"
+    assert manager.evaluate(session_id, "x")["returnValue"] == 1
+
+    # Running out of CPU seconds ends the session
+    with pytest.raises(SessionLost, match="budget"):
+        manager.evaluate(session_id, "while True:\n    pass", time_limit=10)
+    with pytest.raises(SessionLost):
+        manager.evaluate(session_id, "x")
+    assert manager.stats()["sessions"] == 0
+
+
+def test_session_runs_one_cell_at_a_time(sessions):
+    manager = sessions()
+    session_id = manager.create()
+    runner = threading.Thread(
+        target=manager.evaluate, args=(session_id, "import time\ntime.sleep(0.5)")
+    )
+    runner.start()
+    time.sleep(0.2)
+    with pytest.raises(SessionBusy):
+        manager.evaluate(session_id, "1")
+    runner.join()
+    assert manager.evaluate(session_id, "1")["returnValue"] == 1
+
+
+def test_sessions_are_evicted_least_recently_used_first(sessions, monkeypatch):
+    manager = sessions(max_sessions=2)
+    first, second = manager.create(), manager.create()
+    manager.evaluate(first, "1")
+    third = manager.create()
+    with pytest.raises(SessionLost, match="make room"):
+        manager.evaluate(second, "1")
+    assert manager.evaluate(first, "1")["returnValue"] == 1
+
+    # Low host memory evicts idle sessions until there is none left
+    monkeypatch.setattr(session_module, "available_memory", lambda: 0)
+    assert sorted(manager.collect()) == sorted([first, third])
+    with pytest.raises(SessionLost, match="low on memory"):
+        manager.evaluate(third, "1")
+
+
+def test_tenants_only_evict_their_own_sessions(sessions):
+    manager = sessions(max_sessions=3, max_sessions_per_tenant=2)
+    a1, a2 = manager.create(tenant="a"), manager.create(tenant="a")
+    b1 = manager.create(tenant="b")
+
+    # Tenant a is at its cap and makes room among its own sessions
+    a3 = manager.create(tenant="a")
+    with pytest.raises(SessionLost, match="make room"):
+        manager.evaluate(a1, "1")
+    # Every slot is taken, and b's sessions are not a's to evict
+    manager.close(b1)
+    b2 = manager.create(tenant="b")
+    busy = threading.Thread(
+        target=manager.evaluate, args=(b2, "import time\ntime.sleep(0.5)")
+    )
+    busy.start()
+    time.sleep(0.2)
+    with pytest.raises(SessionsExhausted):
+        manager.create(tenant="b")
+    busy.join()
+    assert {manager.evaluate(s, "1")["returnValue"] for s in (a2, a3, b2)} == {1}
+
+
+def test_idle_sessions_are_closed(sessions):
+    manager = sessions(idle_timeout=0.1)
+    session_id = manager.create()
+    time.sleep(0.2)
+    assert manager.collect() == [session_id]
+    with pytest.raises(SessionLost, match="idle"):
+        manager.evaluate(session_id, "1")
+
+
+def test_sessions_live_in_the_sandbox_manager(sessions, tmp_path):
+    server = SandboxManager(
+        tmp_path / "manager.sock", SandboxPool(tmp_dir=tmp_path), sessions=sessions()
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        remote = RemoteSessionManager(RemoteSandboxPool(server.socket_path))
+        session_id = remote.create()
+        remote.evaluate(session_id, "x = 2")
+        assert remote.evaluate(session_id, "x + 1")["returnValue"] == 3
+        assert remote.stats()["sessions"] == 1
+        remote.close(session_id)
+        with pytest.raises(SessionNotFound):
+            remote.evaluate(session_id, "x")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_session_endpoints(testclient: TestClient, sessions, monkeypatch):
+    from app import main
+
+    monkeypatch.setattr(main, "session_manager", sessions())
+    response = testclient.post("/sessions", json={})
+    assert response.status_code == 201
+    session_id = response.json()["session_id"]
+
+    url = f"/sessions/{session_id}/evaluate"
+    response = testclient.post(url, json={"code": "data = [1, 2, 3]"})
+    assert response.status_code == 200
+    assert response.json()["output"] is None
+    response = testclient.post(
+        url, json={"code": "print(len(data))\nsum(data) * k", "scope": {"k": 2}}
+    )
+    assert response.json()["output"] == 12
+    assert response.json()["stdout"] == "3\n"
+    response = testclient.post(url, json={"code": "undefined_name"})
+    assert response.status_code == 400
+    assert "undefined_name" in response.json()["error"]
+    response = testclient.post(url, json={"code": "data", "scope": [1]})
+    assert response.status_code == 400
+    assert testclient.post(url, json={"code": "data"}).json()["output"] == [1, 2, 3]
+
+    assert testclient.delete(f"/sessions/{session_id}").status_code == 204
+    assert testclient.post(url, json={"code": "data"}).status_code == 404
+    assert testclient.delete(f"/sessions/{session_id}").status_code == 404
+    response = testclient.post("/sessions", json={"language": "javascript"})
+    assert response.status_code == 400
@@ -0,0 +1,49 @@
+import shutil
+
+import pytest
+
+from app.PythonSafeEval import syntax_check
+from app.PythonSafeEval.safe_eval import SafeEvalJavaScript, SafeEvalPython
+
+
+def test_python_check_reports_location_in_submitted_code():
+    error = SafeEvalPython.check_syntax("x = 1\nif x\n    return 2")
+
+    assert error["line"] == 2
+    assert error["column"] == 5
+    assert SafeEvalPython.check_syntax("return 1") is None
+
+
+def test_python_check_is_cached(monkeypatch):
+    code = "returnn 1 + 2"
+    first = syntax_check.check_python(code)
+    monkeypatch.setattr(syntax_check, "compile", None, raising=False)
+
+    assert syntax_check.check_python(code) is first
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_javascript_check_reports_location_in_submitted_code():
+    error = SafeEvalJavaScript.check_syntax("let a = 1;\nlet b = (;")
+
+    assert error["line"] == 2
+    assert error["column"] == 10
+    assert SafeEvalJavaScript.check_syntax("return 1 + 1;") is None
+
+
+def test_eval_rejects_syntax_errors_without_running(local_evaluator):
+    evaluator = local_evaluator(SafeEvalPython, "false")
+    result, _ = evaluator.eval("returnn 1")
+
+    assert result["returncode"] == 1
+    assert result["stderr"].startswith("SyntaxError:")
+    assert result["syntax_error"]["line"] == 1
+
+
+def test_python_check_rejects_code_it_cannot_parse(monkeypatch):
+    error = syntax_check.check_python("-" * 1000000 + "1")
+    assert error is not None and error["line"] is None
+
+    monkeypatch.setattr(syntax_check, "max_code_length", 10)
+    error = syntax_check.check_python("return 1 + 2 + 3")
+    assert "longer than 10" in error["message"]